@@ -0,0 +1,307 @@
+// Draws plot data returned by the server with output: "data" (see server/plot_data.py)
+// as SVG, instead of a PNG rendered on the server
+
+const width = 640;
+const height = 480;
+const margin = { top: 40, right: 20, bottom: 50, left: 60 };
+const palette = ["#a1c9f4", "#ffb482", "#8de5a1", "#ff9f9b", "#d0bbff", "#debb9b", "#fab0e4", "#cfcfcf"];
+const lineColor = "#2c4a32";
+
+function getScale(domain, range) {
+    const [d0, d1] = domain[0] === domain[1] ? [domain[0] - 1, domain[1] + 1] : domain;
+    return (value) => range[0] + ((value - d0) / (d1 - d0)) * (range[1] - range[0]);
+}
+
+function getExtent(values) {
+    let min = Infinity;
+    let max = -Infinity;
+    for (const value of values) {
+        if (value < min) min = value;
+        if (value > max) max = value;
+    }
+    return [min, max];
+}
+
+function getTicks([min, max], count = 5) {
+    if (!isFinite(min) || !isFinite(max) || min === max) return [min];
+    const rawStep = (max - min) / count;
+    const power = Math.pow(10, Math.floor(Math.log10(rawStep)));
+    const step = [1, 2, 5, 10].map((m) => m * power).find((s) => s >= rawStep);
+    const ticks = [];
+    for (let tick = Math.ceil(min / step) * step; tick <= max + step * 1e-9; tick += step) {
+        ticks.push(Number(tick.toPrecision(12)));
+    }
+    return ticks;
+}
+
+function polyline(points) {
+    return points.map(([x, y]) => `${x.toFixed(1)},${y.toFixed(1)}`).join(" ");
+}
+
+function Axes({ x, y, xDomain, yDomain, labels, xCategories = null }) {
+    const bottom = height - margin.bottom;
+    const xTicks = xCategories
+        ? xCategories.map((name, i) => [i, name])
+        : getTicks(xDomain).map((t) => [t, t]);
+    return (
+        <g fontSize="11" fill={lineColor}>
+            <line x1={margin.left} y1={bottom} x2={width - margin.right} y2={bottom} stroke={lineColor} />
+            <line x1={margin.left} y1={margin.top} x2={margin.left} y2={bottom} stroke={lineColor} />
+            {xTicks.map(([value, label]) => (
+                <g key={`x${value}`}>
+                    <line x1={x(value)} y1={bottom} x2={x(value)} y2={bottom + 4} stroke={lineColor} />
+                    <text x={x(value)} y={bottom + 16} textAnchor="middle">{label}</text>
+                </g>
+            ))}
+            {getTicks(yDomain).map((value) => (
+                <g key={`y${value}`}>
+                    <line x1={margin.left - 4} y1={y(value)} x2={margin.left} y2={y(value)} stroke={lineColor} />
+                    <text x={margin.left - 6} y={y(value) + 4} textAnchor="end">{value}</text>
+                </g>
+            ))}
+            <text x={width / 2} y={margin.top / 2} textAnchor="middle" fontSize="14">{labels.title}</text>
+            <text x={(margin.left + width - margin.right) / 2} y={height - 10} textAnchor="middle">
+                {labels.xlabel}
+            </text>
+            <text
+                transform={`translate(14, ${(margin.top + bottom) / 2}) rotate(-90)`}
+                textAnchor="middle"
+            >
+                {labels.ylabel}
+            </text>
+        </g>
+    );
+}
+
+const xRange = [margin.left, width - margin.right];
+const yRange = [height - margin.bottom, margin.top];
+
+function Hist({ data }) {
+    const { edges, counts, kde } = data;
+    const xDomain = [edges[0], edges[edges.length - 1]];
+    const yDomain = [0, Math.max(...counts, ...(kde ? kde.y : []))];
+    const x = getScale(xDomain, xRange);
+    const y = getScale(yDomain, yRange);
+    return (
+        <>
+            {counts.map((count, i) => (
+                <rect
+                    key={i}
+                    x={x(edges[i])}
+                    y={y(count)}
+                    width={x(edges[i + 1]) - x(edges[i])}
+                    height={y(0) - y(count)}
+                    fill={palette[0]}
+                    stroke="white"
+                />
+            ))}
+            {kde && (
+                <polyline
+                    points={polyline(kde.x.map((v, i) => [x(v), y(kde.y[i])]))}
+                    fill="none"
+                    stroke={palette[0]}
+                    strokeWidth="2"
+                    filter="brightness(0.7)"
+                />
+            )}
+            <Axes
+                x={x}
+                y={y}
+                xDomain={xDomain}
+                yDomain={yDomain}
+                labels={{ title: data.labels.title, xlabel: data.labels.x, ylabel: data.labels.ylabel }}
+            />
+        </>
+    );
+}
+
+function Kde({ data }) {
+    const xDomain = getExtent(data.series.flatMap((s) => s.x));
+    const yDomain = [0, getExtent(data.series.flatMap((s) => s.y))[1]];
+    const x = getScale(xDomain, xRange);
+    const y = getScale(yDomain, yRange);
+    return (
+        <>
+            {data.series.map((s, i) => (
+                <g key={s.name}>
+                    <polyline
+                        points={polyline(s.x.map((v, j) => [x(v), y(s.y[j])]))}
+                        fill="none"
+                        stroke={palette[i % palette.length]}
+                        strokeWidth="2"
+                    />
+                    <text x={width - margin.right - 4} y={margin.top + 14 * (i + 1)} textAnchor="end" fontSize="11">
+                        {s.name}
+                    </text>
+                </g>
+            ))}
+            <Axes x={x} y={y} xDomain={xDomain} yDomain={yDomain} labels={data.labels} />
+        </>
+    );
+}
+
+// Box and violin plots share the layout: one band per group along x
+function Groups({ data, violin }) {
+    const { groups } = data;
+    const values = groups.flatMap((g) => [
+        g.whisker_low,
+        g.whisker_high,
+        ...(g.fliers || []),
+        ...(g.grid || []),
+    ]);
+    const yDomain = getExtent(values);
+    const band = (xRange[1] - xRange[0]) / groups.length;
+    const x = (i) => xRange[0] + band * (i + 0.5);
+    const y = getScale(yDomain, yRange);
+    const half = band * 0.4;
+    return (
+        <>
+            {groups.map((g, i) => {
+                const color = palette[i % palette.length];
+                const center = x(i);
+                return (
+                    <g key={g.name}>
+                        {violin && (
+                            <polygon
+                                points={polyline([
+                                    ...g.grid.map((v, j) => [center - g.density[j] * half, y(v)]),
+                                    ...g.grid.map((v, j) => [center + g.density[j] * half, y(v)]).reverse(),
+                                ])}
+                                fill={color}
+                                stroke={lineColor}
+                            />
+                        )}
+                        <line x1={center} y1={y(g.whisker_low)} x2={center} y2={y(g.q1)} stroke={lineColor} />
+                        <line x1={center} y1={y(g.q3)} x2={center} y2={y(g.whisker_high)} stroke={lineColor} />
+                        {violin ? (
+                            <>
+                                <rect x={center - 3} y={y(g.q3)} width="6" height={y(g.q1) - y(g.q3)} fill={lineColor} />
+                                <circle cx={center} cy={y(g.median)} r="3" fill="white" />
+                            </>
+                        ) : (
+                            <>
+                                <line x1={center - half / 2} y1={y(g.whisker_low)} x2={center + half / 2} y2={y(g.whisker_low)} stroke={lineColor} />
+                                <line x1={center - half / 2} y1={y(g.whisker_high)} x2={center + half / 2} y2={y(g.whisker_high)} stroke={lineColor} />
+                                <rect x={center - half} y={y(g.q3)} width={half * 2} height={y(g.q1) - y(g.q3)} fill={color} stroke={lineColor} />
+                                <line x1={center - half} y1={y(g.median)} x2={center + half} y2={y(g.median)} stroke={lineColor} />
+                                {g.fliers.map((v, j) => (
+                                    <circle key={j} cx={center} cy={y(v)} r="3" fill="none" stroke={lineColor} />
+                                ))}
+                            </>
+                        )}
+                    </g>
+                );
+            })}
+            <Axes
+                x={x}
+                y={y}
+                yDomain={yDomain}
+                xCategories={groups.map((g) => g.name)}
+                labels={{ title: data.labels.title, xlabel: data.labels.x, ylabel: data.labels.y }}
+            />
+        </>
+    );
+}
+
+function Scatter({ data }) {
+    const xDomain = getExtent(data.x);
+    const yDomain = getExtent(data.y);
+    const x = getScale(xDomain, xRange);
+    const y = getScale(yDomain, yRange);
+    return (
+        <>
+            {data.x.map((v, i) => (
+                <circle key={i} cx={x(v)} cy={y(data.y[i])} r="2" fill={palette[0]} filter="brightness(0.8)" />
+            ))}
+            <Axes x={x} y={y} xDomain={xDomain} yDomain={yDomain} labels={{ title: data.labels.title, xlabel: data.labels.x, ylabel: data.labels.y }} />
+        </>
+    );
+}
+
+// Hexagon vertices relative to the cell center, as in matplotlib.hexbin
+const hexagon = [[0.5, -0.5], [0.5, 0.5], [0, 1], [-0.5, 0.5], [-0.5, -0.5], [0, -1]];
+
+function Hex({ data }) {
+    if (!data.counts.length) return null;
+    const xDomain = [Math.min(...data.x) - data.sx / 2, Math.max(...data.x) + data.sx / 2];
+    const yDomain = [Math.min(...data.y) - data.sy / 3, Math.max(...data.y) + data.sy / 3];
+    const x = getScale(xDomain, xRange);
+    const y = getScale(yDomain, yRange);
+    const maxCount = Math.max(...data.counts);
+    return (
+        <>
+            {data.counts.map((count, i) => (
+                <polygon
+                    key={i}
+                    points={polyline(
+                        hexagon.map(([dx, dy]) => [x(data.x[i] + dx * data.sx), y(data.y[i] + (dy * data.sy) / 3)])
+                    )}
+                    fill={lineColor}
+                    fillOpacity={0.1 + (0.9 * count) / maxCount}
+                />
+            ))}
+            <Axes x={x} y={y} xDomain={xDomain} yDomain={yDomain} labels={{ title: data.labels.title, xlabel: data.labels.x, ylabel: data.labels.y }} />
+        </>
+    );
+}
+
+// Correlation matrix: diverging colors from blue (-1) through white to red (1)
+function getCorrelationColor(value) {
+    if (value === null) return "#eeeeee";
+    const [r, g, b] = value < 0 ? [59, 76, 192] : [180, 4, 38];
+    const t = Math.min(Math.abs(value), 1);
+    const mix = (c) => Math.round(255 + (c - 255) * t);
+    return `rgb(${mix(r)}, ${mix(g)}, ${mix(b)})`;
+}
+
+function Heatmap({ data }) {
+    const { names, values } = data;
+    const size = Math.min(xRange[1] - xRange[0], yRange[0] - yRange[1]);
+    const cell = size / names.length;
+    const left = margin.left;
+    const top = margin.top;
+    return (
+        <g fontSize="10" fill={lineColor}>
+            {values.map((row, i) =>
+                row.map((value, j) => (
+                    <rect
+                        key={`${i}-${j}`}
+                        x={left + j * cell}
+                        y={top + i * cell}
+                        width={cell}
+                        height={cell}
+                        fill={getCorrelationColor(value)}
+                    >
+                        <title>{`${names[i]} / ${names[j]}: ${value === null ? "—" : value.toFixed(2)}`}</title>
+                    </rect>
+                ))
+            )}
+            {names.map((name, i) => (
+                <text key={name} x={left - 4} y={top + (i + 0.5) * cell + 3} textAnchor="end">
+                    {name}
+                </text>
+            ))}
+            <text x={width / 2} y={margin.top / 2} textAnchor="middle" fontSize="14">{data.labels.title}</text>
+        </g>
+    );
+}
+
+const charts = {
+    hist: Hist,
+    kde: Kde,
+    box: (props) => <Groups {...props} violin={false} />,
+    violin: (props) => <Groups {...props} violin={true} />,
+    scatter: Scatter,
+    hex: Hex,
+    heatmap: Heatmap,
+};
+
+export default function Chart({ data }) {
+    const Plot = charts[data.kind];
+    if (!Plot) return <div>{"Нет контента"}</div>;
+    return (
+        <svg className="image" viewBox={`0 0 ${width} ${height}`} width="100%" fontFamily="sans-serif">
+            <Plot data={data} />
+        </svg>
+    );
+}
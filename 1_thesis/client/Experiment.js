@@ -13,6 +13,7 @@ import {
 import { performRequest } from "Api";
 import { getUniqueKey } from "Common";
 import Table from "Table";
+import Chart from "Chart";
 import { hints } from "Hints";
 
 const { Panel } = Collapse;
@@ -21,6 +22,11 @@ const { Paragraph } = Typography;
 const { RangePicker } = DatePicker;
 const { Header, Footer, Sider, Content } = Layout;
 
+// Plots are fetched by URL (/api/images/...) instead of base64 inside JSON
+const imageFormat = "url";
+// Distribution and correlation plots are drawn here from server aggregates (see Chart.js)
+const plotOutput = "data";
+
 // Enum
 const Component = {
     Sample: 5,
@@ -411,13 +417,22 @@ export default function Experiment({ experiment, tests, samples, showDeleteExper
         const key = getUniqueKey();
         switch (content.type) {
             case "image":
-                const image = `data:image/png;charset=utf-8;base64,${content.value}`;
+                const image = content.url
+                    ? process.env.REACT_APP_DOMAIN + content.url
+                    : `data:image/png;charset=utf-8;base64,${content.value}`;
                 return (
                     <div className="result-content" key={key}>
                         <Image className="image" alt="" src={image} />
                     </div>
                 );
 
+            case "plot":
+                return (
+                    <div className="result-content" key={key}>
+                        <Chart data={content.value} />
+                    </div>
+                );
+
             case "table":
                 const columns = renderParams[content.name].columns;
                 return (
@@ -511,6 +526,8 @@ export default function Experiment({ experiment, tests, samples, showDeleteExper
             test_id: compTest1,
             bins: compBins,
             z_value: compZValue,
+            image_format: imageFormat,
+            output: plotOutput,
             sample: getSampleRequestFromSample(sample),
             density: compUseKde,
         };
@@ -527,6 +544,8 @@ export default function Experiment({ experiment, tests, samples, showDeleteExper
         let request = {
             test_id: compTest1,
             z_value: compZValue,
+            image_format: imageFormat,
+            output: plotOutput,
             sample: getSampleRequestFromSample(sample),
         };
 
@@ -543,6 +562,8 @@ export default function Experiment({ experiment, tests, samples, showDeleteExper
         let request = {
             test_id: compTest1,
             z_value: compZValue,
+            image_format: imageFormat,
+            output: plotOutput,
             samples: sampleRequests,
         };
 
@@ -559,6 +580,8 @@ export default function Experiment({ experiment, tests, samples, showDeleteExper
         let request = {
             test_id: compTest1,
             z_value: compZValue,
+            image_format: imageFormat,
+            output: plotOutput,
             samples: sampleRequests,
         };
 
@@ -575,6 +598,8 @@ export default function Experiment({ experiment, tests, samples, showDeleteExper
             test_id1: compTest1,
             test_id2: compTest2,
             z_value: compZValue,
+            image_format: imageFormat,
+            output: plotOutput,
             sample: getSampleRequestFromSample(sample),
         };
 
@@ -591,6 +616,8 @@ export default function Experiment({ experiment, tests, samples, showDeleteExper
             test_id1: compTest1,
             test_id2: compTest2,
             z_value: compZValue,
+            image_format: imageFormat,
+            output: plotOutput,
             sample: getSampleRequestFromSample(sample),
         };
 
@@ -721,6 +748,7 @@ export default function Experiment({ experiment, tests, samples, showDeleteExper
         let request = {
             test_ids: compTests,
             z_value: compZValue,
+            image_format: imageFormat,
             cluster_count: compClusterCount,
             dist_metric: compDistanceMetric,
             samples: sampleRequests,
@@ -755,6 +783,7 @@ export default function Experiment({ experiment, tests, samples, showDeleteExper
         let request = {
             test_ids: compTests,
             z_value: compZValue,
+            image_format: imageFormat,
             cluster_count: compClusterCount,
             samples: sampleRequests,
         };
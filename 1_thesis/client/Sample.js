@@ -20,27 +20,6 @@ const { RangePicker } = DatePicker;
 const { Header, Footer, Sider, Content } = Layout;
 const { Panel } = Collapse;
 
-function getChildrenOfElem(elem, diagnoses) {
-    let result = diagnoses.filter((value) => value.pId === elem).map((value) => value.id);
-
-    if (result.length === 0) {
-        return null;
-    } else {
-        return getChildrenOfElems(result, diagnoses);
-    }
-}
-
-function getChildrenOfElems(elems, diagnoses) {
-    let result = elems.slice();
-    for (const elem of elems) {
-        const children = getChildrenOfElem(elem, diagnoses);
-        if (children !== null) {
-            result = result.concat(children);
-        }
-    }
-    return result;
-}
-
 const tagRender = (props) => {
     if (props.label === "-1") return <div></div>;
 
@@ -176,14 +155,9 @@ export default function Sample({ sample, diagnoses, showRenameSampleModal, showD
                             if (values.length === 1 && values[0] === -1) {
                                 setDiagnoses([]);
                             } else {
-                                const children = getChildrenOfElems(
-                                    values,
-                                    diagnoses
-                                ).sort();
-                                const d = diagnoses.filter((v) =>
-                                    children.includes(v.id)
-                                );
-                                setDiagnoses(children);
+                                // A selected group stands for its whole subtree,
+                                // the server expands it into ranges itself
+                                setDiagnoses(values);
                             }
                         }}
                     />
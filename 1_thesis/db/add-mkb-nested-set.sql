@@ -0,0 +1,14 @@
+-- Миграция существующей базы: колонки вложенных множеств в mkb и колонка
+-- diagnosis_lft в витрине sample_fact. После миграции нужно выполнить
+-- update-mkb-nested-set.sql, затем create-sample-fact.sql и
+-- REFRESH MATERIALIZED VIEW sample_fact; (или заново запустить import.py)
+
+BEGIN;
+
+ALTER TABLE mkb ADD COLUMN IF NOT EXISTS lft INT4;
+ALTER TABLE mkb ADD COLUMN IF NOT EXISTS rgt INT4;
+
+-- Витрина создается заново с новой колонкой
+DROP MATERIALIZED VIEW IF EXISTS sample_fact;
+
+COMMIT;
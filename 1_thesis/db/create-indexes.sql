@@ -0,0 +1,37 @@
+-- Индексы под фильтры db.get_dataset и соединения таблиц.
+-- Применяется к уже созданной схеме (после create-tables.sql), повторный запуск безопасен
+
+-- Основной фильтр выборки: тест + интервал дат + интервал возраста.
+-- INCLUDE позволяет получить результат без обращения к таблице (index only scan)
+CREATE INDEX IF NOT EXISTS referral_body_test_date_age_idx
+	ON referral_body (test_id, sampling_date, patient_age_when_sampling)
+	INCLUDE (result, referral_header_id);
+
+-- Тот же фильтр без ограничения по тестам
+CREATE INDEX IF NOT EXISTS referral_body_date_age_idx
+	ON referral_body (sampling_date, patient_age_when_sampling)
+	INCLUDE (test_id, result, referral_header_id);
+
+-- Индексы внешних ключей для соединений
+CREATE INDEX IF NOT EXISTS referral_body_referral_header_id_idx
+	ON referral_body (referral_header_id);
+
+CREATE INDEX IF NOT EXISTS referral_header_patient_id_idx
+	ON referral_header (patient_id);
+
+CREATE INDEX IF NOT EXISTS referral_header_diagnosis_id_idx
+	ON referral_header (diagnosis_id)
+	INCLUDE (patient_id);
+
+CREATE INDEX IF NOT EXISTS patient_district_id_idx
+	ON patient (district_id);
+
+CREATE INDEX IF NOT EXISTS test_analysis_id_idx
+	ON test (analysis_id);
+
+CREATE INDEX IF NOT EXISTS mkb_parent_id_idx
+	ON mkb (parent_id);
+
+ANALYZE referral_body;
+ANALYZE referral_header;
+ANALYZE patient;
@@ -0,0 +1,38 @@
+-- Денормализованная витрина для db.get_dataset: результат соединения
+-- referral_body ⋈ referral_header ⋈ patient, только нужные колонки.
+-- Пол и район хранятся короткими целыми кодами, название теста берется
+-- из небольшой таблицы test на стороне сервера приложения. diagnosis_lft — номер
+-- диагноза в нумерации вложенных множеств (mkb.lft) для фильтра по группам МКБ.
+-- Создается с WITH NO DATA, заполняется import.py (REFRESH MATERIALIZED VIEW)
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS sample_fact AS
+SELECT
+	rb.referral_header_id,
+	rh.patient_id,
+	rh.diagnosis_id,
+	rb.test_id,
+	rb.sampling_date,
+	rb.result,
+	rb.patient_age_when_sampling,
+	(CASE p.gender WHEN 'м' THEN 1 WHEN 'ж' THEN 2 END)::INT2 AS gender_code,
+	p.district_id::INT2 AS district_id,
+	m.lft AS diagnosis_lft
+FROM referral_body AS rb
+JOIN referral_header AS rh  ON rb.referral_header_id = rh.id
+JOIN patient AS p           ON rh.patient_id = p.id
+LEFT JOIN mkb AS m          ON rh.diagnosis_id = m.id
+-- Строки одного теста за близкие даты оказываются рядом на диске
+ORDER BY rb.test_id, rb.sampling_date
+WITH NO DATA;
+
+CREATE INDEX IF NOT EXISTS sample_fact_test_date_age_idx
+	ON sample_fact (test_id, sampling_date, patient_age_when_sampling)
+	INCLUDE (result, referral_header_id, patient_id, diagnosis_id, gender_code, district_id, diagnosis_lft);
+
+CREATE INDEX IF NOT EXISTS sample_fact_date_age_idx
+	ON sample_fact (sampling_date, patient_age_when_sampling)
+	INCLUDE (test_id, result, referral_header_id, patient_id, diagnosis_id, gender_code, district_id, diagnosis_lft);
+
+-- Версия данных: увеличивается при каждом обновлении витрины (db.refresh_sample_fact).
+-- По ней сервер узнает, что закэшированные выборки устарели
+CREATE SEQUENCE IF NOT EXISTS data_version_seq;
@@ -35,6 +35,10 @@ CREATE TABLE mkb (
     "name" TEXT NOT NULL,
     parent_id INT4,
     "level" INT4 NOT NULL,
+    -- Вложенные множества: номер узла при обходе в глубину и наибольший номер
+    -- в его поддереве (заполняются update-mkb-nested-set.sql)
+    lft INT4,
+    rgt INT4,
     PRIMARY KEY (id),
     FOREIGN KEY (parent_id) REFERENCES mkb(id)
 );
@@ -0,0 +1,70 @@
+-- Необязательная миграция: секционирование referral_body по sampling_date (по годам).
+-- Запросы с интервалом дат читают только нужные секции. Индексы из create-indexes.sql
+-- пересоздаются на секционированной таблице и автоматически появляются в каждой секции
+
+BEGIN;
+
+CREATE TABLE referral_body_partitioned (
+	id SERIAL4 NOT NULL,
+	referral_header_id INT4 NOT NULL,
+	sampling_date DATE NOT NULL,
+	test_id INT4 NOT NULL,
+	result FLOAT8,
+	patient_age_when_sampling INT4 NOT NULL,
+	-- Ключ секционирования обязан входить в первичный ключ
+	PRIMARY KEY (id, sampling_date),
+	FOREIGN KEY (referral_header_id) REFERENCES referral_header(id),
+	FOREIGN KEY (test_id) REFERENCES test(id)
+) PARTITION BY RANGE (sampling_date);
+
+-- Секция на каждый год, встречающийся в данных, и секция по умолчанию для остальных дат
+DO $$
+DECLARE
+	y INT;
+BEGIN
+	FOR y IN
+		SELECT DISTINCT extract(YEAR FROM sampling_date)::INT FROM referral_body ORDER BY 1
+	LOOP
+		EXECUTE format(
+			'CREATE TABLE referral_body_%s PARTITION OF referral_body_partitioned
+				FOR VALUES FROM (%L) TO (%L);',
+			y, make_date(y, 1, 1), make_date(y + 1, 1, 1)
+		);
+	END LOOP;
+END $$;
+
+CREATE TABLE referral_body_default PARTITION OF referral_body_partitioned DEFAULT;
+
+INSERT INTO referral_body_partitioned (
+	id, referral_header_id, sampling_date, test_id, result, patient_age_when_sampling
+)
+SELECT
+	id, referral_header_id, sampling_date, test_id, result, patient_age_when_sampling
+FROM referral_body;
+
+SELECT setval(
+	pg_get_serial_sequence('referral_body_partitioned', 'id'),
+	coalesce((SELECT max(id) FROM referral_body_partitioned), 0) + 1,
+	false
+);
+
+-- Витрина sample_fact зависит от referral_body. После миграции ее нужно создать
+-- заново (create-sample-fact.sql) и заполнить: REFRESH MATERIALIZED VIEW sample_fact;
+DROP MATERIALIZED VIEW IF EXISTS sample_fact;
+DROP TABLE referral_body;
+ALTER TABLE referral_body_partitioned RENAME TO referral_body;
+
+CREATE INDEX referral_body_test_date_age_idx
+	ON referral_body (test_id, sampling_date, patient_age_when_sampling)
+	INCLUDE (result, referral_header_id);
+
+CREATE INDEX referral_body_date_age_idx
+	ON referral_body (sampling_date, patient_age_when_sampling)
+	INCLUDE (test_id, result, referral_header_id);
+
+CREATE INDEX referral_body_referral_header_id_idx
+	ON referral_body (referral_header_id);
+
+COMMIT;
+
+ANALYZE referral_body;
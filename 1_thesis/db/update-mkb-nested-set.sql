@@ -0,0 +1,30 @@
+-- Нумерация МКБ вложенными множествами: lft — номер узла при обходе дерева
+-- в глубину, rgt — наибольший номер в его поддереве. Диагноз d входит в группу g,
+-- если g.lft <= d.lft <= g.rgt, поэтому выбор целой группы превращается в условие
+-- на интервал вместо длинного списка id (см. db.get_dataset_query).
+-- Выполняется import.py после импорта справочника
+
+WITH RECURSIVE tree AS (
+	SELECT id, ARRAY[id] AS path
+	FROM mkb
+	WHERE parent_id IS NULL
+	UNION ALL
+	SELECT m.id, t.path || m.id
+	FROM mkb AS m
+	JOIN tree AS t ON m.parent_id = t.id
+),
+numbered AS (
+	SELECT id, (row_number() OVER (ORDER BY path))::INT4 AS lft
+	FROM tree
+),
+-- Узел встречается в путях всех узлов своего поддерева (и в своем)
+subtree_sizes AS (
+	SELECT unnest(path) AS id, count(*)::INT4 AS size
+	FROM tree
+	GROUP BY 1
+)
+UPDATE mkb
+SET lft = n.lft, rgt = n.lft + s.size - 1
+FROM numbered AS n
+JOIN subtree_sizes AS s ON s.id = n.id
+WHERE mkb.id = n.id;
@@ -0,0 +1,212 @@
+import numpy as np
+import pandas as pd
+
+# Накопители описательных статистик для выборок, которые читаются фрагментами.
+# Каждый накопитель можно обновлять очередным фрагментом и объединять с другим
+# накопителем, результат не зависит от того, как данные были разбиты на фрагменты
+
+
+class Moments:
+    # count/min/max/mean/std. Среднее и сумма квадратов отклонений объединяются
+    # по формулам Чана, что устойчивее наивного накопления суммы квадратов
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.nan
+        self.max = np.nan
+
+    def update(self, values):
+        values = np.asarray(values, dtype="float64")
+        if len(values) == 0:
+            return
+
+        other = Moments()
+        other.count = len(values)
+        other.mean = values.mean()
+        other.m2 = ((values - other.mean) ** 2).sum()
+        other.min = values.min()
+        other.max = values.max()
+        self.merge(other)
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.min, self.max = other.min, other.max
+            return
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta**2 * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def std(self):
+        # Несмещенная оценка, как у pandas (ddof=1)
+        if self.count < 2:
+            return np.nan
+        return np.sqrt(self.m2 / (self.count - 1))
+
+
+class QuantileSketch:
+    # Упрощенный t-digest: значения хранятся в виде центроидов (среднее, вес).
+    # Центроиды у краев распределения мельче, поэтому хвостовые квантили точнее.
+    # Пока различных значений не больше compression, центроиды совпадают со значениями
+    # (вес = число повторов) и квантили считаются точно, как в pandas
+    def __init__(self, compression=500, buffer_size=10_000):
+        self.compression = compression
+        self.buffer_size = buffer_size
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.exact = True
+        self._buffer = []
+        self._buffered = 0
+
+    def update(self, values):
+        values = np.asarray(values, dtype="float64")
+        if len(values) == 0:
+            return
+
+        self._buffer.append(values)
+        self._buffered += len(values)
+        if self._buffered >= self.buffer_size:
+            self._compress()
+
+    def merge(self, other):
+        other._compress()
+        self._compress(other.means, other.weights, other.exact)
+
+    def _compress(self, extra_means=None, extra_weights=None, extra_exact=True):
+        means = [self.means] + self._buffer
+        weights = [self.weights] + [np.ones(len(b)) for b in self._buffer]
+        if extra_means is not None:
+            means.append(extra_means)
+            weights.append(extra_weights)
+
+        means = np.concatenate(means)
+        weights = np.concatenate(weights)
+        self._buffer = []
+        self._buffered = 0
+
+        if self.exact and extra_exact:
+            unique, inverse = np.unique(means, return_inverse=True)
+            if len(unique) <= self.compression:
+                self.means = unique
+                self.weights = np.bincount(inverse, weights=weights)
+                return
+        self.exact = False
+
+        order = np.argsort(means, kind="stable")
+        means = means[order]
+        weights = weights[order]
+
+        # Номер центроида определяется масштабной функцией k(q) = δ/2π · arcsin(2q - 1)
+        # от середины накопленного веса каждой точки. Соседние точки с одинаковым
+        # номером сливаются в один центроид
+        total = weights.sum()
+        q = (np.cumsum(weights) - weights / 2) / total
+        k = np.floor(self.compression / (2 * np.pi) * np.arcsin(2 * q - 1))
+        starts = np.flatnonzero(np.r_[True, k[1:] != k[:-1]])
+
+        merged_weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / merged_weights
+        self.weights = merged_weights
+
+    def quantile(self, q, min_value=None, max_value=None):
+        self._compress()
+        if len(self.means) == 0:
+            return np.nan
+
+        cum_weights = np.cumsum(self.weights)
+        total = cum_weights[-1]
+
+        if self.exact:
+            # Линейная интерполяция между соседними по рангу значениями
+            position = (total - 1) * q
+            lower = np.floor(position)
+            idx = np.searchsorted(cum_weights, [lower, lower + 1], side="right")
+            idx = np.minimum(idx, len(self.means) - 1)
+            lower_value, upper_value = self.means[idx]
+            return lower_value + (position - lower) * (upper_value - lower_value)
+
+        # Интерполяция между центрами центроидов, края привязываются к min и max
+        centers = cum_weights - self.weights / 2
+        positions = np.r_[0.0, centers, total]
+        values = np.r_[
+            self.means[0] if min_value is None else min_value,
+            self.means,
+            self.means[-1] if max_value is None else max_value,
+        ]
+        return np.interp(q * total, positions, values)
+
+
+class ColumnStats:
+    def __init__(self):
+        self.moments = Moments()
+        self.sketch = QuantileSketch()
+
+    def update(self, values):
+        self.moments.update(values)
+        self.sketch.update(values)
+
+    def merge(self, other):
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+
+    def summary(self):
+        m = self.moments
+
+        def q(x):
+            return self.sketch.quantile(x, m.min, m.max)
+
+        return {
+            "count": m.count,
+            "min": m.min,
+            "q25": q(0.25),
+            "q50": q(0.50),
+            "q75": q(0.75),
+            "max": m.max,
+            "mean": m.mean if m.count else np.nan,
+            "std": m.std,
+        }
+
+
+class GroupedStats:
+    # Статистики значения value_cn для каждой комбинации значений колонок keys.
+    # Порядок групп первого ключа запоминается в порядке появления, как у Series.unique()
+    def __init__(self, keys, value_cn):
+        self.keys = list(keys)
+        self.value_cn = value_cn
+        self.groups = {}
+        self.first_key_order = {}
+
+    def update(self, df):
+        for value in pd.unique(df[self.keys[0]]):
+            self.first_key_order.setdefault(value, len(self.first_key_order))
+
+        grouped = df.groupby(self.keys, observed=True, sort=False)[self.value_cn]
+        for key, values in grouped:
+            if not isinstance(key, tuple):
+                key = (key,)
+            if key not in self.groups:
+                self.groups[key] = ColumnStats()
+            self.groups[key].update(values.to_numpy())
+
+    def merge(self, other):
+        for value in other.first_key_order:
+            self.first_key_order.setdefault(value, len(self.first_key_order))
+        for key, stats in other.groups.items():
+            if key not in self.groups:
+                self.groups[key] = ColumnStats()
+            self.groups[key].merge(stats)
+
+    def to_frame(self):
+        rows = [stats.summary() for stats in self.groups.values()]
+        index = pd.MultiIndex.from_tuples(list(self.groups.keys()), names=self.keys)
+        df = pd.DataFrame(rows, index=index)
+        return df.sort_index()
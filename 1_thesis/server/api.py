@@ -1,65 +1,51 @@
 import base64
-import io
 import json
+from concurrent.futures import Future
 from pprint import pprint
 
-import common
 import numpy as np
 import pandas as pd
-import psycopg2 as pg
-import seaborn as sns
 import statsmodels.stats.multitest as multi
-from dotenv import dotenv_values
 from flask import Response, jsonify, request
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-from matplotlib.figure import Figure
-import matplotlib
-from pyclustering.cluster.center_initializer import kmeans_plusplus_initializer
-from pyclustering.cluster.encoder import cluster_encoder
-from pyclustering.cluster.kmeans import kmeans
-from pyclustering.utils.metric import distance_metric
 from scipy import stats as scipy_stats
-from scipy.cluster.hierarchy import dendrogram
 from sklearn.cluster import AgglomerativeClustering
 from sklearn.decomposition import PCA
-from sklearn.neighbors import LocalOutlierFactor
 
 
 # https://json-schema.org/understanding-json-schema/index.html
 from jsonschema import validate, exceptions
 
+import accumulators
+import cache
+import clustering
+import correlation
 import db
+import downsample
+import images
+import mkb
+import outliers
+import pivot
+import plot_cache
+import plot_data
+import pool
+import render
+import resampling
 import schemas
+import screening
+import statements
 
-config = dotenv_values(common.ENV_FILE)
 
-matplotlib.use("agg", force=True)
-
-connection = pg.connect(
-    dbname=config["DB_NAME"],
-    user=config["DB_USER"],
-    password=config["DB_PASSWORD"],
-)
-
-
-sns.set_palette("pastel")
-
-dpi = 200
 aspect_ratio = 1.66666
 figure_height = 4  # inches
 common_figure_size = (figure_height * aspect_ratio, figure_height)
 square_figure_size = (figure_height, figure_height)
 
-max_points_to_draw = 5000
-
 gender_male_one_hot = "gender_м"
 gender_female_one_hot = "gender_ж"
 
-image_bytes = io.BytesIO()
-
 
 def get_image_size(figure_size):
-    return (figure_size[0] * dpi, figure_size[1] * dpi)
+    return (figure_size[0] * render.dpi, figure_size[1] * render.dpi)
 
 
 columns_translator = {
@@ -71,17 +57,6 @@ columns_translator = {
     "sample_name": "Название выборки",
 }
 
-dist_metrics = {
-    "euclidean": 0,
-    "euclidean_square": 1,
-    "manhattan": 2,
-    "chebyshev": 3,
-    "minkowski": 4,
-    "canberra": 5,
-    "chi_square": 6,
-    "gower": 7,
-}
-
 
 def to_json_response(obj, status=200):
     # По неизвестному ряду причин flask.jsonify не работает как нужно
@@ -93,18 +68,72 @@ def to_json_response(obj, status=200):
     )
 
 
-def get_image_content(content_name, figure):
+# png — байты PNG из render.render или Future из render.submit
+# image_format "url" — вместо base64 ссылка на картинку в images.image_store
+def get_image_content(content_name, png, image_format="base64"):
+    if isinstance(png, Future):
+        png = png.result()
+
+    if image_format == "url":
+        key = images.image_store.put(png)
+        return {
+            "name": content_name,
+            "type": "image",
+            "url": images.get_url(key),
+        }
+
     return {
         "name": content_name,
         "type": "image",
-        "value": figure_to_base64(figure),
+        "value": base64.b64encode(png).decode("ascii"),
+    }
+
+
+# Ответ обработчика графика. prepare(connection, params) читает данные и возвращает
+# spec и таблицу для render.render (или Response с ошибкой). По умолчанию ответ — PNG
+# с кэшем (см. plot_cache), с output "data" — данные для отрисовки на клиенте (см. plot_data)
+def get_plot_response(content_name, params, prepare):
+    content = get_plot_output(content_name, params, prepare)
+    if isinstance(content, Response): return content
+    return to_json_response([content])
+
+
+# Элемент ответа с графиком для get_plot_response и обработчиков, которые
+# возвращают график вместе с другими элементами (таблицами)
+def get_plot_output(content_name, params, prepare):
+    connection = pool.get_connection()
+
+    if params.get("output") == "data":
+        prepared = prepare(connection, params)
+        if isinstance(prepared, Response): return prepared
+        return get_plot_content(content_name, plot_data.get_plot_data(*prepared))
+
+    plot_key = plot_cache.get_plot_key(content_name, params, connection)
+    _, png = plot_cache.plot_cache.get(plot_key)
+    if png is None:
+        prepared = prepare(connection, params)
+        if isinstance(prepared, Response): return prepared
+        png = render.render(*prepared)
+        plot_cache.plot_cache.put(plot_key, png)
+
+    return get_image_content(content_name, png, params.get("image_format"))
+
+
+def get_plot_content(content_name, data):
+    return {
+        "name": content_name,
+        "type": "plot",
+        "value": data,
     }
 
 
-def figure_to_base64(figure):
-    figure.savefig(image_bytes, format="png", bbox_inches="tight", dpi=dpi)
-    image_bytes.seek(0)
-    return base64.b64encode(image_bytes.getvalue()).decode("utf-8")
+# Строки без выбросов по колонкам columns: метод outlier_method (по умолчанию z-оценка),
+# порог z_value, для lof — число соседей lof_neighbors (см. outliers). group — колонка,
+# внутри значений которой выбросы ищутся отдельно
+def filter_outliers(df, params, columns, group=None):
+    return outliers.filter_df(
+        df, columns, params.get("outlier_method"), params["z_value"], group, params.get("lof_neighbors")
+    )
 
 
 def get_table_content(content_name, table, title):
@@ -147,6 +176,16 @@ def params_validate(params, schema):
         return to_json_response([content])
     return 0
 
+# Выбранный в фильтре узел МКБ означает все его поддерево, в запрос передаются
+# только корни выбранных поддеревьев (mkb.DiagnosisTree.get_subtree_roots)
+def normalize_sample_diagnoses(connection, samples):
+    tree = mkb.get_tree(connection)
+    return [
+        dict(sample, diagnoses=tree.get_subtree_roots(sample["diagnoses"]))
+        for sample in samples
+    ]
+
+
 def get_df(connection, params, pivot=False, pivot_columns="test_name"):
     # connection = connection, duh
     # params = json / dict parameters for samples (sample(s) and test_id(s) specificaly)
@@ -157,36 +196,20 @@ def get_df(connection, params, pivot=False, pivot_columns="test_name"):
     elif "test_ids" in params: test_id_ = params["test_ids"]
 
     if "samples" in params:
-        res = []
-        for sample in params["samples"]:
-            df = db.get_dataset(connection, sample, test_id_)
-            if pivot:
-                df = (
-                    df
-                    .drop_duplicates(["referral_header_id", "test_id"])
-                    .pivot(
-                        index=["referral_header_id", "gender", "patient_age_when_sampling"],
-                        columns=pivot_columns,
-                        values="result",
-                    )
-                    .dropna()
-                    .rename(columns=columns_translator)
-                )
-            res.append(df)
+        # Все выборки читаются из БД одним запросом
+        samples = normalize_sample_diagnoses(connection, params["samples"])
+        if pivot:
+            res = cache.get_pivots(connection, samples, test_id_, pivot_columns)
+            res = [df.rename(columns=columns_translator) for df in res]
+        else:
+            res = cache.get_datasets(connection, samples, test_id_)
     elif "sample" in params:
-        res = db.get_dataset(connection, params["sample"], test_id_)
+        [sample] = normalize_sample_diagnoses(connection, [params["sample"]])
         if pivot:
-            res = (
-                res
-                .drop_duplicates(["referral_header_id", "test_id"])
-                .pivot(
-                    index=["referral_header_id", "gender", "patient_age_when_sampling"],
-                    columns=pivot_columns,
-                    values="result",
-                )
-                .dropna()
-                .rename(columns=columns_translator)
-            )
+            res = cache.get_pivot(connection, sample, test_id_, pivot_columns)
+            res = res.rename(columns=columns_translator)
+        else:
+            res = cache.get_dataset(connection, sample, test_id_)
     
     if (isinstance(res, pd.DataFrame) and len(res)==0) or (isinstance(res, list) and any([len(_)==0 for _ in res])==True):
         content = get_error_content(0)
@@ -199,70 +222,94 @@ def get_df(connection, params, pivot=False, pivot_columns="test_name"):
 
 
 def get_tests():
-    return to_json_response(db.get_tests(connection))
+    return to_json_response(db.get_tests(pool.get_connection()))
 
 
+# Дерево МКБ с количествами направлений хранится в памяти (mkb.get_tree),
+# ответ сформирован заранее и отдается с ETag
 def get_diagnoses():
-    df = db.get_diagnoses(connection)
-
-    df["parent_id"] = df["parent_id"].fillna(-1).astype("int")
-    root_group = pd.DataFrame(
-        {
-            "id": -1,
-            "parent_id": -2,
-            "level": -1,
-            "name": "Все диагнозы",
-            "count": 0,
-            "code": "",
-        },
-        index=[len(df)],
-    )
-    df = pd.concat([df, root_group], copy=False)
+    tree = mkb.get_tree(pool.get_connection())
+
+    response = Response(tree.response_body, mimetype="application/json")
+    response.set_etag(tree.etag)
+    return response.make_conditional(request)
 
-    df["count"] = df["count"].fillna(0).astype("int")
-    df["group_count"] = df["count"]
 
-    df.set_index("id", drop=False, inplace=True)
-    df.index.name = ""
+def get_cache_stats():
+    return to_json_response({
+        "samples": cache.sample_cache.get_stats(),
+        "statements": statements.get_stats(),
+        "render": render.get_stats(),
+        "images": images.image_store.get_stats(),
+        "plots": plot_cache.plot_cache.get_stats(),
+        "outliers": outliers.mask_cache.get_stats(),
+        "neighbors": outliers.neighbor_index_cache.get_stats(),
+        "kmeans": clustering.get_stats(),
+    })
 
-    levels = sorted(df.level.unique(), reverse=True)
-    levels.remove(-1)
-    for level in levels:
-        sums = df[df.level == level].groupby("parent_id")["count"].agg("sum")
-        df.loc[sums.index, "count"] = df.loc[sums.index, "count"] + sums
 
-    df.sort_values(["level", "count"], ascending=False, inplace=True)
+# Картинка из images.image_store по ссылке из get_image_content. Содержимое по ключу
+# не меняется, поэтому браузер может хранить его сколько угодно
+def get_image(key):
+    png = images.image_store.get(key)
+    if png is None:
+        return Response(status=404)
 
-    return to_json_response(df.to_dict("records"))
+    response = Response(png, mimetype="image/png")
+    response.set_etag(key)
+    response.cache_control.public = True
+    response.cache_control.max_age = 365 * 24 * 3600
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
 
 
 ### Описательные статистики ###
 
 
-def q25(x):
-    return x.quantile(0.25)
+stats_columns = ["count", "min", "q25", "q50", "q75", "max", "mean", "std"]
 
 
-def q50(x):
-    return x.quantile(0.50)
+# Описательные статистики value_cn для всех комбинаций значений колонок keys
+# за один проход groupby (квантили считаются встроенным groupby.quantile)
+def describe_groups(df, keys, value_cn):
+    grouped = df.groupby(keys, observed=True)[value_cn]
 
+    stats_df = grouped.aggregate(["count", "min", "max", "mean", "std"])
+    quantiles = grouped.quantile([0.25, 0.50, 0.75]).unstack()
+    quantiles.columns = ["q25", "q50", "q75"]
 
-def q75(x):
-    return x.quantile(0.75)
+    return stats_df.join(quantiles)[stats_columns]
 
 
-functions = ["count", "min", q25, q50, q75, "max", "mean", "std"]
+# Порядок таблиц /api/stats: выборки — в порядке запроса, тесты — в порядке test_ids
+# (строки выборки приходят из базы в произвольном порядке, поэтому порядок первого
+# появления у вариантов get_stats различался бы). test_names — названия тестов по id
+def get_stats_groups(params, test_names):
+    if params["group_by"] == "samples":
+        return list(dict.fromkeys(sample["name"] for sample in params["samples"]))
+    return [
+        test_names[test_id]
+        for test_id in dict.fromkeys(params["test_ids"])
+        if test_id in test_names.index
+    ]
 
 
 # cn - "column name" (in df)
-def get_test_stats(df, group_creator_cn, group_content_cn, value_cn):
-    results = []
-    for group in df[group_creator_cn].unique():
-        filtered_df = df[df[group_creator_cn] == group]
+# groups — порядок таблиц (по умолчанию — порядок появления в df)
+def get_test_stats(df, group_creator_cn, group_content_cn, value_cn, groups=None):
+    all_stats_df = describe_groups(df, [group_creator_cn, group_content_cn], value_cn)
+    all_stats_df.fillna(0, inplace=True)
 
-        stats_df = filtered_df.groupby(group_content_cn)[value_cn].aggregate(functions)
-        stats_df.fillna(0, inplace=True)
-        stats_df.reset_index(names="row_name", inplace=True)
+    if groups is None:
+        groups = df[group_creator_cn].unique()
+    present = set(all_stats_df.index.get_level_values(0))
+
+    results = []
+    for group in groups:
+        if group not in present:
+            continue
+        stats_df = all_stats_df.xs(group, level=0)
+        stats_df = stats_df.reset_index(names="row_name")
 
         results.append(dict(df=stats_df, title=f"Описательные статистики — {group}"))
 
@@ -270,15 +317,15 @@ def get_test_stats(df, group_creator_cn, group_content_cn, value_cn):
 
 
 def get_gender_stats(df, sample_cn, gender_cn):
-    rows = []
     sample_names = df[sample_cn].unique()
-    for sample_name in sample_names:
-        filtered_df = df[df[sample_cn] == sample_name]
-        counts = filtered_df[gender_cn].value_counts()
-        row = counts.to_dict()
-        row["count_total"] = counts.sum()
-        rows.append(row)
-    stats_df = pd.DataFrame(rows, index=sample_names)
+    stats_df = (
+        df.groupby([sample_cn, gender_cn], observed=True)
+        .size()
+        .unstack(fill_value=0)
+        .reindex(sample_names)
+    )
+    stats_df.columns = list(stats_df.columns)
+    stats_df["count_total"] = stats_df.sum(axis=1)
     stats_df.fillna(0, inplace=True)
     stats_df.reset_index(names="row_name", inplace=True)
     stats_df.rename(columns={"м": "count_male", "ж": "count_female"}, inplace=True)
@@ -286,7 +333,7 @@ def get_gender_stats(df, sample_cn, gender_cn):
 
 
 def get_age_stats(df, sample_cn, age_cn):
-    stats_df = df.groupby(sample_cn)[age_cn].aggregate(functions)
+    stats_df = describe_groups(df, [sample_cn], age_cn)
     stats_df.fillna(0, inplace=True)
     stats_df.reset_index(names="row_name", inplace=True)
     return dict(df=stats_df, title="Описательные статистики — Возраст")
@@ -297,6 +344,15 @@ def get_stats():
     valid = params_validate(params, schemas.stats)
     if valid != 0: return valid # now valid is an error message
 
+    connection = pool.get_connection()
+    if params.get("execution") == "sql":
+        return get_stats_sql(connection, params)
+    if params.get("stream", False):
+        return get_stats_streaming(connection, params)
+    return get_stats_pandas(connection, params)
+
+
+def get_stats_pandas(connection, params):
     dfs = get_df(connection, params)
     if isinstance(dfs, Response): return dfs # now df is an error message
 
@@ -319,6 +375,7 @@ def get_stats():
         group_creator_cn,
         group_content_cn,
         "result",
+        get_stats_groups(params, db.get_test_names(connection).set_index("id")["name"]),
     )
     content_list += [
         get_table_content("test_stats", stats["df"], stats["title"])
@@ -348,6 +405,160 @@ def get_stats():
     return to_json_response(content_list)
 
 
+# Вариант get_stats, в котором статистики считает PostgreSQL (db.get_stats_summary):
+# по сети передается только итоговая таблица, а не все строки выборок
+def get_stats_sql(connection, params):
+    samples = normalize_sample_diagnoses(connection, params["samples"])
+    summary = db.get_stats_summary(connection, samples, params["test_ids"])
+
+    sample_rows = summary[summary["kind"] == "rows"]
+    if len(sample_rows) < len(params["samples"]):
+        return to_json_response([get_error_content(0)])
+
+    sample_names = list(dict.fromkeys(sample["name"] for sample in params["samples"]))
+    test_names = db.get_test_names(connection).set_index("id")["name"]
+
+    test_df = summary[summary["kind"] == "test"].copy()
+    test_df["test_name"] = test_df["key"].astype("int64").map(test_names)
+    test_df = test_df.astype({"count": "int64"})
+
+    if params["group_by"] == "samples":
+        group_creator_cn = "sample_name"
+        group_content_cn = "test_name"
+    elif params["group_by"] == "params":
+        group_creator_cn = "test_name"
+        group_content_cn = "sample_name"
+
+    content_list = []
+    for group in get_stats_groups(params, test_names):
+        stats_df = test_df[test_df[group_creator_cn] == group]
+        if len(stats_df) == 0:
+            continue
+        stats_df = stats_df.set_index(group_content_cn).sort_index()[stats_columns]
+        stats_df = stats_df.fillna(0).reset_index(names="row_name")
+        content_list.append(
+            get_table_content("test_stats", stats_df, f"Описательные статистики — {group}")
+        )
+
+    if params["calc_gender_stats"]:
+        # Строки без пола, как и в pandas-варианте (groupby), не считаются
+        gender_df = summary[(summary["kind"] == "gender") & summary["key"].notna()]
+        genders = {code: gender for gender, code in db.gender_codes.items()}
+        stats_df = (
+            gender_df.assign(gender=gender_df["key"].astype("int64").map(genders))
+            .pivot(index="sample_name", columns="gender", values="count")
+            .reindex(sample_names)
+            .fillna(0)
+            .astype("int64")
+        )
+        stats_df.columns = list(stats_df.columns)
+        stats_df["count_total"] = stats_df.sum(axis=1)
+        stats_df.reset_index(names="row_name", inplace=True)
+        stats_df.rename(columns={"м": "count_male", "ж": "count_female"}, inplace=True)
+        content_list.append(
+            get_table_content("gender_stats", stats_df, "Описательные статистики — Пол")
+        )
+
+    if params["calc_age_stats"]:
+        stats_df = summary[summary["kind"] == "age"]
+        stats_df = stats_df.set_index("sample_name").sort_index()[stats_columns]
+        stats_df = stats_df.astype({"count": "int64", "min": "int64", "max": "int64"})
+        stats_df = stats_df.fillna(0).reset_index(names="row_name")
+        content_list.append(
+            get_table_content("age_stats", stats_df, "Описательные статистики — Возраст")
+        )
+
+    return to_json_response(content_list)
+
+
+# Потоковый вариант get_stats: выборки читаются фрагментами через db.iter_dataset,
+# статистики собираются накопителями, поэтому целиком выборка в памяти не хранится
+def get_stats_streaming(connection, params):
+
+    if params["group_by"] == "samples":
+        group_creator_cn = "sample_name"
+        group_content_cn = "test_name"
+    elif params["group_by"] == "params":
+        group_creator_cn = "test_name"
+        group_content_cn = "sample_name"
+
+    test_stats = accumulators.GroupedStats([group_creator_cn, group_content_cn], "result")
+    age_stats = accumulators.GroupedStats(["sample_name"], "patient_age_when_sampling")
+    gender_counts = {}
+
+    for sample in normalize_sample_diagnoses(connection, params["samples"]):
+        row_count = 0
+        for chunk in db.iter_dataset(connection, sample, params["test_ids"]):
+            chunk["sample_name"] = sample["name"]
+            row_count += len(chunk)
+
+            test_stats.update(chunk)
+            if params["calc_age_stats"]:
+                age_stats.update(chunk)
+            if params["calc_gender_stats"]:
+                counts = gender_counts.setdefault(sample["name"], pd.Series(dtype="int64"))
+                chunk_counts = chunk["gender"].value_counts().astype("int64")
+                gender_counts[sample["name"]] = counts.add(chunk_counts, fill_value=0)
+
+        if row_count == 0:
+            return to_json_response([get_error_content(0)])
+
+    test_names = db.get_test_names(connection).set_index("id")["name"]
+    content_list = [
+        get_table_content("test_stats", stats["df"], stats["title"])
+        for stats in get_test_stats_streaming(test_stats, get_stats_groups(params, test_names))
+    ]
+
+    if params["calc_gender_stats"]:
+        gender_stats = get_gender_stats_streaming(gender_counts)
+        content_list.append(
+            get_table_content("gender_stats", gender_stats["df"], gender_stats["title"])
+        )
+
+    if params["calc_age_stats"]:
+        age_stats = get_age_stats_streaming(age_stats)
+        content_list.append(
+            get_table_content("age_stats", age_stats["df"], age_stats["title"])
+        )
+
+    return to_json_response(content_list)
+
+
+def get_test_stats_streaming(grouped_stats, groups):
+    df = grouped_stats.to_frame()
+    results = []
+    for group in groups:
+        if group not in grouped_stats.first_key_order:
+            continue
+        stats_df = df.xs(group, level=0)
+        stats_df = stats_df.fillna(0).reset_index(names="row_name")
+        results.append(dict(df=stats_df, title=f"Описательные статистики — {group}"))
+
+    return results
+
+
+def get_gender_stats_streaming(gender_counts):
+    rows = []
+    for counts in gender_counts.values():
+        counts = counts.sort_values(ascending=False).astype("int64")
+        row = counts.to_dict()
+        row["count_total"] = counts.sum()
+        rows.append(row)
+    stats_df = pd.DataFrame(rows, index=list(gender_counts.keys()))
+    stats_df.fillna(0, inplace=True)
+    stats_df.reset_index(names="row_name", inplace=True)
+    stats_df.rename(columns={"м": "count_male", "ж": "count_female"}, inplace=True)
+    return dict(df=stats_df, title="Описательные статистики — Пол")
+
+
+def get_age_stats_streaming(grouped_stats):
+    stats_df = grouped_stats.to_frame()
+    stats_df.index = stats_df.index.get_level_values(0)
+    stats_df.fillna(0, inplace=True)
+    stats_df.reset_index(names="row_name", inplace=True)
+    return dict(df=stats_df, title="Описательные статистики — Возраст")
+
+
 ### Изучение распределения ###
 
 
@@ -356,28 +567,25 @@ def get_hist():
     valid = params_validate(params, schemas.hist)
     if valid != 0: return valid
 
-    df = get_df(connection, params)
-    if isinstance(df, Response): return df
-
-    col = df["result"]
-    df = df[np.abs(scipy_stats.zscore(col)) < params["z_value"]]
+    return get_plot_response("hist", params, prepare_hist)
 
-    df.rename(columns=columns_translator, inplace=True)
 
-    figure = Figure(figsize=common_figure_size)
-    ax = figure.add_subplot(1, 1, 1)
-    ax.set_title("Гистограмма распределения")
+def prepare_hist(connection, params):
+    df = get_df(connection, params)
+    if isinstance(df, Response): return df
 
-    sns.histplot(
-        df,
-        x=columns_translator["result"],
-        bins=params["bins"],
-        kde=params["density"],
-        ax=ax,
-    ).set(ylabel="Частота")
+    df = filter_outliers(df, params, ["result"])
 
-    content = get_image_content("hist", figure)
-    return to_json_response([content])
+    spec = {
+        "kind": "hist",
+        "title": "Гистограмма распределения",
+        "figsize": common_figure_size,
+        "x": columns_translator["result"],
+        "bins": params["bins"],
+        "kde": params["density"],
+        "ylabel": "Частота",
+    }
+    return spec, df[["result"]].rename(columns=columns_translator)
 
 
 def get_density():
@@ -385,19 +593,22 @@ def get_density():
     valid = params_validate(params, schemas.density)
     if valid != 0: return valid
 
-    df = get_df(connection, params, pivot=True)
-    if isinstance(df, Response): return df
+    return get_plot_response("density", params, prepare_density)
 
-    df = df[np.abs(scipy_stats.zscore(df.iloc[:, -1])) < params["z_value"]]
 
-    figure = Figure(figsize=common_figure_size)
-    ax = figure.add_subplot(1, 1, 1)
-    ax.set_title("График плотности")
+def prepare_density(connection, params):
+    df = get_df(connection, params, pivot=True)
+    if isinstance(df, Response): return df
 
-    sns.kdeplot(df, ax=ax).set(ylabel="Плотность")
+    df = filter_outliers(df, params, [df.columns[-1]])
 
-    content = get_image_content("density", figure)
-    return to_json_response([content])
+    spec = {
+        "kind": "kde",
+        "title": "График плотности",
+        "figsize": common_figure_size,
+        "ylabel": "Плотность",
+    }
+    return spec, df.reset_index(drop=True)
 
 
 def get_box():
@@ -405,32 +616,29 @@ def get_box():
     valid = params_validate(params, schemas.box_violin)
     if valid != 0: return valid
 
+    return get_plot_response("box", params, prepare_box)
+
+
+def prepare_box(connection, params):
     dfs = get_df(connection, params)
     if isinstance(dfs, Response): return dfs
 
     for i in range(len(dfs)):
-        col = dfs[i]["result"]
-        dfs[i] = dfs[i][np.abs(scipy_stats.zscore(col)) < params["z_value"]]
-
-    for i in range(len(dfs)):
+        dfs[i]["sample_number"] = i
         dfs[i]["sample_name"] = params["samples"][i]["name"]
 
-    final_df = pd.concat(dfs)
+    # Выбросы ищутся в каждой выборке отдельно
+    final_df = filter_outliers(pd.concat(dfs), params, ["result"], "sample_number")
     final_df.rename(columns=columns_translator, inplace=True)
 
-    figure = Figure(figsize=common_figure_size)
-    ax = figure.add_subplot(1, 1, 1)
-    ax.set_title("Ящичная диаграмма")
-
-    sns.boxplot(
-        data=final_df,
-        x=columns_translator["sample_name"],
-        y=columns_translator["result"],
-        ax=ax,
-    )
-
-    content = get_image_content("box", figure)
-    return to_json_response([content])
+    spec = {
+        "kind": "box",
+        "title": "Ящичная диаграмма",
+        "figsize": common_figure_size,
+        "x": columns_translator["sample_name"],
+        "y": columns_translator["result"],
+    }
+    return spec, final_df[[spec["x"], spec["y"]]]
 
 
 def get_violin():
@@ -438,32 +646,29 @@ def get_violin():
     valid = params_validate(params, schemas.box_violin)
     if valid != 0: return valid
 
+    return get_plot_response("violin", params, prepare_violin)
+
+
+def prepare_violin(connection, params):
     dfs = get_df(connection, params)
     if isinstance(dfs, Response): return dfs
-    
-    for i in range(len(dfs)):
-        col = dfs[i]["result"]
-        dfs[i] = dfs[i][np.abs(scipy_stats.zscore(col)) < params["z_value"]]
 
     for i in range(len(dfs)):
+        dfs[i]["sample_number"] = i
         dfs[i]["sample_name"] = params["samples"][i]["name"]
 
-    final_df = pd.concat(dfs)
+    # Выбросы ищутся в каждой выборке отдельно
+    final_df = filter_outliers(pd.concat(dfs), params, ["result"], "sample_number")
     final_df.rename(columns=columns_translator, inplace=True)
 
-    figure = Figure(figsize=common_figure_size)
-    ax = figure.add_subplot(1, 1, 1)
-    ax.set_title("Скрипичная диаграмма")
-
-    sns.violinplot(
-        data=final_df,
-        x=columns_translator["sample_name"],
-        y=columns_translator["result"],
-        ax=ax,
-    )
-
-    content = get_image_content("violin", figure)
-    return to_json_response([content])
+    spec = {
+        "kind": "violin",
+        "title": "Скрипичная диаграмма",
+        "figsize": common_figure_size,
+        "x": columns_translator["sample_name"],
+        "y": columns_translator["result"],
+    }
+    return spec, final_df[[spec["x"], spec["y"]]]
 
 
 ### Изучение корреляции и многомерного распределения ###
@@ -474,28 +679,26 @@ def get_scatter():
     valid = params_validate(params, schemas.scatter_hex)
     if valid != 0: return valid
 
+    return get_plot_response("scatter", params, prepare_scatter)
+
+
+def prepare_scatter(connection, params):
     df = get_df(connection, params, pivot=True)
     if isinstance(df, Response): return df
 
-    df = df[np.abs(scipy_stats.zscore(df.iloc[:, 0])) < params["z_value"]]
-    df = df[np.abs(scipy_stats.zscore(df.iloc[:, 1])) < params["z_value"]]
-
-    figure = Figure(figsize=square_figure_size)
-    ax = figure.add_subplot(1, 1, 1)
-    ax.set_title("Диаграмма рассеяния")
-
-    sns.scatterplot(
-        df,
-        x=df.columns[1],
-        y=df.columns[0],
-        ax=ax,
-        size=[1] * len(df),
-        sizes=(10, 10),
-        legend=False,
-    )
+    df = filter_outliers(df, params, [df.columns[0], df.columns[1]])
 
-    content = get_image_content("scatter", figure)
-    return to_json_response([content])
+    x, y = df.columns[1], df.columns[0]
+    df_to_draw = downsample.thin(df, [x, y], downsample.max_points_to_draw)
+
+    spec = {
+        "kind": "scatter",
+        "title": downsample.get_title("Диаграмма рассеяния", len(df_to_draw), len(df)),
+        "figsize": square_figure_size,
+        "x": x,
+        "y": y,
+    }
+    return spec, df_to_draw[[x, y]].reset_index(drop=True)
 
 
 def get_hex():
@@ -503,29 +706,78 @@ def get_hex():
     valid = params_validate(params, schemas.scatter_hex)
     if valid != 0: return valid
 
+    return get_plot_response("hex", params, prepare_hex)
+
+
+def prepare_hex(connection, params):
     df = get_df(connection, params, pivot=True)
     if isinstance(df, Response): return df
 
-    df = df[np.abs(scipy_stats.zscore(df[df.columns[-2]])) < params["z_value"]]
-    df = df[np.abs(scipy_stats.zscore(df[df.columns[-1]])) < params["z_value"]]
+    df = filter_outliers(df, params, [df.columns[-2], df.columns[-1]])
 
-    figure = sns.jointplot(
-        df,
-        x=df.columns[-2],
-        y=df.columns[-1],
-        kind="hex",
-        height=figure_height,
-    ).figure
+    spec = {
+        "kind": "hex",
+        "title": "Сетка шестиугольников",
+        "height": figure_height,
+        "x": df.columns[-2],
+        "y": df.columns[-1],
+    }
+    return spec, df[[spec["x"], spec["y"]]].reset_index(drop=True)
 
-    figure.suptitle("Сетка шестиугольников", y=1)
 
-    content = get_image_content("hex", figure)
-    return to_json_response([content])
+# Корреляции всех пар тестов test_ids с попарным исключением пропусков: таблица пар
+# с q-значениями и тепловая карта матрицы (см. correlation)
+def get_correlation():
+    params = request.json
+    valid = params_validate(params, schemas.correlation)
+    if valid != 0: return valid
+
+    connection = pool.get_connection()
+    [sample] = normalize_sample_diagnoses(connection, [params["sample"]])
+    df = cache.get_pivot(connection, sample, params["test_ids"], complete_cases=False)
+    if len(df)==0: return to_json_response([get_error_content(0)])
+
+    method = params.get("method", "pearson")
+    r, n, pvalue = correlation.get_correlation(df.to_numpy(), method)
+    names = [str(_) for _ in df.columns]
+
+    spec = {
+        "kind": "heatmap",
+        "title": f"Корреляционная матрица ({correlation.methods[method]})",
+        "figsize": (max(figure_height, 0.4 * len(names)),) * 2,
+        "annot": len(names) <= 12,
+    }
+    matrix = pd.DataFrame(r, columns=names)
+    # Матрица уже посчитана для таблицы пар: при промахе кэша графиков
+    # остается только отрисовать ее
+    heatmap_content = get_plot_output("heatmap", params, lambda connection, params: (spec, matrix))
+
+    res = correlation.get_pairs_table(names, r, n, pvalue, params["threshold"])
+    table_content = get_table_content("correlation_stats", res, "Корреляции пар тестов")
+    return to_json_response([heatmap_content, table_content])
 
 
 ### Проверка статистических гипотез ###
 
 
+# С inference "resampling" к параметрическим результатам добавляется таблица
+# перестановочных p-значений и бутстреп-интервалов (см. resampling). items — список
+# (название теста, значения выборок), differences — разности каждой выборки с первой,
+# overall — статистика для всех выборок сразу
+def get_resampling_content(content_name, params, items, names, differences, overall=None):
+    res = resampling.compare(
+        items,
+        names,
+        differences,
+        overall,
+        params["threshold"],
+        params.get("resamples"),
+        params.get("seed", 0),
+        params.get("time_budget"),
+    )
+    return get_table_content(content_name, res, "Результаты перестановочного критерия и бутстрепа")
+
+
 def get_ttest():
     params = request.json
 
@@ -534,7 +786,7 @@ def get_ttest():
         valid = params_validate(params, schemas.ttest0)
         if valid != 0: return valid
 
-        df = get_df(connection, params, pivot=True, pivot_columns="test_id")
+        df = get_df(pool.get_connection(), params, pivot=True, pivot_columns="test_id")
         if isinstance(df, Response): return df
 
         pr_res = scipy_stats.pearsonr(df[params["test_id1"]], df[params["test_id2"]])
@@ -556,7 +808,7 @@ def get_ttest():
         valid = params_validate(params, schemas.ttest1)
         if valid != 0: return valid
 
-        df = get_df(connection, params, pivot=True)
+        df = get_df(pool.get_connection(), params, pivot=True)
         if isinstance(df, Response): return df
 
         tt_res = scipy_stats.ttest_1samp(df, params["value"])
@@ -579,11 +831,11 @@ def get_ttest():
         if valid != 0: return valid
 
         params["sample"] = params["sample1"]
-        df1 = get_df(connection, params, pivot=True)
+        df1 = get_df(pool.get_connection(), params, pivot=True)
         if isinstance(df1, Response): return df1
 
         params["sample"] = params["sample2"]
-        df2 = get_df(connection, params, pivot=True)
+        df2 = get_df(pool.get_connection(), params, pivot=True)
         if isinstance(df2, Response): return df2
 
         # equal_var:
@@ -615,6 +867,14 @@ def get_ttest():
         res = pd.DataFrame.from_dict(res)
     
     content_list = [get_table_content("ttest_stats", res, "Результаты t-статистики")]
+    if params["ttest_type"] == 2 and params.get("inference") == "resampling":
+        content_list.append(get_resampling_content(
+            "ttest_resampling",
+            params,
+            [(_, [df1[_], df2[_]]) for _ in df1.columns],
+            [params["sample1"]["name"], params["sample2"]["name"]],
+            ["mean_difference", "median_difference"],
+        ))
     return content_list
 
 
@@ -625,8 +885,9 @@ def get_mediantest():
     # minimum 2 samples 
     if len(params["samples"]) < 2: return to_json_response([get_error_content(2)])
     
-    dfs = get_df(connection, params, pivot=True)
+    dfs = get_df(pool.get_connection(), params, pivot=True)
     if isinstance(dfs, Response): return dfs
+    test_name = dfs[0].columns[0]
     for _ in range(len(dfs)):
         dfs[_] = dfs[_].values.flatten()
 
@@ -642,6 +903,15 @@ def get_mediantest():
     }
     
     content_list = [get_table_content("mediantest_stats", res, "Результаты медианного критерия")]
+    if params.get("inference") == "resampling":
+        content_list.append(get_resampling_content(
+            "mediantest_resampling",
+            params,
+            [(test_name, dfs)],
+            [_["name"] for _ in params["samples"]],
+            ["median_difference"],
+            "median_test",
+        ))
     return content_list
 
 
@@ -652,7 +922,7 @@ def get_oneway_anova():
     # minimum 2 samples 
     if len(params["samples"]) < 2: return to_json_response([get_error_content(2)])
 
-    dfs = get_df(connection, params, pivot=True)
+    dfs = get_df(pool.get_connection(), params, pivot=True)
     if isinstance(dfs, Response): return dfs
 
     owa_res = scipy_stats.f_oneway(*dfs)
@@ -673,6 +943,40 @@ def get_oneway_anova():
     res = pd.DataFrame.from_dict(res)
     
     content_list = [get_table_content("owa_stats", res, "Результаты однофакторного дисперсионного анализа")]
+    if params.get("inference") == "resampling":
+        content_list.append(get_resampling_content(
+            "owa_resampling",
+            params,
+            [(_, [df[_] for df in dfs]) for _ in dfs[0].columns],
+            [_["name"] for _ in params["samples"]],
+            ["mean_difference"],
+            "anova",
+        ))
+    return content_list
+
+
+# Скрининг всех тестов (или test_ids) по выборкам: первая выборка — опорная,
+# поправка FDR на все проверенные гипотезы сразу (см. screening)
+def get_screening():
+    params = request.json
+    valid = params_validate(params, schemas.screening)
+    if valid != 0: return valid
+    # minimum 2 samples
+    if len(params["samples"]) < 2: return to_json_response([get_error_content(2)])
+
+    connection = pool.get_connection()
+    samples = normalize_sample_diagnoses(connection, params["samples"])
+    dfs = cache.get_datasets(connection, samples, params.get("test_ids"))
+    if any([len(_)==0 for _ in dfs]): return to_json_response([get_error_content(0)])
+
+    res = screening.screen(
+        dfs,
+        [sample["name"] for sample in params["samples"]],
+        params["threshold"],
+        params.get("fdr_method", "fdr_bh"),
+    )
+
+    content_list = [get_table_content("screening_stats", res, "Результаты скрининга гипотез")]
     return content_list
 
 
@@ -684,63 +988,72 @@ def get_kmeans():
     valid = params_validate(params, schemas.kmeans)
     if valid != 0: return valid
 
+    connection = pool.get_connection()
     dfs = get_df(connection, params)
     if isinstance(dfs, Response): return dfs
 
     df = pd.concat(dfs)
     df.drop_duplicates(["referral_header_id", "test_name"], inplace=True)
     pivot_df = (
-        df
-        .pivot(
-            index=["referral_header_id", "gender", "patient_age_when_sampling"],
-            columns="test_name",
-            values="result",
-        )
-        .dropna()
+        pivot.pivot_results(df, "test_name")
         .reset_index(["gender", "patient_age_when_sampling"])
     )
-    for _ in pivot_df.columns:
-        if _!="gender": pivot_df = pivot_df[np.abs(scipy_stats.zscore(pivot_df[_])) < params["z_value"]]
+    pivot_df = filter_outliers(pivot_df, params, [_ for _ in pivot_df.columns if _ != "gender"])
     pivot_df = pd.get_dummies(pivot_df, columns=["gender"])
 
-    splom_figure, stats = clust_kmeans(
-        df, pivot_df, params["cluster_count"], params["dist_metric"]
+    # Центры прошлого запроса для тех же выборок, тестов и фильтра выбросов
+    # (при другом числе кластеров или метрике) — начальные для нового (см. clustering)
+    warm_start_key = plot_cache.get_plot_key(
+        "kmeans",
+        {name: value for name, value in params.items() if name not in ("cluster_count", "dist_metric")},
+        connection,
+    )
+    splom_png, stats = clust_kmeans(
+        df, pivot_df, params["cluster_count"], params["dist_metric"], warm_start_key
     )
 
-    splom_content = get_image_content("splom", splom_figure)
+    splom_content = get_image_content("splom", splom_png, params.get("image_format"))
 
     return to_json_response([splom_content] + stats)
 
 
-def clust_kmeans(original_df, pivot_df, cluster_count, dist_metric):
+def clust_kmeans(original_df, pivot_df, cluster_count, dist_metric, warm_start_key=None):
     norm_df = pivot_df.copy()
     for _ in norm_df.columns: norm_df[_] = scipy_stats.zscore(norm_df[_])
-    
-    init_centers = kmeans_plusplus_initializer(norm_df, cluster_count).initialize()
-    metric = distance_metric(dist_metrics[dist_metric])
-    model = kmeans(norm_df, initial_centers=init_centers, metric=metric)
-    model.process()
+    # Постоянная колонка (например, пол в выборке одного пола) дает NaN
+    # и на кластеры не влияет
+    norm_values = np.nan_to_num(norm_df.to_numpy(dtype="float64"))
 
-    encoder = cluster_encoder(
-        model.get_cluster_encoding(), model.get_clusters(), pivot_df
-    )
-    pivot_df["cluster"] = encoder.set_encoding(0).get_clusters()
+    pivot_df["cluster"] = clustering.fit(norm_values, cluster_count, dist_metric, warm_start_key)
     pivot_df["cluster"] += 1
     
-    elems_to_draw = min(pivot_df.shape[0], 1000)
-    df_to_draw = pivot_df.sample(elems_to_draw)
-    df_to_draw.rename(columns=columns_translator, inplace=True)
-    if gender_male_one_hot in df_to_draw.columns: df_to_draw.drop(columns=[gender_male_one_hot], inplace=True)
-    if gender_female_one_hot in df_to_draw.columns: df_to_draw.drop(columns=[gender_female_one_hot], inplace=True)
+    df_to_draw = get_splom_df(pivot_df)
 
-    splom_figure = sns.pairplot(
-        df_to_draw, hue=columns_translator["cluster"], palette="pastel"
-    ).figure
-    splom_figure.suptitle("Матрица сравнения кластеров", y=1)
+    # Таблицы статистик считаются, пока график рисуется в процессе отрисовки
+    splom_png = render.submit(
+        get_splom_spec(len(df_to_draw), len(pivot_df)), df_to_draw.reset_index(drop=True)
+    )
 
     stats = get_clusters_stats(original_df, pivot_df)
 
-    return splom_figure, stats
+    return splom_png, stats
+
+
+# Точки для матрицы диаграмм: прореживание с сохранением долей кластеров
+# (малые кластеры не пропадают, см. downsample.thin)
+def get_splom_df(pivot_df):
+    df_to_draw = pivot_df.drop(columns=[gender_male_one_hot, gender_female_one_hot], errors="ignore")
+    columns = [_ for _ in df_to_draw.columns if _ != "cluster"]
+    df_to_draw = downsample.thin(df_to_draw, columns, downsample.max_points_to_draw_pairplot, strata="cluster")
+    return df_to_draw.rename(columns=columns_translator)
+
+
+def get_splom_spec(shown, total):
+    return {
+        "kind": "pairplot",
+        "title": downsample.get_title("Матрица сравнения кластеров", shown, total),
+        "hue": columns_translator["cluster"],
+    }
 
 
 def get_clusters_stats(original_df, pivot_df):
@@ -795,7 +1108,7 @@ def get_associated_diagnoses(cluster_df):
         filter = cluster_df["cluster"] == c
         filtered_df = cluster_df[filter]
         patient_ids = filtered_df["patient_id"].unique().tolist()
-        asd = db.get_associated_diagnoses(connection, patient_ids)
+        asd = db.get_associated_diagnoses(pool.get_connection(), patient_ids)
         asd["cluster"] = f"cluster{i}"
         dfs.append(asd.sort_values("count", ascending=False).head(10))
         i += 1
@@ -841,46 +1154,39 @@ def get_hierarchy():
     valid = params_validate(params, schemas.hierarchy)
     if valid != 0: return valid
 
-    dfs = get_df(connection, params)
+    dfs = get_df(pool.get_connection(), params)
     if isinstance(dfs, Response): return dfs
 
     df = pd.concat(dfs)
     df.drop_duplicates(["referral_header_id", "test_name"], inplace=True)
     pivot_df = (
-        df
-        .drop_duplicates(["referral_header_id", "test_name"])
-        .pivot(
-            index=["referral_header_id", "gender", "patient_age_when_sampling"],
-            columns="test_name",
-            values="result",
-        )
-        .dropna()
+        pivot.pivot_results(df, "test_name")
         .reset_index(["gender", "patient_age_when_sampling"])
     )
-    for _ in pivot_df.columns:
-        if _!="gender": pivot_df = pivot_df[np.abs(scipy_stats.zscore(pivot_df[_])) < params["z_value"]]
+    pivot_df = filter_outliers(pivot_df, params, [_ for _ in pivot_df.columns if _ != "gender"])
     pivot_df = pd.get_dummies(pivot_df, columns=["gender"])
 
-    dendrogram_figure, splom_figure, stats = clust_hierarchy(
+    dendrogram_png, splom_png, stats = clust_hierarchy(
         df, pivot_df, params["cluster_count"]
     )
 
-    dendrogram_content = get_image_content("dendrogram", dendrogram_figure)
-    splom_content = get_image_content("splom", splom_figure)
+    dendrogram_content = get_image_content("dendrogram", dendrogram_png, params.get("image_format"))
+    splom_content = get_image_content("splom", splom_png, params.get("image_format"))
 
     return to_json_response([dendrogram_content, splom_content] + stats)
 
 
+# Дендрограмма и матрица диаграмм рисуются параллельно (render.submit)
 def clust_hierarchy(original_df, pivot_df, k):
-    dendrogram_figure = clust_hierarchy_distance_threshold(
+    dendrogram_png = clust_hierarchy_distance_threshold(
         pivot_df, truncate_mode="level", p=3
     )
     
-    splom_figure, stats = clust_hierarchy_extract_clusters(
+    splom_png, stats = clust_hierarchy_extract_clusters(
         pivot_df, original_df, k
     )
 
-    return dendrogram_figure, splom_figure, stats
+    return dendrogram_png, splom_png, stats
 
 
 def clust_hierarchy_distance_threshold(pivot_df, dist=0, **kwargs):
@@ -888,11 +1194,6 @@ def clust_hierarchy_distance_threshold(pivot_df, dist=0, **kwargs):
     for _ in norm_df.columns: norm_df[_] = scipy_stats.zscore(norm_df[_])
     
     model = AgglomerativeClustering(n_clusters=None, distance_threshold=dist).fit(norm_df)
-    dendrogram_figure = Figure(figsize=[12, 9])
-    ax = dendrogram_figure.add_subplot(1, 1, 1)
-    ax.set_xlabel(
-        "Без скобок указывается индекс одного объекта, со скобками указывается кол-во объектов в группе"
-    )
 
     # https://scikit-learn.org/stable/auto_examples/cluster/plot_agglomerative_dendrogram.html
     # create the counts of samples under each node
@@ -914,12 +1215,13 @@ def clust_hierarchy_distance_threshold(pivot_df, dist=0, **kwargs):
     ]).astype(float)
 
     # plot the corresponding dendrogram
-    dendrogram(linkage_matrix, **kwargs, ax=ax)
-    bytes = io.BytesIO()
-    dendrogram_figure.savefig(bytes, format="png")
-    # encoded_dendrogram = base64.b64encode(bytes.getvalue()).decode("ascii")
-
-    return dendrogram_figure
+    spec = {
+        "kind": "dendrogram",
+        "figsize": [12, 9],
+        "xlabel": "Без скобок указывается индекс одного объекта, со скобками указывается кол-во объектов в группе",
+        "options": kwargs,
+    }
+    return render.submit(spec, pd.DataFrame(linkage_matrix))
 
 
 def clust_hierarchy_extract_clusters(pivot_df, original_df, k):
@@ -930,29 +1232,12 @@ def clust_hierarchy_extract_clusters(pivot_df, original_df, k):
     pivot_df["cluster"] = model.labels_
     pivot_df["cluster"] += 1
 
-    elems_to_draw = min(pivot_df.shape[0], 1000)
-    df_to_draw = pivot_df.sample(elems_to_draw)
-    df_to_draw.rename(columns=columns_translator, inplace=True)
-    if gender_male_one_hot in df_to_draw.columns: df_to_draw.drop(columns=[gender_male_one_hot], inplace=True)
-    if gender_female_one_hot in df_to_draw.columns: df_to_draw.drop(columns=[gender_female_one_hot], inplace=True)
-    
-    splom_figure = sns.pairplot(
-        df_to_draw, hue=columns_translator["cluster"], palette="pastel"
-    ).figure
-    splom_figure.suptitle("Матрица сравнения кластеров", y=1)
-
-    stats = get_clusters_stats(original_df, pivot_df)
-
-    return splom_figure, stats
+    df_to_draw = get_splom_df(pivot_df)
 
+    splom_png = render.submit(
+        get_splom_spec(len(df_to_draw), len(pivot_df)), df_to_draw.reset_index(drop=True)
+    )
 
-def lof(df):
-    model = LocalOutlierFactor(n_neighbors=20, contamination=0.1)
-    model.fit_predict(df)
-    scores = model.negative_outlier_factor_  # lof scores
-
-    # getting lowest 5 percent of score values as the anomalies
-    threshold = np.quantile(scores, 0.05)
-    anomalies = df.iloc[np.where(scores <= threshold)]
+    stats = get_clusters_stats(original_df, pivot_df)
 
-    return df.drop(anomalies.index)
+    return splom_png, stats
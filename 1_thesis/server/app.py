@@ -1,4 +1,5 @@
 import api
+import pool
 from flask import Flask, jsonify, request
 from flask_cors import CORS
 
@@ -10,6 +11,10 @@ rules = [
     # Получение данных для списков
     ("/api/tests", api.get_tests, ["GET"]),
     ("/api/diagnoses", api.get_diagnoses, ["GET"]),
+    # Состояние кэшей сервера
+    ("/api/cache", api.get_cache_stats, ["GET"]),
+    # Картинки графиков по ссылкам из ответов (image_format: "url")
+    ("/api/images/<key>.png", api.get_image, ["GET"]),
     # Описательные статистики
     ("/api/stats", api.get_stats, ["POST"]),
     # Изучение распределения
@@ -20,10 +25,12 @@ rules = [
     # Изучение корреляции и многомерного распределения
     ("/api/scatter", api.get_scatter, ["POST"]),
     ("/api/hex", api.get_hex, ["POST"]),
+    ("/api/correlation", api.get_correlation, ["POST"]),
     # Оценка статистических гипотез
     ("/api/ttest", api.get_ttest, ["POST"]),
     ("/api/mediantest", api.get_mediantest, ["POST"]),
     ("/api/oneway_anova", api.get_oneway_anova, ["POST"]),
+    ("/api/screening", api.get_screening, ["POST"]),
     # Анализ скрытых закономерностей (data-mining)
     ("/api/hierarchy", api.get_hierarchy, ["POST"]),
     ("/api/kmeans", api.get_kmeans, ["POST"]),
@@ -32,5 +39,8 @@ rules = [
 for rule in rules:
     app.add_url_rule(rule=rule[0], view_func=rule[1], methods=rule[2])
 
+# Соединение с БД, взятое из пула во время запроса, возвращается в пул по его завершении
+app.teardown_appcontext(pool.release_connection)
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,334 @@
+import threading
+import time
+from collections import OrderedDict
+
+import common
+import db
+import pandas as pd
+import pivot
+from dotenv import dotenv_values
+
+config = dotenv_values(common.ENV_FILE)
+
+# Кэш выборок в памяти процесса. Аналитик обычно строит несколько графиков и таблиц
+# по одной и той же выборке, поэтому повторные запросы отдаются без обращения к БД
+max_bytes = int(config.get("SAMPLE_CACHE_MAX_BYTES") or 512 * 2**20)
+ttl = float(config.get("SAMPLE_CACHE_TTL") or 3600)  # seconds
+# Как часто сверять версию данных в БД (см. db.get_data_version)
+version_check_interval = float(config.get("SAMPLE_CACHE_VERSION_CHECK_INTERVAL") or 10)  # seconds
+
+
+def normalize_date(value):
+    return pd.Timestamp(value).date().isoformat()
+
+
+# Ключ фильтра не зависит от порядка диагнозов/районов и формата дат,
+# а также от названия и номера выборки, которые на данные не влияют
+def get_sample_key(sample_filter):
+    district = sorted(set(sample_filter["district"]))
+    if district == [-1]:
+        district = []
+
+    return (
+        tuple(sample_filter["age_interval"]),
+        tuple(normalize_date(d) for d in sample_filter["sampling_date_interval"]),
+        tuple(sorted(set(sample_filter["diagnoses"]))),
+        tuple(district),
+        sample_filter["gender"],
+    )
+
+
+def get_test_key(test_ids):
+    if test_ids is None:
+        return None
+    if type(test_ids) == int:
+        test_ids = [test_ids]
+    return tuple(sorted(set(test_ids)))
+
+
+# Выборка key является частью выборки other_key, если совпадают фильтры по диагнозам,
+# районам и полу, интервалы возраста и дат other_key включают интервалы key,
+# а набор тестов other_key включает набор тестов key (None = все тесты)
+def is_contained(key, other_key):
+    (age, dates, diagnoses, district, gender), tests = key
+    (other_age, other_dates, other_diagnoses, other_district, other_gender), other_tests = other_key
+
+    if (diagnoses, district, gender) != (other_diagnoses, other_district, other_gender):
+        return False
+    if not (other_age[0] <= age[0] and age[1] <= other_age[1]):
+        return False
+    if not (other_dates[0] <= dates[0] and dates[1] <= other_dates[1]):
+        return False
+    if other_tests is None:
+        return True
+    return tests is not None and set(tests) <= set(other_tests)
+
+
+# Вырезает из более широкой выборки строки, соответствующие key
+def filter_contained(df, key):
+    (age, dates, _, _, _), tests = key
+
+    age_column = df["patient_age_when_sampling"]
+    date_column = df["sampling_date"]
+    mask = (
+        (age_column >= age[0])
+        & (age_column <= age[1])
+        & (date_column >= pd.Timestamp(dates[0]))
+        & (date_column <= pd.Timestamp(dates[1]))
+    )
+    if tests is not None:
+        mask &= df["test_id"].isin(tests)
+
+    df = df[mask].reset_index(drop=True)
+
+    # Категории тестов, которых нет в результате, иначе попадут в pivot и groupby
+    for column in df.select_dtypes("category").columns:
+        df[column] = df[column].cat.remove_unused_categories()
+
+    return df
+
+
+def get_df_nbytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class CacheEntry:
+    def __init__(self, df):
+        self.df = df
+        self.nbytes = get_df_nbytes(df)
+        self.created_at = time.monotonic()
+        # Производные таблицы той же выборки (например, результат pivot)
+        self.derived = {}
+
+
+class SampleCache:
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # от давно использованных к недавно использованным
+        self._bytes = 0
+
+        self.data_version = None
+        self._version_checked_at = None
+
+        self.hits = 0
+        self.containment_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._get_entry(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.df
+
+            # Точного совпадения нет: ищем наименьшую закэшированную выборку,
+            # которая содержит запрошенную
+            containing_key = None
+            for other_key in list(self._entries):
+                other = self._get_entry(other_key)
+                if other is None or not is_contained(key, other_key):
+                    continue
+                if containing_key is None or other.nbytes < entry.nbytes:
+                    containing_key, entry = other_key, other
+
+            if containing_key is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(containing_key)
+            self.containment_hits += 1
+
+        return filter_contained(entry.df, key)
+
+    # Возвращает запись, удаляя ее, если истек срок хранения
+    def _get_entry(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry.created_at > self.ttl:
+            self._remove(key)
+            self.expirations += 1
+            entry = None
+        return entry
+
+    def put(self, key, df):
+        entry = CacheEntry(df)
+        if entry.nbytes > self.max_bytes:
+            return entry
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += entry.nbytes
+
+            while self._bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+        return entry
+
+    def get_derived(self, key, derived_key):
+        with self._lock:
+            entry = self._get_entry(key)
+            if entry is None:
+                return None
+            return entry.derived.get(derived_key)
+
+    # Производная таблица хранится, только пока в кэше есть исходная выборка
+    def put_derived(self, key, derived_key, df):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or derived_key in entry.derived:
+                return
+
+            nbytes = get_df_nbytes(df)
+            entry.derived[derived_key] = df
+            entry.nbytes += nbytes
+            self._bytes += nbytes
+
+            while self._bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    # После импорта новых данных (import.py) версия в БД меняется и весь кэш сбрасывается
+    def check_version(self, connection):
+        now = time.monotonic()
+        if (
+            self._version_checked_at is not None
+            and now - self._version_checked_at < version_check_interval
+        ):
+            return
+
+        version = db.get_data_version(connection)
+        with self._lock:
+            self._version_checked_at = now
+            if version != self.data_version:
+                if self.data_version is not None:
+                    self.invalidations += 1
+                self._entries.clear()
+                self._bytes = 0
+                self.data_version = version
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "data_version": self.data_version,
+                "hits": self.hits,
+                "containment_hits": self.containment_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+sample_cache = SampleCache(max_bytes, ttl)
+
+
+# Замена db.get_dataset с кэшированием. Возвращается поверхностная копия, чтобы
+# добавление колонок в обработчиках api не меняло закэшированную выборку
+def get_dataset(connection, sample_filter, test_ids=None):
+    sample_cache.check_version(connection)
+
+    key = (get_sample_key(sample_filter), get_test_key(test_ids))
+    df = sample_cache.get(key)
+    if df is None:
+        df = db.get_dataset(connection, sample_filter, test_ids)
+        sample_cache.put(key, df)
+
+    return df.copy(deep=False)
+
+
+# Пакетный вариант get_dataset для нескольких выборок: выборки, которых нет в кэше,
+# читаются из БД одним запросом (db.get_datasets), одинаковые фильтры — один раз
+def get_datasets(connection, sample_filters, test_ids=None):
+    sample_cache.check_version(connection)
+
+    test_key = get_test_key(test_ids)
+    keys = [(get_sample_key(sample_filter), test_key) for sample_filter in sample_filters]
+
+    found = {}
+    missing = {}
+    for key, sample_filter in zip(keys, sample_filters):
+        if key in found or key in missing:
+            continue
+        df = sample_cache.get(key)
+        if df is None:
+            missing[key] = sample_filter
+        else:
+            found[key] = df
+
+    if missing:
+        dfs = db.get_datasets(connection, list(missing.values()), test_ids)
+        for key, df in zip(missing, dfs):
+            sample_cache.put(key, df)
+            found[key] = df
+
+    return [found[key].copy(deep=False) for key in keys]
+
+
+# Широкая таблица "направление × тест" (pivot.pivot_results) для выборки,
+# кэшируется вместе с исходной длинной выборкой
+def get_pivot(connection, sample_filter, test_ids=None, columns="test_name", complete_cases=True):
+    key = (get_sample_key(sample_filter), get_test_key(test_ids))
+    derived_key = ("pivot", columns, complete_cases)
+
+    sample_cache.check_version(connection)
+    pivot_df = sample_cache.get_derived(key, derived_key)
+    if pivot_df is None:
+        df = get_dataset(connection, sample_filter, test_ids)
+        pivot_df = pivot.pivot_results(df, columns, complete_cases)
+        sample_cache.put_derived(key, derived_key, pivot_df)
+
+    return pivot_df.copy(deep=False)
+
+
+# Пакетный вариант get_pivot: длинные выборки для недостающих таблиц
+# читаются через get_datasets
+def get_pivots(connection, sample_filters, test_ids=None, columns="test_name", complete_cases=True):
+    sample_cache.check_version(connection)
+
+    test_key = get_test_key(test_ids)
+    keys = [(get_sample_key(sample_filter), test_key) for sample_filter in sample_filters]
+    derived_key = ("pivot", columns, complete_cases)
+
+    pivots = {}
+    missing = {}
+    for key, sample_filter in zip(keys, sample_filters):
+        if key in pivots or key in missing:
+            continue
+        pivot_df = sample_cache.get_derived(key, derived_key)
+        if pivot_df is None:
+            missing[key] = sample_filter
+        else:
+            pivots[key] = pivot_df
+
+    if missing:
+        dfs = get_datasets(connection, list(missing.values()), test_ids)
+        for key, df in zip(missing, dfs):
+            pivot_df = pivot.pivot_results(df, columns, complete_cases)
+            sample_cache.put_derived(key, derived_key, pivot_df)
+            pivots[key] = pivot_df
+
+    return [pivots[key].copy(deep=False) for key in keys]
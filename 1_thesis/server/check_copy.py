@@ -0,0 +1,139 @@
+import multiprocessing
+import resource
+import sys
+import time
+
+import common
+import db
+import pandas as pd
+import psycopg2 as pg
+from dotenv import dotenv_values
+
+config = dotenv_values(common.ENV_FILE)
+
+# Сравнение двух способов получить выборку get_dataset в DataFrame на синтетических
+# строках (generate_series, таблицы базы не нужны):
+# - прежний: строки с названиями теста и пола, cursor.fetchall() (кортеж на строку)
+#   и pd.DataFrame(...), как get_dataset до перехода на COPY;
+# - текущий: строки вида витрины sample_fact с кодами, db.copy_result_as_df
+#   (COPY ... TO STDOUT в CSV и pd.read_csv в типизированные колонки) и
+#   db.decode_fact_df.
+# Каждый замер выполняется в отдельном процессе: выводятся время, прирост пикового
+# RSS процесса и размер итоговой таблицы. tracemalloc не используется: он в разы
+# замедляет создание кортежей в прежнем варианте и искажает время.
+# Запуск: python check_copy.py [число строк ...] [fetchall] [copy]
+# (по умолчанию 1M и 10M строк, оба способа; прежнему способу на 10M строк
+# нужно больше 5 ГБ памяти)
+
+test_count = 50
+
+old_query = """
+SELECT
+    g AS referral_header_id,
+    g / 3 AS patient_id,
+    g %% 500 AS diagnosis_id,
+    g %% {tests} + 1 AS test_id,
+    'Тест ' || (g %% {tests} + 1) AS test_name,
+    'T' || (g %% {tests} + 1) AS test_mnemonic,
+    DATE '2015-01-01' + (g %% 3000)::INT4 AS sampling_date,
+    round((random() * 100)::NUMERIC, 3)::FLOAT8 AS result,
+    (g %% 90)::INT2 AS patient_age_when_sampling,
+    CASE g %% 2 WHEN 0 THEN 'м' ELSE 'ж' END AS gender,
+    (g %% 20)::INT2 AS district_id
+FROM generate_series(1, %(rows)s) AS g;
+""".format(tests=test_count)
+
+new_query = """
+SELECT
+    g AS referral_header_id,
+    g / 3 AS patient_id,
+    g %% 500 AS diagnosis_id,
+    g %% {tests} + 1 AS test_id,
+    DATE '2015-01-01' + (g %% 3000)::INT4 AS sampling_date,
+    round((random() * 100)::NUMERIC, 3)::FLOAT8 AS result,
+    (g %% 90)::INT2 AS patient_age_when_sampling,
+    (g %% 2 + 1)::INT2 AS gender_code,
+    (g %% 20)::INT2 AS district_id
+FROM generate_series(1, %(rows)s) AS g;
+""".format(tests=test_count)
+
+
+def connect():
+    return pg.connect(
+        dbname=config["DB_NAME"],
+        user=config["DB_USER"],
+        password=config["DB_PASSWORD"],
+    )
+
+
+def fetch_old(connection, rows):
+    with connection.cursor() as cur:
+        cur.execute(old_query, {"rows": rows})
+        result = cur.fetchall()
+        col_names = [desc[0] for desc in cur.description]
+
+    return pd.DataFrame(result, columns=col_names)
+
+
+def fetch_new(connection, rows):
+    tests = pd.DataFrame({
+        "id": range(1, test_count + 1),
+        "name": [f"Тест {i}" for i in range(1, test_count + 1)],
+        "mnemonic": [f"T{i}" for i in range(1, test_count + 1)],
+    })
+    df = db.copy_result_as_df(
+        connection,
+        new_query,
+        {"rows": rows},
+        dtype=db.fact_dtypes,
+        parse_dates=db.fact_date_columns,
+    )
+    return db.decode_fact_df(df, tests)
+
+
+methods = {
+    "fetchall": fetch_old,
+    "copy": fetch_new,
+}
+
+
+# ru_maxrss в Linux — в килобайтах
+def get_max_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure(method, rows, results):
+    connection = connect()
+    rss_before = get_max_rss()
+
+    start = time.perf_counter()
+    df = methods[method](connection, rows)
+    elapsed = time.perf_counter() - start
+
+    results.put((elapsed, get_max_rss() - rss_before, df.memory_usage(deep=True).sum()))
+    connection.close()
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:] if arg not in methods] or [1_000_000, 10_000_000]
+    selected = [arg for arg in sys.argv[1:] if arg in methods] or list(methods)
+    context = multiprocessing.get_context("spawn")
+    mb = 2**20
+
+    print(f"{'rows':>9} {'method':<9} {'time':>8} {'RSS peak':>10} {'frame':>9}")
+    for rows in sizes:
+        for method in selected:
+            results = context.Queue()
+            process = context.Process(target=measure, args=(method, rows, results))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                print(f"{rows:>9} {method:<9} завершился с кодом {process.exitcode} (нехватка памяти?)")
+                continue
+
+            elapsed, rss, frame = results.get()
+            print(f"{rows:>9} {method:<9} {elapsed:>7.2f}s {rss / mb:>8.0f}MB {frame / mb:>7.0f}MB")
+
+
+if __name__ == "__main__":
+    main()
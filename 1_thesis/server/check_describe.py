@@ -0,0 +1,120 @@
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import api
+
+# Сравнение таблиц /api/stats (api.get_test_stats, get_gender_stats, get_age_stats
+# на одном проходе groupby) с прежней реализацией — циклом по группам с булевой
+# маской и квантилями через lambda — на синтетической выборке вида get_dataset:
+# 10 выборок × 50 тестов. Таблицы должны совпадать (у таблицы пола прежний вариант
+# упорядочивал колонки по частоте, поэтому порядок колонок не сравнивается),
+# выводится время обоих вариантов.
+# Запуск: python check_describe.py [число строк]
+
+sample_count = 10
+test_count = 50
+
+
+def q25(x):
+    return x.quantile(0.25)
+
+
+def q50(x):
+    return x.quantile(0.50)
+
+
+def q75(x):
+    return x.quantile(0.75)
+
+
+functions = ["count", "min", q25, q50, q75, "max", "mean", "std"]
+
+
+def get_test_stats_old(df, group_creator_cn, group_content_cn, value_cn):
+    results = []
+    for group in df[group_creator_cn].unique():
+        filtered_df = df[df[group_creator_cn] == group]
+
+        stats_df = filtered_df.groupby(group_content_cn, observed=True)[value_cn].aggregate(functions)
+        stats_df.fillna(0, inplace=True)
+        stats_df.reset_index(names="row_name", inplace=True)
+
+        results.append(dict(df=stats_df, title=f"Описательные статистики — {group}"))
+
+    return results
+
+
+def get_gender_stats_old(df, sample_cn, gender_cn):
+    rows = []
+    sample_names = df[sample_cn].unique()
+    for sample_name in sample_names:
+        filtered_df = df[df[sample_cn] == sample_name]
+        counts = filtered_df[gender_cn].value_counts()
+        row = counts.to_dict()
+        row["count_total"] = counts.sum()
+        rows.append(row)
+    stats_df = pd.DataFrame(rows, index=sample_names)
+    stats_df.fillna(0, inplace=True)
+    stats_df.reset_index(names="row_name", inplace=True)
+    stats_df.rename(columns={"м": "count_male", "ж": "count_female"}, inplace=True)
+    return dict(df=stats_df, title="Описательные статистики — Пол")
+
+
+def get_age_stats_old(df, sample_cn, age_cn):
+    stats_df = df.groupby(sample_cn, observed=True)[age_cn].aggregate(functions)
+    stats_df.fillna(0, inplace=True)
+    stats_df.reset_index(names="row_name", inplace=True)
+    return dict(df=stats_df, title="Описательные статистики — Возраст")
+
+
+def get_sample(rows, rng):
+    test_names = np.array([f"Тест {i:02}" for i in range(1, test_count + 1)], dtype=object)
+    sample_names = np.array([f"Выборка {i}" for i in range(1, sample_count + 1)], dtype=object)
+    tests = rng.integers(test_count, size=rows)
+    # Тест с единственным значением: std не определено и заменяется нулем
+    tests[tests == test_count - 1] = 0
+    tests[0] = test_count - 1
+
+    return pd.DataFrame({
+        "sample_name": sample_names[rng.integers(sample_count, size=rows)],
+        "test_name": pd.Categorical(test_names[tests]),
+        "result": np.round(rng.lognormal(1, 0.5, size=rows), 3),
+        "patient_age_when_sampling": rng.integers(0, 90, size=rows),
+        "gender": pd.Categorical(rng.choice(np.array(["м", "ж"], dtype=object), size=rows)),
+    })
+
+
+def get_tables(df, test_stats, gender_stats, age_stats):
+    tables = [stats["df"] for stats in test_stats(df, "sample_name", "test_name", "result")]
+    tables += [stats["df"] for stats in test_stats(df, "test_name", "sample_name", "result")]
+    tables.append(gender_stats(df, "sample_name", "gender")["df"])
+    tables.append(age_stats(df, "sample_name", "patient_age_when_sampling")["df"])
+    return tables
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    df = get_sample(rows, np.random.default_rng(0))
+
+    start = time.perf_counter()
+    old = get_tables(df, get_test_stats_old, get_gender_stats_old, get_age_stats_old)
+    old_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    new = get_tables(df, api.get_test_stats, api.get_gender_stats, api.get_age_stats)
+    new_time = time.perf_counter() - start
+
+    assert len(old) == len(new)
+    for old_table, new_table in zip(old, new):
+        assert set(old_table.columns) == set(new_table.columns)
+        pd.testing.assert_frame_equal(new_table, old_table[list(new_table.columns)], check_dtype=False)
+
+    print(f"{len(new)} таблиц совпадают с прежней реализацией")
+    print(f"{rows} строк, {sample_count} выборок × {test_count} тестов: прежний {old_time:.2f} s, текущий {new_time:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
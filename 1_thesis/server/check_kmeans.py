@@ -0,0 +1,98 @@
+import sys
+import time
+
+import numpy as np
+from pyclustering.cluster.center_initializer import kmeans_plusplus_initializer
+from pyclustering.cluster.kmeans import kmeans
+from pyclustering.utils.metric import distance_metric, type_metric
+from sklearn.metrics import adjusted_rand_score
+
+import clustering
+
+# Сравнение clustering.fit с прежней реализацией /api/kmeans на pyclustering
+# (k-means++ и kmeans с той же метрикой) на синтетических данных вида сводной
+# таблицы после z-нормировки: время одного запуска с k-means++ (как в pyclustering)
+# и clustering.fit со всеми перезапусками, отношение сумм расстояний до центров
+# у fit и pyclustering (меньше 1 — fit лучше) и согласие разбиений
+# (скорректированный индекс Рэнда). pyclustering запускается
+# без C++-ядра (ccore=False): оно собрано не для всех платформ и на некоторых
+# аварийно завершает процесс.
+# Запуск: python check_kmeans.py [число строк ...]
+
+pyclustering_metrics = {
+    "euclidean": type_metric.EUCLIDEAN,
+    "euclidean_square": type_metric.EUCLIDEAN_SQUARE,
+    "manhattan": type_metric.MANHATTAN,
+    "chebyshev": type_metric.CHEBYSHEV,
+    "minkowski": type_metric.MINKOWSKI,
+    "canberra": type_metric.CANBERRA,
+    "chi_square": type_metric.CHI_SQUARE,
+    "gower": type_metric.GOWER,
+}
+
+cluster_count = 4
+dimensions = 8
+
+
+def get_data(rows, rng):
+    centers = rng.normal(scale=3, size=(cluster_count, dimensions))
+    labels = rng.integers(cluster_count, size=rows)
+    values = centers[labels] + rng.standard_t(4, size=(rows, dimensions))
+    return (values - values.mean(axis=0)) / values.std(axis=0)
+
+
+def get_inertia(values, labels, metric):
+    centers = np.array([values[labels == label].mean(axis=0) for label in np.unique(labels)])
+    _, codes = np.unique(labels, return_inverse=True)
+    max_range = values.max(axis=0) - values.min(axis=0)
+    distances = clustering.get_distances(values, centers, metric, max_range)
+    return distances[np.arange(len(values)), codes].sum()
+
+
+def run_pyclustering(values, metric):
+    arguments = {"data": values} if metric == "gower" else {}
+    initial_centers = kmeans_plusplus_initializer(values, cluster_count).initialize()
+    model = kmeans(
+        values,
+        initial_centers=initial_centers,
+        ccore=False,
+        metric=distance_metric(pyclustering_metrics[metric], **arguments),
+    )
+    model.process()
+
+    labels = np.empty(len(values), dtype="int64")
+    for label, indexes in enumerate(model.get_clusters()):
+        labels[indexes] = label
+    return labels
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [5000, 20000, 50000]
+    rng = np.random.default_rng(0)
+
+    print(f"{'rows':>6} {'metric':<17} {'pyclustering':>12} {'run':>8} {'fit':>8} {'inertia':>8} {'ARI':>5}")
+    for rows in sizes:
+        values = get_data(rows, rng)
+        for metric in clustering.metrics:
+            start = time.perf_counter()
+            old_labels = run_pyclustering(values, metric)
+            old_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            clustering.run(values, cluster_count, metric, np.random.SeedSequence(0))
+            run_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            new_labels = clustering.fit(values, cluster_count, metric)
+            fit_time = time.perf_counter() - start
+
+            ratio = get_inertia(values, new_labels, metric) / get_inertia(values, old_labels, metric)
+            agreement = adjusted_rand_score(old_labels, new_labels)
+            print(
+                f"{rows:>6} {metric:<17} {old_time:>11.2f}s {run_time:>7.2f}s {fit_time:>7.2f}s"
+                f" {ratio:>8.3f} {agreement:>5.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
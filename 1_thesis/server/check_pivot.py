@@ -0,0 +1,95 @@
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import pivot
+
+# Сравнение pivot.pivot_results с прежней последовательностью
+# drop_duplicates().pivot().dropna(): на небольших выборках с пропусками в поле
+# пола и возраста, повторами теста в направлении и неполными направлениями
+# результаты должны совпадать полностью (значения, индекс, колонки), на большой
+# синтетической выборке выводится время обоих вариантов.
+# Запуск: python check_pivot.py [число строк]
+
+test_names = ["АЛТ", "АСТ", "Гемоглобин", "Глюкоза", "Креатинин", "Лейкоциты"]
+
+
+def get_old(df, complete_cases=True):
+    res = (
+        df
+        .drop_duplicates(["referral_header_id", "test_id"])
+        .pivot(index=pivot.pivot_index, columns="test_name", values="result")
+    )
+    return res.dropna() if complete_cases else res
+
+
+def get_sample(referrals, rng, missing_share=0.1):
+    referral_ids = rng.permutation(referrals) + 1
+    gender = rng.choice(np.array(["м", "ж", None], dtype=object), referrals, p=[0.45, 0.45, 0.1])
+    age = rng.integers(18, 90, referrals).astype("float64")
+    age[rng.random(referrals) < 0.05] = np.nan
+
+    rows = np.repeat(np.arange(referrals), len(test_names))
+    tests = np.tile(np.arange(len(test_names)), referrals)
+    keep = rng.random(len(rows)) >= missing_share
+    rows, tests = rows[keep], tests[keep]
+    # Повторы теста в направлении
+    repeated = rng.random(len(rows)) < 0.02
+    rows = np.concatenate([rows, rows[repeated]])
+    tests = np.concatenate([tests, tests[repeated]])
+    order = rng.permutation(len(rows))
+    rows, tests = rows[order], tests[order]
+
+    return pd.DataFrame({
+        "referral_header_id": referral_ids[rows],
+        "gender": gender[rows],
+        "patient_age_when_sampling": age[rows],
+        "test_id": tests + 1,
+        "test_name": np.array(test_names, dtype=object)[tests],
+        "result": rng.lognormal(size=len(rows)),
+    })
+
+
+def check_equal(df):
+    for complete_cases in [True, False]:
+        pd.testing.assert_frame_equal(
+            pivot.pivot_results(df, complete_cases=complete_cases),
+            get_old(df, complete_cases),
+        )
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    rng = np.random.default_rng(0)
+
+    # Направление без пола между направлениями с полом
+    check_equal(pd.DataFrame({
+        "referral_header_id": [1, 1, 2, 2],
+        "gender": ["м", "м", None, None],
+        "patient_age_when_sampling": [40.0, 40.0, 50.0, 50.0],
+        "test_id": [1, 2, 1, 2],
+        "test_name": ["АЛТ", "АСТ", "АЛТ", "АСТ"],
+        "result": [1.0, 2.0, 3.0, 4.0],
+    }))
+    for referrals in [1, 10, 1000]:
+        check_equal(get_sample(referrals, rng))
+    print("pivot_results совпадает с drop_duplicates().pivot().dropna()")
+
+    df = get_sample(rows // len(test_names), rng, missing_share=0.02)
+
+    start = time.perf_counter()
+    old = get_old(df)
+    old_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    new = pivot.pivot_results(df)
+    new_time = time.perf_counter() - start
+
+    pd.testing.assert_frame_equal(new, old)
+    print(f"{len(df)} строк, {len(new)} направлений: pandas {old_time:.2f} s, pivot_results {new_time:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import itertools
+import json
+import sys
+
+import common
+import db
+import psycopg2 as pg
+from dotenv import dotenv_values
+
+config = dotenv_values(common.ENV_FILE)
+
+# Проверка планов запросов get_dataset: для каждой комбинации фильтров, допускаемой
+# schemas.sample, выполняется EXPLAIN и проверяется, что данные (витрина sample_fact
+# или referral_body) читаются по индексу из db/create-sample-fact.sql или
+# db/create-indexes.sql, а не последовательным сканированием. Если referral_body
+# секционирована (db/partition-referral-body.sql), последовательное чтение секций
+# допустимо, когда планировщик отбросил часть секций по интервалу дат
+
+expected_indexes = {
+    "sample_fact_test_date_age_idx",
+    "sample_fact_date_age_idx",
+    "referral_body_test_date_age_idx",
+    "referral_body_date_age_idx",
+}
+
+index_scan_types = {"Index Scan", "Index Only Scan", "Bitmap Index Scan"}
+
+# Узкий интервал дат, как у типичной выборки: при интервале на всю базу
+# последовательное сканирование действительно дешевле, и это не ошибка
+sampling_date_interval_days = 31
+
+
+def get_partition_count(conn):
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT count(*) FROM pg_inherits WHERE inhparent = 'referral_body'::regclass;"
+        )
+        count = cur.fetchone()[0]
+    conn.rollback()
+
+    return count
+
+
+def get_filter_values(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT max(sampling_date) FROM referral_body;")
+        max_date = cur.fetchone()[0]
+        cur.execute(
+            "SELECT diagnosis_id FROM referral_header GROUP BY diagnosis_id ORDER BY count(*) DESC LIMIT 3;"
+        )
+        diagnoses = [row[0] for row in cur.fetchall()]
+        cur.execute("SELECT id FROM district ORDER BY id LIMIT 1;")
+        districts = [row[0] for row in cur.fetchall()]
+        cur.execute(
+            "SELECT test_id FROM referral_body GROUP BY test_id ORDER BY count(*) DESC LIMIT 3;"
+        )
+        test_ids = [row[0] for row in cur.fetchall()]
+    conn.rollback()
+
+    return max_date, diagnoses, districts, test_ids
+
+
+def get_sample_filters(max_date, diagnoses, districts, test_ids):
+    min_date = max_date.toordinal() - sampling_date_interval_days
+    min_date = max_date.fromordinal(min_date)
+
+    # diagnoses, district, gender, test_ids: фильтр включен / выключен
+    for flags in itertools.product([False, True], repeat=4):
+        sample_filter = {
+            "age_interval": [0, 120],
+            "sampling_date_interval": [min_date.isoformat(), max_date.isoformat()],
+            "diagnoses": diagnoses if flags[0] else [],
+            "district": districts if flags[1] else [],
+            "gender": db.GENDER_MALE if flags[2] else "ANY",
+        }
+        yield flags, sample_filter, test_ids if flags[3] else None
+
+
+def get_data_scans(plan):
+    relation = plan.get("Relation Name", "")
+    if relation == "sample_fact" or relation.startswith("referral_body"):
+        yield plan
+    for subplan in plan.get("Plans", []):
+        yield from get_data_scans(subplan)
+
+
+# InitPlan/SubPlan — отдельные запросы (например, интервалы МКБ из mkb), они
+# выполняются один раз и к чтению данных не относятся
+def get_scan_children(scan):
+    return [
+        subplan
+        for subplan in scan.get("Plans", [])
+        if subplan.get("Parent Relationship") not in ("InitPlan", "SubPlan")
+    ]
+
+
+def uses_expected_index(scan):
+    if scan["Node Type"] == "Bitmap Heap Scan":
+        return all(uses_expected_index(subplan) for subplan in get_scan_children(scan))
+    if scan["Node Type"] == "BitmapOr":
+        return all(uses_expected_index(subplan) for subplan in get_scan_children(scan))
+    if scan["Node Type"] not in index_scan_types:
+        return False
+    # В секционированной таблице индексы секций называются по-своему,
+    # но начинаются с имени секции и содержат перечень колонок
+    name = scan.get("Index Name", "")
+    return name in expected_indexes or (
+        name.startswith("referral_body_") and "sampling_date" in name
+    )
+
+
+def check_plan(conn, sample_filter, test_ids, partition_count):
+    query, params = db.get_dataset_query(sample_filter, test_ids)
+    with conn.cursor() as cur:
+        cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+        plan = cur.fetchone()[0]
+    conn.rollback()
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    plan = plan[0]["Plan"]
+
+    scans = list(get_data_scans(plan))
+    if all(uses_expected_index(scan) for scan in scans):
+        return True, scans
+
+    partitions = {scan["Relation Name"] for scan in scans}
+    pruned = 0 < len(partitions) < partition_count and "referral_body" not in partitions
+    return pruned, scans
+
+
+def main():
+    conn = pg.connect(
+        dbname=config["DB_NAME"],
+        user=config["DB_USER"],
+        password=config["DB_PASSWORD"],
+    )
+
+    filter_values = get_filter_values(conn)
+    partition_count = get_partition_count(conn)
+    flag_names = ["diagnoses", "district", "gender", "test_ids"]
+
+    failed = 0
+    for flags, sample_filter, test_ids in get_sample_filters(*filter_values):
+        ok, scans = check_plan(conn, sample_filter, test_ids, partition_count)
+        shape = ", ".join(f"{n}={'on' if f else 'off'}" for n, f in zip(flag_names, flags))
+        used = ", ".join(
+            f"{s['Node Type']} {s.get('Index Name', s['Relation Name'])}" for s in scans
+        )
+        print(f"{'ok  ' if ok else 'FAIL'} [{shape}] {used}")
+        failed += not ok
+
+    conn.close()
+
+    if failed:
+        print(f"{failed} filter combination(s) do not use indexes")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
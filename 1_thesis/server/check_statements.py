@@ -0,0 +1,110 @@
+import json
+import statistics
+import time
+
+import check_plans
+import common
+import db
+import psycopg2 as pg
+import statements
+from dotenv import dotenv_values
+
+config = dotenv_values(common.ENV_FILE)
+
+# Сравнение времени планирования и выполнения запросов в двух вариантах: текст
+# запроса (разбирается и планируется при каждом вызове) и подготовленное выражение
+# (statements.Statement, EXECUTE по имени).
+# - get_dataset: запрос выполняется внутри COPY, где EXECUTE нельзя, поэтому в реестр
+#   эти запросы не входят, а сравнение показывает, сколько стоит их разбор и
+#   планирование (для каждой комбинации фильтров);
+# - get_stats_summary: выполняется обычным курсором и подготавливается (для 1–4
+#   выборок с разными фильтрами).
+# Каждый запрос выполняется repeats раз через EXPLAIN (ANALYZE, SUMMARY) и repeats
+# раз обычным образом, выводятся медианы. Время разбора запроса EXPLAIN не
+# показывает, его экономия видна только во времени полного вызова (round trip)
+
+repeats = 10
+
+
+def explain_times(conn, query, params):
+    with conn.cursor() as cur:
+        cur.execute("EXPLAIN (ANALYZE, SUMMARY, FORMAT JSON) " + query, params)
+        plan = cur.fetchone()[0]
+    conn.rollback()
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Planning Time"], plan[0]["Execution Time"]
+
+
+def round_trip_time(conn, query, params):
+    with conn.cursor() as cur:
+        start = time.perf_counter()
+        cur.execute(query, params)
+        cur.fetchall()
+        elapsed = time.perf_counter() - start
+    conn.rollback()
+
+    return elapsed * 1000  # ms
+
+
+def measure(conn, query, params):
+    times = [explain_times(conn, query, params) for _ in range(repeats)]
+    planning, execution = zip(*times)
+    round_trip = [round_trip_time(conn, query, params) for _ in range(repeats)]
+    return (
+        statistics.median(planning),
+        statistics.median(execution),
+        statistics.median(round_trip),
+    )
+
+
+def main():
+    conn = pg.connect(
+        dbname=config["DB_NAME"],
+        user=config["DB_USER"],
+        password=config["DB_PASSWORD"],
+    )
+
+    filter_values = check_plans.get_filter_values(conn)
+    sample_filters = list(check_plans.get_sample_filters(*filter_values))
+
+    cases = []
+    for flags, sample_filter, test_ids in sample_filters:
+        query, params = db.get_dataset_query(sample_filter, test_ids)
+        name = "get_dataset_" + "".join(str(int(flag)) for flag in flags)
+        cases.append((statements.Statement(name, query), params))
+
+    # Выборки с разными фильтрами: без фильтров, по диагнозам, районам и полу
+    summary_filters = [dict(sample_filters[i][1], name=f"s{i}") for i in [0, 8, 4, 2]]
+    test_ids = filter_values[-1]
+    for count in range(1, len(summary_filters) + 1):
+        query, params = db.get_stats_summary_query(summary_filters[:count], test_ids)
+        cases.append((statements.Statement(f"get_stats_summary_{count}", query), params))
+
+    totals = {"text": [0, 0], "prepared": [0, 0]}
+    print("statement, ms          plan text / prepared   execute text / prepared   round trip text / prepared")
+    for statement, params in cases:
+        with conn.cursor() as cur:
+            statements.prepare(cur, statement)
+        conn.rollback()
+
+        text = measure(conn, statement.query, params)
+        prepared = measure(conn, statement.execute_query, params)
+        for kind, (plan, _, round_trip) in [("text", text), ("prepared", prepared)]:
+            totals[kind][0] += plan
+            totals[kind][1] += round_trip
+
+        print(
+            f"{statement.name:<21} "
+            + "   ".join(f"{t:8.3f} / {p:8.3f}" for t, p in zip(text, prepared))
+        )
+
+    for kind, (plan, round_trip) in totals.items():
+        print(f"{kind}: planning {plan:.3f} ms, round trip {round_trip:.3f} ms (sum of medians)")
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import datetime
+import math
+
+import api
+import app
+import common
+import db
+import psycopg2 as pg
+from dotenv import dotenv_values
+
+config = dotenv_values(common.ENV_FILE)
+
+# Сравнение трех вариантов /api/stats (pandas, execution="sql" и stream) на
+# небольшой заданной выборке: таблицы должны совпадать по заголовкам, порядку
+# таблиц, строк и колонок, значения — с точностью до ошибок округления.
+# Выборка записывается во временную таблицу sample_fact: в соединении скрипта
+# она закрывает витрину с тем же именем, поэтому данные базы не меняются.
+# В выборке есть тест с одним значением и выборка из одной строки
+# (std не определено и заменяется нулем) и направления без указания пола.
+# Нужны таблицы test (минимум три теста) и mkb
+# Запуск: python check_stats.py
+
+create_fixture = """
+CREATE TEMPORARY TABLE sample_fact (
+    referral_header_id INT4,
+    patient_id INT4,
+    diagnosis_id INT4,
+    test_id INT4,
+    sampling_date DATE,
+    result FLOAT8,
+    patient_age_when_sampling INT2,
+    gender_code INT2,
+    district_id INT2,
+    diagnosis_lft INT4
+);
+"""
+
+sampling_date = datetime.date(2020, 6, 1)
+
+
+# (направление, тест, результат, возраст, пол). Направления 1–6 — взрослые,
+# 7 — единственное детское (выборка "Дети" из одной строки)
+def get_fixture_rows(first, second, third):
+    return [
+        (1, first, 4.2, 35, 1),
+        (1, second, 140.0, 35, 1),
+        (2, first, 5.1, 62, 2),
+        (2, second, 133.5, 62, 2),
+        (2, third, 0.8, 62, 2),
+        (3, first, 3.9, 47, 1),
+        (4, first, 6.3, 51, 2),
+        (4, second, 128.0, 51, 2),
+        (5, first, 4.8, 29, None),
+        (5, second, 151.0, 29, None),
+        (6, first, 5.5, 70, 1),
+        (7, first, 4.4, 9, 2),
+    ]
+
+
+def get_samples():
+    sample = {
+        "age_interval": [18, 90],
+        "sampling_date_interval": ["2020-01-01", "2020-12-31"],
+        "diagnoses": [],
+        "district": [],
+        "gender": "ANY",
+    }
+    return [
+        dict(sample, name="Все", index=0),
+        dict(sample, name="Женщины", gender="ж", index=1),
+        dict(sample, name="Дети", age_interval=[0, 17], index=2),
+    ]
+
+
+def check_equal(expected, actual, path):
+    if isinstance(expected, dict):
+        assert isinstance(actual, dict) and list(expected) == list(actual), f"{path}: {expected} != {actual}"
+        for key in expected:
+            check_equal(expected[key], actual[key], f"{path}.{key}")
+    elif isinstance(expected, list):
+        assert isinstance(actual, list) and len(expected) == len(actual), f"{path}: {expected} != {actual}"
+        for i, (left, right) in enumerate(zip(expected, actual)):
+            check_equal(left, right, f"{path}[{i}]")
+    elif isinstance(expected, float) or isinstance(actual, float):
+        assert math.isclose(expected, actual, rel_tol=1e-9, abs_tol=1e-12), f"{path}: {expected} != {actual}"
+    else:
+        assert expected == actual, f"{path}: {expected} != {actual}"
+
+
+def main():
+    conn = pg.connect(
+        dbname=config["DB_NAME"],
+        user=config["DB_USER"],
+        password=config["DB_PASSWORD"],
+    )
+
+    test_ids = db.get_test_names(conn)["id"].sort_values().tolist()[:3]
+    with conn.cursor() as cur:
+        cur.execute(create_fixture)
+        for referral, test_id, result, age, gender in get_fixture_rows(*test_ids):
+            cur.execute(
+                "INSERT INTO sample_fact VALUES (%s, %s, NULL, %s, %s, %s, %s, %s, NULL, NULL);",
+                (referral, referral, test_id, sampling_date, result, age, gender),
+            )
+    conn.commit()
+
+    # Порядок test_ids отличается от порядка тестов в таблице и в выборке
+    requested_test_ids = [test_ids[2], test_ids[0], test_ids[1]]
+    with app.app.test_request_context():
+        for group_by in ["samples", "params"]:
+            params = {
+                "samples": get_samples(),
+                "test_ids": requested_test_ids,
+                "group_by": group_by,
+                "calc_gender_stats": True,
+                "calc_age_stats": True,
+            }
+            expected = api.get_stats_pandas(conn, params).get_json()
+            for name, get_stats in [("sql", api.get_stats_sql), ("stream", api.get_stats_streaming)]:
+                check_equal(expected, get_stats(conn, params).get_json(), f"{group_by}/{name}")
+            print(f"group_by={group_by}: {len(expected)} таблиц, sql и stream совпадают с pandas")
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
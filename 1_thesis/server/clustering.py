@@ -0,0 +1,263 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures.process import BrokenProcessPool
+
+import common
+import compute
+import numpy as np
+from dotenv import dotenv_values
+
+config = dotenv_values(common.ENV_FILE)
+
+# Метод k-средних на NumPy (вместо pyclustering) для /api/kmeans. Расстояния от
+# всех точек до центров считаются операциями над всей матрицей данных (для
+# евклидовых метрик — одним матричным произведением), центры пересчитываются
+# через np.bincount. Как и в pyclustering, точки относятся к центру по выбранной
+# метрике, центр — среднее точек кластера, а итерации прекращаются, когда центры
+# смещаются (по той же метрике) меньше чем на tolerance; пустые кластеры
+# отбрасываются.
+# Начальные центры — k-means++ с разными seed; перезапуски выполняются параллельно
+# в пуле процессов compute, результат — перезапуск с наименьшей суммой расстояний
+# до центров. Центры лучшего результата запоминаются по ключу выборки (warm_starts):
+# следующий запрос для той же выборки начинает еще и с них и при тех же данных
+# сходится за одну итерацию к тем же кластерам
+
+metrics = [
+    "euclidean",
+    "euclidean_square",
+    "manhattan",
+    "chebyshev",
+    "minkowski",
+    "canberra",
+    "chi_square",
+    "gower",
+]
+
+restarts = int(config.get("KMEANS_RESTARTS") or 4)
+# Меньше этого числа строк перезапуски дешевле выполнить в текущем процессе,
+# чем передавать данные в пул
+parallel_min_rows = int(config.get("KMEANS_PARALLEL_MIN_ROWS") or 5000)
+warm_starts_size = int(config.get("KMEANS_WARM_STARTS") or 64)
+
+tolerance = 0.001
+max_iterations = 200
+
+
+### Расстояния ###
+
+
+# Расстояния от каждой строки values до каждого центра, матрица (строки × центры).
+# max_range — размах каждой колонки (для gower)
+def get_distances(values, centers, metric, max_range=None):
+    if metric in ("euclidean", "euclidean_square", "minkowski"):
+        squares = (
+            (values**2).sum(axis=1)[:, None]
+            - 2 * values @ centers.T
+            + (centers**2).sum(axis=1)[None, :]
+        )
+        squares = np.maximum(squares, 0)
+        # Метрика Минковского в pyclustering по умолчанию второй степени
+        return squares if metric == "euclidean_square" else np.sqrt(squares)
+
+    if metric == "gower":
+        max_range = np.where(max_range > 0, max_range, np.nan)
+
+    # По одному центру: центров немного, а промежуточный массив — размером с values
+    distances = np.empty((len(values), len(centers)))
+    for index, center in enumerate(centers):
+        difference = np.abs(values - center)
+        if metric == "manhattan":
+            distances[:, index] = difference.sum(axis=1)
+        elif metric == "chebyshev":
+            distances[:, index] = difference.max(axis=1)
+        else:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                if metric == "canberra":
+                    result = difference / (np.abs(values) + np.abs(center))
+                elif metric == "chi_square":
+                    result = difference**2 / (np.abs(values) + np.abs(center))
+                else:
+                    result = difference / max_range / values.shape[1]
+            distances[:, index] = np.nansum(result, axis=1)
+    return distances
+
+
+### Один запуск ###
+
+
+# k-means++: первый центр — случайная точка, следующие — с вероятностью,
+# пропорциональной квадрату расстояния до ближайшего из уже выбранных
+def get_initial_centers(values, cluster_count, rng):
+    centers = [values[rng.integers(len(values))]]
+    closest = ((values - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, cluster_count):
+        total = closest.sum()
+        if total == 0:
+            index = rng.integers(len(values))
+        else:
+            index = rng.choice(len(values), p=closest / total)
+        centers.append(values[index])
+        closest = np.minimum(closest, ((values - values[index]) ** 2).sum(axis=1))
+    return np.array(centers)
+
+
+def get_means(values, labels, cluster_count):
+    counts = np.bincount(labels, minlength=cluster_count)
+    sums = np.stack([
+        np.bincount(labels, weights=values[:, column], minlength=cluster_count)
+        for column in range(values.shape[1])
+    ], axis=1)
+    kept = counts > 0
+    return sums[kept] / counts[kept, None]
+
+
+# Возвращает центры, номера кластеров, сумму расстояний до центров и число итераций
+def run(values, cluster_count, metric, seed, initial_centers=None):
+    if initial_centers is None:
+        centers = get_initial_centers(values, cluster_count, np.random.default_rng(seed))
+    else:
+        centers = np.array(initial_centers, dtype="float64")
+    max_range = values.max(axis=0) - values.min(axis=0) if metric == "gower" else None
+
+    iterations = 0
+    while iterations < max_iterations:
+        labels = get_distances(values, centers, metric, max_range).argmin(axis=1)
+        updated = get_means(values, labels, len(centers))
+        iterations += 1
+
+        if len(updated) != len(centers):
+            change = np.inf
+        else:
+            change = np.diag(get_distances(centers, updated, metric, max_range)).max()
+        centers = updated
+        if change <= tolerance:
+            break
+
+    distances = get_distances(values, centers, metric, max_range)
+    labels = distances.argmin(axis=1)
+    inertia = distances[np.arange(len(values)), labels].sum()
+    return centers, labels, inertia, iterations
+
+
+### Перезапуски и центры прошлых запросов ###
+
+
+class WarmStarts:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._centers = OrderedDict()  # от давно использованных к недавно использованным
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, cluster_count, dimensions):
+        with self._lock:
+            centers = self._centers.get(key)
+            if centers is None or centers.shape != (cluster_count, dimensions):
+                self.misses += 1
+                return None
+            self._centers.move_to_end(key)
+            self.hits += 1
+            return centers
+
+    def put(self, key, centers):
+        with self._lock:
+            self._centers[key] = centers
+            self._centers.move_to_end(key)
+            while len(self._centers) > self.max_entries:
+                self._centers.popitem(last=False)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._centers),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+warm_starts = WarmStarts(warm_starts_size)
+
+
+class ClusteringStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.restarts = 0
+        self.iterations = 0
+        self.total = 0.0
+
+    def add(self, restarts, iterations, total):
+        with self._lock:
+            self.runs += 1
+            self.restarts += restarts
+            self.iterations += iterations
+            self.total += total
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "runs": self.runs,
+                "restarts": self.restarts,
+                "iterations": self.iterations,
+                "total": self.total,
+                "warm_starts": warm_starts.get_stats(),
+            }
+
+
+clustering_stats = ClusteringStats()
+
+
+# Номера кластеров от 0 по убыванию размера кластера: одинаковое разбиение
+# дает одинаковые номера независимо от порядка начальных центров
+def order_by_size(centers, labels):
+    counts = np.bincount(labels, minlength=len(centers))
+    order = np.argsort(-counts, kind="stable")
+    codes = np.empty(len(order), dtype="int64")
+    codes[order] = np.arange(len(order))
+    return centers[order], codes[labels]
+
+
+# values — матрица (строки × признаки) без пропусков. warm_start_key — ключ выборки,
+# по которому запоминаются центры. Возвращает номера кластеров строк (от 0)
+def fit(values, cluster_count, metric, warm_start_key=None, seed=0):
+    start = time.perf_counter()
+    values = np.ascontiguousarray(values, dtype="float64")
+    cluster_count = min(cluster_count, len(values))
+
+    tasks = [
+        (values, cluster_count, metric, seed_sequence)
+        for seed_sequence in np.random.SeedSequence(seed).spawn(restarts)
+    ]
+    if warm_start_key is not None:
+        centers = warm_starts.get(warm_start_key, cluster_count, values.shape[1])
+        if centers is not None:
+            tasks.insert(0, (values, cluster_count, metric, None, centers))
+
+    executor = compute.executor_pool.get_executor() if len(values) >= parallel_min_rows else None
+    if executor is None:
+        results = [run(*task) for task in tasks]
+    else:
+        try:
+            results = [future.result() for future in [executor.submit(run, *task) for task in tasks]]
+        except BrokenProcessPool:
+            compute.executor_pool.reset_executor(executor)
+            raise
+
+    # При равной сумме расстояний — первый (центры прошлого запроса)
+    best = min(range(len(results)), key=lambda i: results[i][2])
+    centers, labels, _, _ = results[best]
+    centers, labels = order_by_size(centers, labels)
+    if warm_start_key is not None:
+        warm_starts.put(warm_start_key, centers)
+
+    clustering_stats.add(len(tasks), sum(result[3] for result in results), time.perf_counter() - start)
+    return labels
+
+
+def get_stats():
+    return clustering_stats.get_stats()
@@ -5,6 +5,8 @@ ROOT_DIR = Path(__file__).parent.parent.parent
 
 SERVER_DIR = Path(__file__).parent.parent
 
+DB_DIR = SERVER_DIR / "db"
+
 DATA_DIR = ROOT_DIR / "data"
 PRIVATE_DATA_DIR = DATA_DIR / "private"
 
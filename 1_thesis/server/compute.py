@@ -0,0 +1,20 @@
+import os
+
+import common
+import executors
+from dotenv import dotenv_values
+
+config = dotenv_values(common.ENV_FILE)
+
+# Пул процессов для вычислений, которые делятся на независимые части: пакеты
+# ресэмплов (resampling) и перезапуски k-средних (clustering). Задачи — функции
+# уровня модуля с аргументами из массивов NumPy. COMPUTE_WORKERS=0 — вычисления
+# в текущем процессе
+workers = int(config.get("COMPUTE_WORKERS") or min(4, os.cpu_count() or 1))
+
+
+def warm_up():
+    pass
+
+
+executor_pool = executors.SpawnPool(workers, warm_up)
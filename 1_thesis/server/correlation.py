@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+import statsmodels.stats.multitest as multi
+from scipy import stats as scipy_stats
+
+# Корреляционная матрица по всем парам тестов выборки (/api/correlation).
+# Пропуски исключаются попарно: для пары тестов используются все направления,
+# в которых есть оба теста, а не только направления со всеми тестами сразу.
+# Все пары считаются матричными произведениями по сводной таблице с нулями
+# вместо пропусков и маске наличия значений, без цикла по парам.
+# Спирмен — Пирсон по рангам. Ранги, посчитанные по всем значениям теста, верны
+# для пары, только если общие строки пары — все строки обоих тестов; такие пары
+# считаются теми же матричными произведениями, остальные ранжируются заново
+# по общим строкам (как DataFrame.corr("spearman"))
+
+methods = {
+    "pearson": "Пирсон",
+    "spearman": "Спирмен",
+}
+# Меньше трех общих значений — корреляция и ее значимость не считаются
+min_pairs = 3
+
+
+# Коэффициенты Пирсона всех пар колонок по общим строкам (present — маска
+# наличия значений) и матрица чисел общих значений
+def get_pearson(values, present):
+    mask = present.astype("float64")
+    # Центрирование по колонкам уменьшает потерю точности в разностях сумм
+    with np.errstate(invalid="ignore"):
+        centered = np.where(present, values - np.nanmean(values, axis=0), 0)
+
+    # [i, j] — по строкам, где есть оба теста i и j
+    n = mask.T @ mask
+    sums = centered.T @ mask  # сумма значений теста i
+    squares = (centered**2).T @ mask
+    products = centered.T @ centered
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        covariance = products - sums * sums.T / n
+        variance = squares - sums**2 / n
+        r = np.clip(covariance / np.sqrt(variance * variance.T), -1, 1)
+
+    r = np.where((variance > 0) & (variance.T > 0), r, np.nan)
+    return r, n.astype("int64")
+
+
+def get_pair_pearson(x, y):
+    x = x - x.mean()
+    y = y - y.mean()
+    denominator = np.sqrt((x**2).sum() * (y**2).sum())
+    return np.clip((x * y).sum() / denominator, -1, 1) if denominator > 0 else np.nan
+
+
+# values — матрица (строки × тесты) с NaN на месте пропусков. Возвращает
+# матрицы коэффициентов, числа общих значений и p-значений
+def get_correlation(values, method="pearson"):
+    values = np.asarray(values, dtype="float64")
+    present = ~np.isnan(values)
+
+    if method == "spearman":
+        r, n = get_pearson(pd.DataFrame(values).rank(method="average").to_numpy(), present)
+
+        counts = present.sum(axis=0)
+        partial = (n < counts[:, None]) | (n < counts[None, :])
+        partial &= n >= min_pairs
+        for i, j in zip(*np.nonzero(np.triu(partial, k=1))):
+            both = present[:, i] & present[:, j]
+            r[i, j] = r[j, i] = get_pair_pearson(
+                scipy_stats.rankdata(values[both, i]),
+                scipy_stats.rankdata(values[both, j]),
+            )
+    else:
+        r, n = get_pearson(values, present)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        df = n - 2
+        t = r * np.sqrt(df / (1 - r**2))
+        pvalue = 2 * scipy_stats.t.sf(np.abs(t), df)
+
+    valid = (n >= min_pairs) & ~np.isnan(r)
+    r = np.where(valid, r, np.nan)
+    pvalue = np.where(valid, pvalue, np.nan)
+    return r, n, pvalue
+
+
+# Таблица пар тестов (каждая пара один раз) с q-значениями FDR по всем парам,
+# упорядоченная по q-значению
+def get_pairs_table(names, r, n, pvalue, threshold):
+    first, second = np.triu_indices(len(names), k=1)
+    res = pd.DataFrame({
+        "test_name1": np.asarray(names, dtype=object)[first],
+        "test_name2": np.asarray(names, dtype=object)[second],
+        "count": n[first, second],
+        "stats": r[first, second],
+        "pvalue": pvalue[first, second],
+    })
+
+    tested = res["pvalue"].notna().to_numpy()
+    res["qvalue"] = np.nan
+    res["qvalue_null_h"] = None
+    if tested.any():
+        rejected, qvalues, _, _ = multi.multipletests(res.loc[tested, "pvalue"], alpha=threshold, method="fdr_bh")
+        res.loc[tested, "qvalue"] = qvalues
+        res.loc[tested, "qvalue_null_h"] = np.where(rejected, "отвергается", "не отвергается")
+
+    res = res.sort_values(["qvalue", "pvalue"], kind="stable", na_position="last").reset_index(drop=True)
+    # NaN не сериализуется в JSON
+    return res.astype(object).where(res.notna(), None)
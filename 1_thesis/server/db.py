@@ -1,30 +1,87 @@
+import io
+import itertools
+import uuid
+
 import common
+import numpy as np
 import pandas as pd
+import statements
+from psycopg2.extensions import encodings
 from psycopg2.extras import RealDictCursor
 
 GENDER_MALE = "м"
 GENDER_FEMALE = "ж"
 
+# В витрине sample_fact пол хранится кодом (см. db/create-sample-fact.sql)
+gender_codes = {GENDER_MALE: 1, GENDER_FEMALE: 2}
+
+# Типы колонок, которые приходят из sample_fact
+fact_dtypes = {
+    "referral_header_id": "int64",
+    "patient_id": "int64",
+    "diagnosis_id": "Int64",
+    "test_id": "int64",
+    "result": "float64",
+    "patient_age_when_sampling": "int64",
+    "gender_code": "Int8",
+    "district_id": "Int64",
+}
+fact_date_columns = ["sampling_date"]
+
+# Колонки результата get_dataset. Строковые колонки с небольшим числом уникальных
+# значений хранятся как категории, чтобы не создавать объект на каждую строку
+dataset_columns = [
+    "referral_header_id",
+    "patient_id",
+    "diagnosis_id",
+    "test_id",
+    "test_name",
+    "test_mnemonic",
+    "sampling_date",
+    "result",
+    "patient_age_when_sampling",
+    "gender",
+    "district_id",
+]
 
+# Количество строк в одном фрагменте при потоковом чтении выборки
+dataset_chunk_size = 100_000
+
+
+# query — строка запроса или выражение из реестра statements (выполняется по имени)
 def get_result_as_df(connection, query, params=None):
     with connection.cursor() as cur:
-        cur.execute(query, params)
+        statements.execute(cur, query, params)
         result = cur.fetchall()
         col_names = [desc[0] for desc in cur.description]
 
     return pd.DataFrame(result, columns=col_names)
 
 
+# Результат запроса выгружается через COPY ... TO STDOUT одним CSV-буфером и
+# разбирается pandas сразу в типизированные колонки, минуя кортежи Python для каждой строки
+def copy_result_as_df(connection, query, params=None, dtype=None, parse_dates=None):
+    encoding = encodings[connection.encoding]
+    buffer = io.BytesIO()
+    with connection.cursor() as cur:
+        query = cur.mogrify(query, params).decode(encoding)
+        query = query.strip().rstrip(";")
+        cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", buffer)
+
+    buffer.seek(0)
+    return pd.read_csv(buffer, dtype=dtype, parse_dates=parse_dates, encoding=encoding)
+
+
 def get_result_list_of_dicts(connection, query, params=None):
     with connection.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(query)
+        statements.execute(cur, query, params)
         result = cur.fetchall()
 
     return result
 
 
 def get_tests(connection):
-    query = """
+    query = statements.register("get_tests", """
 WITH cte AS (
 	SELECT t.id, count(*) AS count
 	FROM referral_body AS rb
@@ -39,12 +96,12 @@ ON t.id  = cte.id
 JOIN analysis AS a
 ON a.id  = t.analysis_id
 ORDER BY cte.count DESC;
-"""
+""")
     return get_result_list_of_dicts(connection, query)
 
 
 def get_diagnoses(connection):
-    query = """
+    query = statements.register("get_diagnoses", """
 WITH cte AS (
     SELECT
         diagnosis_id,
@@ -62,12 +119,12 @@ SELECT
 FROM cte
 RIGHT JOIN mkb ON cte.diagnosis_id = mkb.id
 ORDER BY mkb.parent_id, mkb.code;
-"""
+""")
     return get_result_as_df(connection, query)
 
 
 def get_associated_diagnoses(connection, patient_ids):
-    query = """
+    query = statements.register("get_associated_diagnoses", """
 SELECT
     m.code, m.name, count(*) AS count
 FROM
@@ -75,39 +132,72 @@ FROM
 JOIN mkb AS m ON
     m.id = rh.diagnosis_id
 WHERE
-    rh.patient_id IN %(patient_ids)s
+    rh.patient_id = ANY(%(patient_ids)s)
 GROUP BY
     m.code, m.name;
-"""
-    params = {"patient_ids": tuple(patient_ids)}
+""")
+    params = {"patient_ids": list(patient_ids)}
 
     return get_result_as_df(connection, query, params)
 
 
-def get_dataset(connection, sample_filter, test_ids=None):
-    query = """
+def get_test_names(connection):
+    query = statements.register("get_test_names", "SELECT id, name, mnemonic FROM test;")
+    return get_result_as_df(connection, query)
+
+
+dataset_query_head = """
 SELECT
-	rb.referral_header_id,
-    rh.patient_id,
-    rh.diagnosis_id,
-	t.id AS "test_id",
-	t.name AS "test_name",
-	t.mnemonic AS "test_mnemonic",
-	rb.sampling_date,
-	rb.result,
-	rb.patient_age_when_sampling,
-	p.gender,
-    p.district_id
-FROM referral_body AS rb
-JOIN test AS t              ON rb.test_id = t.id
-JOIN referral_header AS rh  ON rb.referral_header_id = rh.id
-JOIN patient AS p           ON rh.patient_id = p.id
+    f.referral_header_id,
+    f.patient_id,
+    f.diagnosis_id,
+    f.test_id,
+    f.sampling_date,
+    f.result,
+    f.patient_age_when_sampling,
+    f.gender_code,
+    f.district_id
+FROM sample_fact AS f
 WHERE
-	rb.patient_age_when_sampling >= %(min_age)s
-	AND	rb.patient_age_when_sampling <= %(max_age)s
-	AND	rb.sampling_date >= %(min_sampling_date)s
- 	AND rb.sampling_date <= %(max_sampling_date)s
+    f.patient_age_when_sampling >= %(min_age)s
+    AND f.patient_age_when_sampling <= %(max_age)s
+    AND f.sampling_date >= %(min_sampling_date)s
+    AND f.sampling_date <= %(max_sampling_date)s
 """
+
+# Интервалы вложенных множеств (mkb.lft, mkb.rgt) для выбранных узлов МКБ:
+# узел означает все свое поддерево (db/update-mkb-nested-set.sql)
+diagnosis_ranges_query = (
+    "ARRAY(SELECT int4range(m.lft, m.rgt, '[]') FROM mkb AS m WHERE m.id = ANY({}))"
+)
+
+# Необязательные условия get_dataset. Списки передаются массивами (= ANY),
+# чтобы число параметров не зависело от длины списка
+dataset_query_filters = [
+    "AND f.diagnosis_lft <@ ANY(" + diagnosis_ranges_query.format("%(diagnoses)s") + ")\n",
+    "AND f.district_id = ANY(%(district)s)\n",
+    "AND f.gender_code = %(gender)s\n",
+    "AND f.test_id = ANY(%(test_ids)s)\n",
+]
+
+# Все возможные варианты запроса get_dataset: фильтры по диагнозам, районам, полу
+# и тестам включены / выключены (shape — кортеж из 4 флагов). Это обычный текст,
+# а не выражения реестра statements: get_dataset и iter_dataset выполняют запрос
+# внутри COPY и именованного курсора, где EXECUTE использовать нельзя
+def get_dataset_queries():
+    result = {}
+    for shape in itertools.product([False, True], repeat=len(dataset_query_filters)):
+        query = dataset_query_head
+        query += "".join(f for on, f in zip(shape, dataset_query_filters) if on) + ";"
+        result[shape] = query
+    return result
+
+
+dataset_queries = get_dataset_queries()
+
+
+# Текст запроса get_dataset, соответствующий фильтру, и его параметры
+def get_dataset_query(sample_filter, test_ids=None):
     params = {
         "min_age": sample_filter["age_interval"][0],
         "max_age": sample_filter["age_interval"][1],
@@ -116,23 +206,293 @@ WHERE
     }
 
     if sample_filter["diagnoses"] != []:
-        query += "AND rh.diagnosis_id IN %(diagnoses)s\n"
-        params["diagnoses"] = tuple(sample_filter["diagnoses"])
-    
+        params["diagnoses"] = list(sample_filter["diagnoses"])
+
     if sample_filter["district"] != [-1] and sample_filter["district"] != []:
-        query += "AND p.district_id IN %(district)s\n"
-        params["district"] = tuple(sample_filter["district"])
+        params["district"] = list(sample_filter["district"])
 
     if sample_filter["gender"] != "ANY":
-        query += "AND p.gender = %(gender)s\n"
-        params["gender"] = sample_filter["gender"]
+        params["gender"] = gender_codes[sample_filter["gender"]]
+
+    if test_ids is not None:
+        if type(test_ids) == int:
+            test_ids = [test_ids]
+        params["test_ids"] = list(test_ids)
+
+    shape = tuple(name in params for name in ["diagnoses", "district", "gender", "test_ids"])
+    return dataset_queries[shape], params
+
+
+# Приводит строки витрины к виду, который ожидают обработчики api:
+# код пола превращается обратно в "м"/"ж", название и мнемоника теста
+# подставляются из таблицы test
+def decode_fact_df(df, tests):
+    genders = pd.Series(list(gender_codes.keys()), index=list(gender_codes.values()))
+    df["gender"] = df["gender_code"].map(genders).astype("category")
+
+    tests = tests.set_index("id")
+    df["test_name"] = df["test_id"].map(tests["name"]).astype("category")
+    df["test_mnemonic"] = df["test_id"].map(tests["mnemonic"]).astype("category")
+
+    return df[dataset_columns]
+
+
+def get_dataset(connection, sample_filter, test_ids=None):
+    query, params = get_dataset_query(sample_filter, test_ids)
+
+    df = copy_result_as_df(
+        connection,
+        query,
+        params,
+        dtype=fact_dtypes,
+        parse_dates=fact_date_columns,
+    )
+    return decode_fact_df(df, get_test_names(connection))
+
+
+# Потоковый вариант get_dataset: строки читаются серверным (именованным) курсором
+# и отдаются фрагментами по chunk_size строк, поэтому в памяти одновременно
+# находится только один фрагмент. Курсор живет внутри транзакции соединения
+def iter_dataset(connection, sample_filter, test_ids=None, chunk_size=None):
+    if chunk_size is None:
+        chunk_size = dataset_chunk_size
+
+    query, params = get_dataset_query(sample_filter, test_ids)
+    tests = get_test_names(connection)
+
+    with connection.cursor(name=f"dataset_{uuid.uuid4().hex}") as cur:
+        cur.itersize = chunk_size
+        cur.execute(query, params)
+
+        col_names = None
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            if col_names is None:
+                col_names = [desc[0] for desc in cur.description]
+
+            df = pd.DataFrame(rows, columns=col_names)
+            df["sampling_date"] = pd.to_datetime(df["sampling_date"])
+            yield decode_fact_df(df.astype(fact_dtypes), tests)
+
+
+# Фильтры нескольких выборок в виде CTE samples (одна строка VALUES на выборку).
+# Соединение sample_fact с samples по условиям фильтра отбирает строки всех выборок
+# одним запросом, строка может попасть сразу в несколько пересекающихся выборок.
+# NULL в колонке фильтра означает, что фильтр выключен. Выбранные узлы МКБ
+# превращаются в интервалы diagnosis_ranges (как в get_dataset_query). Типы всех
+# параметров указаны явно: в подготовленном выражении (PREPARE) их не из чего вывести.
+# Текст зависит только от числа выборок
+def get_samples_cte(sample_filters):
+    rows = []
+    params = {}
+    for i, sample_filter in enumerate(sample_filters):
+        rows.append(
+            f"(%(s{i}_index)s::INT4, %(s{i}_name)s::TEXT, "
+            f"%(s{i}_min_age)s::INT4, %(s{i}_max_age)s::INT4, "
+            f"%(s{i}_min_date)s::DATE, %(s{i}_max_date)s::DATE, "
+            f"%(s{i}_diagnoses)s::INT4[], %(s{i}_district)s::INT4[], %(s{i}_gender)s::INT2)"
+        )
+
+        district = sample_filter["district"]
+        if district == [-1] or district == []:
+            district = None
+
+        params.update({
+            f"s{i}_index": i,
+            f"s{i}_name": sample_filter.get("name"),
+            f"s{i}_min_age": sample_filter["age_interval"][0],
+            f"s{i}_max_age": sample_filter["age_interval"][1],
+            f"s{i}_min_date": sample_filter["sampling_date_interval"][0],
+            f"s{i}_max_date": sample_filter["sampling_date_interval"][1],
+            f"s{i}_diagnoses": sample_filter["diagnoses"] or None,
+            f"s{i}_district": district,
+            f"s{i}_gender": gender_codes.get(sample_filter["gender"]),
+        })
+
+    cte = """
+samples AS (
+    SELECT
+        v.*,
+        """ + diagnosis_ranges_query.format("v.diagnoses") + """ AS diagnosis_ranges
+    FROM (
+        VALUES
+        """ + ",\n        ".join(rows) + """
+    ) AS v (
+        sample_index, sample_name, min_age, max_age, min_date, max_date,
+        diagnoses, district, gender_code
+    )
+)"""
+
+    return cte, params
+
+
+samples_join_condition = """
+    f.patient_age_when_sampling >= s.min_age
+    AND f.patient_age_when_sampling <= s.max_age
+    AND f.sampling_date >= s.min_date
+    AND f.sampling_date <= s.max_date
+    AND (s.diagnoses IS NULL OR f.diagnosis_lft <@ ANY(s.diagnosis_ranges))
+    AND (s.district IS NULL OR f.district_id = ANY(s.district))
+    AND (s.gender_code IS NULL OR f.gender_code = s.gender_code)
+"""
+
+
+# Описательные статистики для /api/stats, посчитанные в PostgreSQL одним запросом.
+# Результат — длинная таблица: kind = "test" (по выборке и тесту), "age" (по выборке),
+# "gender" (число строк по выборке и коду пола), "rows" (число строк по номеру выборки).
+# Запрос выполняется обычным курсором, поэтому он подготавливается: в реестре
+# statements по выражению на каждое число выборок
+def get_stats_summary(connection, sample_filters, test_ids):
+    query, params = get_stats_summary_query(sample_filters, test_ids)
+    statement = statements.register(f"get_stats_summary_{len(sample_filters)}", query)
+    return get_result_as_df(connection, statement, params)
+
+
+# Текст запроса get_stats_summary и его параметры
+def get_stats_summary_query(sample_filters, test_ids):
+    cte, params = get_samples_cte(sample_filters)
+    params["test_ids"] = list(test_ids)
+
+    query = "WITH" + cte + """,
+data AS (
+    SELECT
+        s.sample_index,
+        s.sample_name,
+        f.test_id,
+        f.result,
+        f.patient_age_when_sampling AS age,
+        f.gender_code
+    FROM sample_fact AS f
+    JOIN samples AS s ON""" + samples_join_condition + """
+    WHERE f.test_id = ANY(%(test_ids)s::INT4[])
+)
+SELECT
+    'test' AS kind,
+    NULL::INT4 AS sample_index,
+    sample_name,
+    test_id AS key,
+    count(result) AS count,
+    min(result) AS min,
+    percentile_cont(0.25) WITHIN GROUP (ORDER BY result) AS q25,
+    percentile_cont(0.50) WITHIN GROUP (ORDER BY result) AS q50,
+    percentile_cont(0.75) WITHIN GROUP (ORDER BY result) AS q75,
+    max(result) AS max,
+    avg(result) AS mean,
+    stddev_samp(result) AS std
+FROM data
+GROUP BY sample_name, test_id
+UNION ALL
+SELECT
+    'age', NULL, sample_name, NULL,
+    count(age),
+    min(age),
+    percentile_cont(0.25) WITHIN GROUP (ORDER BY age),
+    percentile_cont(0.50) WITHIN GROUP (ORDER BY age),
+    percentile_cont(0.75) WITHIN GROUP (ORDER BY age),
+    max(age),
+    avg(age)::FLOAT8,
+    stddev_samp(age)::FLOAT8
+FROM data
+GROUP BY sample_name
+UNION ALL
+SELECT
+    'gender', NULL, sample_name, gender_code,
+    count(*), NULL, NULL, NULL, NULL, NULL, NULL, NULL
+FROM data
+GROUP BY sample_name, gender_code
+UNION ALL
+SELECT
+    'rows', sample_index, NULL, NULL,
+    count(*), NULL, NULL, NULL, NULL, NULL, NULL, NULL
+FROM data
+GROUP BY sample_index;
+"""
+
+    return query, params
+
+
+# Пакетный вариант get_dataset: строки всех выборок читаются одним запросом
+# (один проход по sample_fact вместо отдельного запроса на каждую выборку).
+# Каждая строка помечается номером выборки, строка пересекающихся выборок
+# приходит несколько раз. Возвращает список таблиц в порядке sample_filters
+def get_datasets(connection, sample_filters, test_ids=None):
+    cte, params = get_samples_cte(sample_filters)
+
+    query = "WITH" + cte + """
+SELECT
+    s.sample_index,
+    f.referral_header_id,
+    f.patient_id,
+    f.diagnosis_id,
+    f.test_id,
+    f.sampling_date,
+    f.result,
+    f.patient_age_when_sampling,
+    f.gender_code,
+    f.district_id
+FROM sample_fact AS f
+JOIN samples AS s ON""" + samples_join_condition
 
     if test_ids is not None:
         if type(test_ids) == int:
             test_ids = [test_ids]
-        query += "AND test_id IN %(test_ids)s\n"
+        query += "WHERE f.test_id IN %(test_ids)s\n"
         params["test_ids"] = tuple(test_ids)
 
     query += ";"
 
-    return get_result_as_df(connection, query, params)
+    df = copy_result_as_df(
+        connection,
+        query,
+        params,
+        dtype=dict(fact_dtypes, sample_index="int64"),
+        parse_dates=fact_date_columns,
+    )
+    sample_index = df.pop("sample_index").to_numpy()
+    df = decode_fact_df(df, get_test_names(connection))
+
+    # Строки каждой выборки — непрерывный отрезок после устойчивой сортировки по номеру
+    order = np.argsort(sample_index, kind="stable")
+    bounds = np.searchsorted(sample_index[order], np.arange(len(sample_filters) + 1))
+
+    dfs = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        sample_df = df.iloc[order[start:end]].reset_index(drop=True)
+        # Категории, которые встречаются только в других выборках
+        for column in sample_df.select_dtypes("category").columns:
+            sample_df[column] = sample_df[column].cat.remove_unused_categories()
+        dfs.append(sample_df)
+
+    return dfs
+
+
+# Нумерует справочник МКБ вложенными множествами (колонки mkb.lft, mkb.rgt)
+def update_mkb_nested_set(connection):
+    query = (common.DB_DIR / "update-mkb-nested-set.sql").read_text(encoding="utf-8")
+    with connection:
+        with connection.cursor() as cur:
+            cur.execute(query)
+
+
+# Создает витрину sample_fact, если ее еще нет, и заполняет ее текущими данными
+def refresh_sample_fact(connection):
+    query = (common.DB_DIR / "create-sample-fact.sql").read_text(encoding="utf-8")
+    with connection:
+        with connection.cursor() as cur:
+            cur.execute(query)
+            cur.execute("REFRESH MATERIALIZED VIEW sample_fact;")
+            cur.execute("ANALYZE sample_fact;")
+            cur.execute("SELECT nextval('data_version_seq');")
+
+
+def get_data_version(connection):
+    statement = statements.register(
+        "get_data_version", "SELECT last_value, is_called FROM data_version_seq;"
+    )
+    with connection.cursor() as cur:
+        statements.execute(cur, statement)
+        last_value, is_called = cur.fetchone()
+
+    return last_value if is_called else 0
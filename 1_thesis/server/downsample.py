@@ -0,0 +1,129 @@
+import common
+import numpy as np
+import pandas as pd
+from dotenv import dotenv_values
+
+config = dotenv_values(common.ENV_FILE)
+
+# Прореживание точек перед отрисовкой (диаграмма рассеяния, матрица диаграмм
+# кластеров). Время отрисовки и размер картинки растут с числом точек, а после
+# нескольких тысяч точек график уже не становится информативнее.
+# Простая случайная выборка сохраняет плотность, но теряет редкие группы и выбросы,
+# поэтому:
+# - бюджет точек делится между группами (кластерами, выборками) пропорционально
+#   их размеру, но не меньше min_stratum_points на группу;
+# - внутри группы большая часть бюджета — случайная выборка (сохраняет плотность),
+#   остальное — по одной точке из ячеек сетки, не попавших в случайную выборку,
+#   начиная с самых редких (сохраняет выбросы и границы облака точек)
+max_points_to_draw = int(config.get("MAX_POINTS_TO_DRAW") or 5000)
+# В матрице диаграмм каждая точка рисуется на каждой из n * n диаграмм
+max_points_to_draw_pairplot = int(config.get("MAX_POINTS_TO_DRAW_PAIRPLOT") or 1000)
+
+min_stratum_points = 20
+# Доля бюджета группы на точки из непокрытых ячеек сетки
+coverage_share = 0.2
+max_grid_size = 64
+# Одинаковый запрос дает одинаковую картинку (в том числе для plot_cache)
+seed = 0
+
+
+# Распределение бюджета по группам: пропорционально размеру (метод наибольших
+# остатков), но каждой группе не меньше min(размер, min_stratum_points)
+def allocate(sizes, budget):
+    sizes = np.asarray(sizes, dtype="int64")
+    minimum = np.minimum(sizes, min_stratum_points)
+    if minimum.sum() >= budget:
+        minimum = np.minimum(sizes, max(budget // max(len(sizes), 1), 1))
+
+    rest = budget - minimum.sum()
+    extra_sizes = sizes - minimum
+    if rest <= 0 or extra_sizes.sum() == 0:
+        return minimum
+
+    quotas = extra_sizes * rest / extra_sizes.sum()
+    extra = np.floor(quotas).astype("int64")
+    remainder = rest - extra.sum()
+    extra[np.argsort(extra - quotas, kind="stable")[:remainder]] += 1
+    return minimum + np.minimum(extra, extra_sizes)
+
+
+# Номер ячейки сетки для каждой точки. Число ячеек по каждой оси подобрано так,
+# чтобы всего ячеек было порядка бюджета
+def get_cells(values, budget):
+    n, dims = values.shape
+    grid_size = int(min(max(budget ** (1 / max(dims, 1)), 2), max_grid_size))
+
+    low = np.nanmin(values, axis=0)
+    span = np.nanmax(values, axis=0) - low
+    span[span == 0] = 1
+    scaled = np.floor((values - low) / span * grid_size)
+    scaled = np.nan_to_num(np.clip(scaled, 0, grid_size - 1), nan=grid_size).astype("int64")
+
+    cells = np.zeros(n, dtype="int64")
+    for dim in range(dims):
+        cells = cells * (grid_size + 1) + scaled[:, dim]
+    return cells
+
+
+def thin_stratum(positions, cells, budget, rng):
+    if len(positions) <= budget:
+        return positions
+
+    coverage_budget = int(budget * coverage_share)
+    chosen = rng.choice(len(positions), budget - coverage_budget, replace=False)
+    taken = np.zeros(len(positions), dtype=bool)
+    taken[chosen] = True
+
+    # Ячейки без выбранных точек, от самых редких; из каждой — одна случайная точка
+    stratum_cells = cells[positions]
+    unique_cells, inverse, counts = np.unique(stratum_cells, return_inverse=True, return_counts=True)
+    covered = np.zeros(len(unique_cells), dtype=bool)
+    covered[inverse[taken]] = True
+
+    # Первая точка каждой ячейки в случайном порядке
+    order = rng.permutation(len(positions))
+    _, first = np.unique(inverse[order], return_index=True)
+    first_in_cell = order[first]
+
+    uncovered = np.flatnonzero(~covered)
+    uncovered = uncovered[np.argsort(counts[uncovered], kind="stable")][:coverage_budget]
+    taken[first_in_cell[uncovered]] = True
+
+    # Оставшийся бюджет (ячеек меньше, чем он) — снова случайной выборкой
+    missing = budget - taken.sum()
+    if missing > 0:
+        taken[rng.choice(np.flatnonzero(~taken), missing, replace=False)] = True
+
+    return positions[taken]
+
+
+# Возвращает не больше budget строк df. columns — координаты точек на графике,
+# strata — колонка групп (кластер, выборка), доли которых нужно сохранить.
+# Порядок строк сохраняется
+def thin(df, columns, budget, strata=None):
+    if len(df) <= budget:
+        return df
+
+    rng = np.random.default_rng(seed)
+    values = df[columns].to_numpy(dtype="float64")
+    cells = get_cells(values, budget)
+
+    if strata is None:
+        groups = [np.arange(len(df))]
+    else:
+        codes = pd.factorize(df[strata], use_na_sentinel=False)[0]
+        groups = [np.flatnonzero(codes == code) for code in range(codes.max() + 1)]
+
+    budgets = allocate([len(group) for group in groups], budget)
+    positions = np.concatenate([
+        thin_stratum(group, cells, group_budget, rng)
+        for group, group_budget in zip(groups, budgets)
+    ])
+
+    return df.iloc[np.sort(positions)]
+
+
+def get_title(title, shown, total):
+    if shown == total:
+        return title
+    return f"{title} (показано {shown} из {total} точек)"
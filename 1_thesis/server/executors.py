@@ -0,0 +1,45 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Пул процессов, запускаемых через spawn (отрисовка в render, вычисления в compute).
+# Как и пул соединений (pool.get_pool), пул создается в каждом процессе сервера
+# заново: пул, унаследованный после fork, использовать нельзя, а fork из
+# многопоточного сервера небезопасен. warm_up — пустая функция того модуля, который
+# должен быть импортирован в процессах пула: процессы запускаются и импортируют его
+# сразу при создании пула, а не при первой задаче. workers=0 — пула нет,
+# вычисления выполняются в текущем процессе
+
+
+class SpawnPool:
+    def __init__(self, workers, warm_up):
+        self.workers = workers
+        self.warm_up = warm_up
+
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def get_executor(self):
+        if not self.workers:
+            return None
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+                    self._pid = os.getpid()
+                    for _ in range(self.workers):
+                        self._executor.submit(self.warm_up)
+        return self._executor
+
+    # Если процесс аварийно завершился, пул больше не принимает задачи
+    # и при следующем обращении создается заново
+    def reset_executor(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
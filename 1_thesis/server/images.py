@@ -0,0 +1,226 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import common
+from dotenv import dotenv_values
+
+config = dotenv_values(common.ENV_FILE)
+
+# Хранилище готовых PNG. Вместо base64 внутри JSON (на треть больше самих байтов
+# и лишняя копия при кодировании) ответ может содержать ссылку /api/images/<hash>.png,
+# а картинка отдается отдельным запросом как есть. Ключ — SHA-256 содержимого,
+# поэтому одинаковые графики хранятся один раз, а ответ по ссылке никогда не меняется
+# и кэшируется браузером.
+# Два уровня: память процесса и (если задан IMAGE_STORE_DIR) каталог на диске, общий
+# для всех процессов сервера и переживающий перезапуск. Кроме картинок хранятся
+# псевдонимы — произвольные ключи (например, ключ запроса графика, см. plot_cache),
+# указывающие на хэш картинки
+max_bytes = int(config.get("IMAGE_STORE_MAX_BYTES") or 128 * 2**20)
+max_aliases = int(config.get("IMAGE_STORE_MAX_ALIASES") or 10000)
+directory = config.get("IMAGE_STORE_DIR") or None
+disk_max_bytes = int(config.get("IMAGE_STORE_DISK_MAX_BYTES") or 2**30)
+
+key_pattern = re.compile(r"[0-9a-f]{64}")
+
+
+class ImageStore:
+    def __init__(self, max_bytes, max_aliases, directory=None, disk_max_bytes=None):
+        self.max_bytes = max_bytes
+        self.max_aliases = max_aliases
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+
+        self._lock = threading.Lock()
+        self._images = OrderedDict()  # от давно использованных к недавно использованным
+        self._aliases = OrderedDict()
+        self._bytes = 0
+
+        self._disk_lock = threading.Lock()
+        self._disk_bytes = None  # считается при первой записи
+
+        self.puts = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def put(self, png):
+        key = hashlib.sha256(png).hexdigest()
+        with self._lock:
+            self.puts += 1
+        self._put_memory(key, png)
+        self._write_disk(key + ".png", png)
+        return key
+
+    def get(self, key):
+        # Ключ приходит из адреса запроса и используется как имя файла
+        if not key_pattern.fullmatch(key):
+            return None
+
+        with self._lock:
+            png = self._images.get(key)
+            if png is not None:
+                self._images.move_to_end(key)
+                self.hits += 1
+                return png
+
+        png = self._read_disk(key + ".png")
+        with self._lock:
+            if png is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self._put_memory(key, png)
+        return png
+
+    def put_alias(self, alias, key):
+        with self._lock:
+            self._aliases[alias] = key
+            self._aliases.move_to_end(alias)
+            while len(self._aliases) > self.max_aliases:
+                self._aliases.popitem(last=False)
+        self._write_disk(alias + ".alias", key.encode("ascii"))
+
+    def get_alias(self, alias):
+        with self._lock:
+            key = self._aliases.get(alias)
+            if key is not None:
+                self._aliases.move_to_end(alias)
+                return key
+
+        key = self._read_disk(alias + ".alias")
+        if key is None:
+            return None
+        key = key.decode("ascii")
+        with self._lock:
+            self._aliases[alias] = key
+        return key
+
+    def remove_alias(self, alias):
+        with self._lock:
+            self._aliases.pop(alias, None)
+        if self.directory is not None:
+            try:
+                os.remove(os.path.join(self.directory, alias + ".alias"))
+            except FileNotFoundError:
+                pass
+
+    def _put_memory(self, key, png):
+        with self._lock:
+            if key in self._images:
+                self._images.move_to_end(key)
+                return
+
+            self._images[key] = bytes(png)
+            self._bytes += len(png)
+            # Последнюю добавленную картинку не вытесняем, даже если она больше лимита:
+            # ссылка на нее уже уходит клиенту
+            while self._bytes > self.max_bytes and len(self._images) > 1:
+                _, evicted = self._images.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    ### Уровень на диске ###
+
+    def _read_disk(self, name):
+        if self.directory is None:
+            return None
+
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+            # Время изменения файла — время последнего использования (см. _evict_disk)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def _write_disk(self, name, data):
+        if self.directory is None:
+            return
+
+        path = os.path.join(self.directory, name)
+        if os.path.exists(path):
+            os.utime(path)
+            return
+
+        # Запись во временный файл и переименование: другой процесс не прочитает
+        # недописанный файл
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(data)
+        os.replace(temp_path, path)
+
+        with self._disk_lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(entry.stat().st_size for entry in self._scan_disk())
+            else:
+                self._disk_bytes += len(data)
+            if self._disk_bytes > self.disk_max_bytes:
+                self._evict_disk()
+
+    def _scan_disk(self):
+        return [
+            entry
+            for entry in os.scandir(self.directory)
+            if entry.is_file() and not entry.name.endswith(".tmp")
+        ]
+
+    # Удаляются давно использованные файлы, пока каталог не займет не больше 90% лимита
+    # (чтобы не проходить по каталогу при каждой записи). Каталог могут заполнять
+    # несколько процессов, поэтому размер пересчитывается по самим файлам
+    def _evict_disk(self):
+        entries = []
+        for entry in self._scan_disk():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        target = self.disk_max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.disk_evictions += 1
+        self._disk_bytes = total
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._images),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "aliases": len(self._aliases),
+                "directory": self.directory,
+                "disk_bytes": self._disk_bytes,
+                "disk_max_bytes": self.disk_max_bytes if self.directory is not None else None,
+                "puts": self.puts,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk_evictions": self.disk_evictions,
+            }
+
+
+image_store = ImageStore(max_bytes, max_aliases, directory, disk_max_bytes)
+
+
+def get_url(key):
+    return f"/api/images/{key}.png"
@@ -300,6 +300,9 @@ def import_mkb(conn):
         level += 1
         mask = mkb.parent_id.isin(df.id)  # Идем на следующий уровень
 
+    # Интервалы вложенных множеств для фильтра по группам диагнозов
+    db.update_mkb_nested_set(conn)
+
 
 def import_referral_headers(data, conn):
     data = data[["referral_id", "db_patient_id", "db_diagnosis_id"]]
@@ -513,6 +516,10 @@ def main():
     import_referral_bodies(data, conn)
     print("done")
 
+    print("Refreshing sample fact... ", end="", flush=True)
+    db.refresh_sample_fact(conn)
+    print("done")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import threading
+
+import cache
+import db
+import numpy as np
+import pandas as pd
+
+# Дерево диагнозов МКБ в памяти процесса. Строится один раз (при первом запросе
+# и после импорта новых данных) и хранится в массивах NumPy: родитель каждого узла
+# и интервалы обхода в глубину (Euler tour). Поддерево узла — непрерывный отрезок
+# [tin, tout) в порядке обхода, поэтому сумма по поддереву и вложенность узлов
+# проверяются без рекурсии
+
+ROOT_ID = -1
+ROOT_NAME = "Все диагнозы"
+
+
+class DiagnosisTree:
+    def __init__(self, df):
+        # df — результат db.get_diagnoses: id, code, name, parent_id, level, count
+        self.df = df.reset_index(drop=True)
+        self.ids = self.df["id"].to_numpy(dtype="int64")
+        self.index = pd.Index(self.ids)
+
+        parent_ids = self.df["parent_id"].fillna(ROOT_ID).to_numpy(dtype="int64")
+        self.parents = self.index.get_indexer(parent_ids)  # -1 у узлов верхнего уровня
+
+        self.preorder, self.tin, self.tout = get_euler_tour(self.parents)
+
+        self.own_counts = np.zeros(len(self.ids), dtype="int64")
+        self.subtree_counts = np.zeros(len(self.ids), dtype="int64")
+        self.set_counts(self.df["count"].fillna(0).to_numpy(dtype="int64"))
+
+    def has_same_structure(self, df):
+        parent_ids = df["parent_id"].fillna(ROOT_ID).to_numpy(dtype="int64")
+        return (
+            len(df) == len(self.ids)
+            and (df["id"].to_numpy(dtype="int64") == self.ids).all()
+            and (self.index.get_indexer(parent_ids) == self.parents).all()
+        )
+
+    # Полный пересчет: сумма собственных количеств на отрезке [tin, tout)
+    def set_counts(self, counts):
+        self.own_counts = np.asarray(counts, dtype="int64").copy()
+        cumulative = np.r_[0, np.cumsum(self.own_counts[self.preorder])]
+        self.subtree_counts = cumulative[self.tout] - cumulative[self.tin]
+        self.update_response()
+
+    # Изменение количеств отдельных диагнозов: приращение добавляется узлу
+    # и всем его предкам, остальное дерево не пересчитывается
+    def add_counts(self, diagnosis_ids, deltas):
+        positions = self.index.get_indexer(diagnosis_ids)
+        deltas = np.asarray(deltas, dtype="int64")
+        known = positions >= 0
+        positions, deltas = positions[known], deltas[known]
+
+        np.add.at(self.own_counts, positions, deltas)
+        while len(positions):
+            np.add.at(self.subtree_counts, positions, deltas)
+            positions = self.parents[positions]
+            known = positions >= 0
+            positions, deltas = positions[known], deltas[known]
+
+        self.update_response()
+
+    def update_counts(self, df):
+        counts = df["count"].fillna(0).to_numpy(dtype="int64")
+        changed = np.flatnonzero(counts != self.own_counts)
+        if len(changed):
+            self.add_counts(self.ids[changed], counts[changed] - self.own_counts[changed])
+
+    # Выбранный узел означает все свое поддерево (см. db/update-mkb-nested-set.sql),
+    # поэтому узлы, у которых выбран один из предков, лишние. Остаются только корни
+    # выбранных поддеревьев — короткий список вместо всех потомков. Неизвестные id сохраняются
+    def get_subtree_roots(self, diagnosis_ids):
+        positions = self.index.get_indexer(diagnosis_ids)
+        unknown = [d for d, p in zip(diagnosis_ids, positions) if p < 0]
+        positions = np.unique(positions[positions >= 0])
+
+        # Отрезки поддеревьев [tin, tout) вложены или не пересекаются: при обходе
+        # по возрастанию tin узел — корень, если начинается после конца предыдущего корня
+        positions = positions[np.argsort(self.tin[positions])]
+        roots = []
+        end = -1
+        for position in positions:
+            if self.tin[position] >= end:
+                roots.append(position)
+                end = self.tout[position]
+
+        return sorted(set(self.ids[roots].tolist()) | set(unknown))
+
+    # Таблица для /api/diagnoses: count — число направлений в поддереве,
+    # group_count — с самим диагнозом. Корень "Все диагнозы" добавляется отдельной строкой
+    def to_frame(self):
+        df = self.df[["id", "code", "name", "parent_id", "level"]].copy()
+        df["parent_id"] = df["parent_id"].fillna(ROOT_ID).astype("int")
+        df["count"] = self.subtree_counts
+        df["group_count"] = self.own_counts
+
+        root = pd.DataFrame(
+            {
+                "id": ROOT_ID,
+                "code": "",
+                "name": ROOT_NAME,
+                "parent_id": -2,
+                "level": -1,
+                "count": int(self.own_counts.sum()),
+                "group_count": 0,
+            },
+            index=[len(df)],
+        )
+        df = pd.concat([df, root], copy=False)
+        df["count"] = df["count"].astype("int")
+        df["group_count"] = df["group_count"].astype("int")
+
+        return df.sort_values(["level", "count"], ascending=False)
+
+    # Готовый ответ и его ETag: клиент, у которого дерево уже есть, получает 304
+    def update_response(self):
+        body = json.dumps(self.to_frame().to_dict("records"), ensure_ascii=False)
+        self.response_body = body
+        self.etag = hashlib.sha1(body.encode("utf-8")).hexdigest()
+
+
+# Обход в глубину без рекурсии. Возвращает порядок обхода и для каждого узла
+# границы его поддерева в этом порядке
+def get_euler_tour(parents):
+    n = len(parents)
+    # Дочерние узлы в виде CSR: children[offsets[i]:offsets[i + 1]] — дети узла i,
+    # узлы верхнего уровня — дети виртуального корня n
+    parent_keys = np.where(parents >= 0, parents, n)
+    children = np.argsort(parent_keys, kind="stable")
+    offsets = np.searchsorted(parent_keys[children], np.arange(n + 2))
+
+    preorder = np.empty(n, dtype="int64")
+    tin = np.empty(n, dtype="int64")
+    tout = np.empty(n, dtype="int64")
+
+    counter = 0
+    stack = [(n, False)]
+    while stack:
+        node, exiting = stack.pop()
+        if exiting:
+            tout[node] = counter
+            continue
+        if node != n:
+            preorder[counter] = node
+            tin[node] = counter
+            counter += 1
+            stack.append((node, True))
+        # Дети кладутся в обратном порядке, чтобы обходиться в исходном
+        stack.extend((child, False) for child in children[offsets[node]:offsets[node + 1]][::-1])
+
+    return preorder, tin, tout
+
+
+_tree = None
+_tree_version = None
+_tree_lock = threading.Lock()
+
+
+# Дерево перестраивается, когда меняется версия данных (см. cache.SampleCache.check_version).
+# Если справочник МКБ не изменился, пересчитываются только количества
+def get_tree(connection):
+    global _tree, _tree_version
+
+    cache.sample_cache.check_version(connection)
+    version = cache.sample_cache.data_version
+    if _tree is not None and _tree_version == version:
+        return _tree
+
+    with _tree_lock:
+        if _tree is None or _tree_version != version:
+            df = db.get_diagnoses(connection)
+            if _tree is not None and _tree.has_same_structure(df):
+                _tree.update_counts(df)
+            else:
+                _tree = DiagnosisTree(df)
+            _tree_version = version
+
+    return _tree
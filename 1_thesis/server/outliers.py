@@ -0,0 +1,332 @@
+import functools
+import hashlib
+import threading
+from collections import OrderedDict
+
+import common
+import numpy as np
+import pandas as pd
+from dotenv import dotenv_values
+from sklearn.neighbors import BallTree, KDTree
+
+config = dotenv_values(common.ENV_FILE)
+
+# Фильтрация выбросов перед построением графиков и кластеризацией (параметр z_value).
+# Маска считается за один проход по матрице значений сразу для всех колонок: строка
+# остается, если ни в одной колонке она не выброс. Статистики всех колонок считаются
+# по исходной таблице, а не по таблице, уже отфильтрованной по предыдущим колонкам.
+# Если заданы группы (например, выборки на ящичной диаграмме), выбросы ищутся
+# внутри каждой группы отдельно.
+# Методы (threshold — значение z_value):
+# - zscore: |x - среднее| / ст. отклонение < threshold;
+# - mad: |x - медиана| / (1.4826 * MAD) < threshold — устойчив к самим выбросам;
+# - iqr: x в пределах [Q1 - threshold * IQR, Q3 + threshold * IQR] (правило Тьюки);
+# - lof: локальный коэффициент выброса (LOF) по всем колонкам сразу меньше threshold
+#   (у обычных точек он около 1). Число соседей — lof_neighbors.
+# Кэшируются только маски lof (по содержимому данных, порогу и числу соседей) и
+# индекс соседей: новый порог или число соседей не перестраивают дерево. Маски
+# zscore, mad и iqr считаются заново: они не дороже хэша данных, по которому их
+# пришлось бы искать в кэше
+methods = ["zscore", "mad", "iqr", "lof"]
+default_method = "zscore"
+
+mask_cache_max_bytes = int(config.get("OUTLIER_MASK_CACHE_MAX_BYTES") or 16 * 2**20)
+
+# Переводит MAD в оценку стандартного отклонения для нормального распределения
+mad_scale = 1.4826
+
+lof_neighbors = int(config.get("LOF_NEIGHBORS") or 20)
+max_lof_neighbors = 100
+# Выше этого числа строк LOF считается приближенно: индекс соседей строится по
+# случайной опорной подвыборке такого размера, и каждая строка сравнивается с ней.
+# Время построения и запросов тогда ограничено, а не растет вместе с таблицей
+lof_max_rows = int(config.get("LOF_MAX_ROWS") or 20000)
+neighbor_index_cache_size = int(config.get("NEIGHBOR_INDEX_CACHE_SIZE") or 8)
+# KD-дерево быстрее при небольшом числе колонок, дальше — шаровое дерево
+kd_tree_max_dims = 15
+
+
+# Отклонения, нормированные на разброс, для матрицы values (n строк, k колонок).
+# Нулевой разброс означает, что выбросов в колонке нет
+def get_scores(values, center, spread):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = np.abs(values - center) / spread
+    scores[:, spread == 0] = 0
+    return scores
+
+
+def get_zscore_mask(values, threshold):
+    scores = get_scores(values, np.nanmean(values, axis=0), np.nanstd(values, axis=0))
+    return (scores < threshold).all(axis=1)
+
+
+def get_mad_mask(values, threshold):
+    median = np.nanmedian(values, axis=0)
+    mad = mad_scale * np.nanmedian(np.abs(values - median), axis=0)
+    # Больше половины одинаковых значений (MAD = 0): вместо MAD — среднее
+    # абсолютное отклонение (его отношение к ст. отклонению 0.7979)
+    mean_ad = np.nanmean(np.abs(values - median), axis=0) / 0.7979
+    spread = np.where(mad > 0, mad, mean_ad)
+    scores = get_scores(values, median, spread)
+    return (scores < threshold).all(axis=1)
+
+
+def get_iqr_mask(values, threshold):
+    q1, q3 = np.nanpercentile(values, [25, 75], axis=0)
+    iqr = q3 - q1
+    return ((values >= q1 - threshold * iqr) & (values <= q3 + threshold * iqr)).all(axis=1)
+
+
+# Индекс ближайших соседей для матрицы values (без пропусков) — дерево по опорным
+# строкам и найденные соседи. Строится один раз для матрицы и переиспользуется
+# запросами с разным порогом и числом соседей (см. neighbor_index_cache)
+class NeighborIndex:
+    def __init__(self, values, max_rows):
+        self.values = values
+        if len(values) > max_rows:
+            rng = np.random.default_rng(0)
+            self.reference = np.sort(rng.choice(len(values), max_rows, replace=False))
+        else:
+            self.reference = np.arange(len(values))
+
+        tree_class = KDTree if values.shape[1] <= kd_tree_max_dims else BallTree
+        self.tree = tree_class(values[self.reference])
+
+        self._lock = threading.Lock()
+        self._distances = None
+        self._indices = None
+
+    @property
+    def approximate(self):
+        return len(self.reference) < len(self.values)
+
+    # k ближайших опорных строк для каждой строки (сама строка не считается),
+    # по возрастанию расстояния. Соседи ищутся для наибольшего запрошенного k,
+    # меньшие k берут первые столбцы
+    def get_neighbors(self, k):
+        with self._lock:
+            if self._indices is None or self._indices.shape[1] < k:
+                self._distances, self._indices = self.query(k)
+            return self._distances[:, :k], self._indices[:, :k]
+
+    def query(self, k):
+        distances, indices = self.tree.query(self.values, k=k + 1)
+
+        # Номер строки среди опорных (-1 — не опорная). Если строки нет среди
+        # ее соседей (не опорная или совпадает с многими другими), вместо нее
+        # отбрасывается самый дальний сосед
+        own = np.full(len(self.values), -1)
+        own[self.reference] = np.arange(len(self.reference))
+        is_self = indices == own[:, None]
+        is_self[~is_self.any(axis=1), -1] = True
+
+        keep = ~is_self
+        return distances[keep].reshape(-1, k), indices[keep].reshape(-1, k)
+
+
+# LOF как в sklearn.neighbors.LocalOutlierFactor: отношение средней локальной
+# плотности соседей к плотности самой строки. В приближенном режиме соседи и их
+# плотности — только среди опорных строк (как LocalOutlierFactor(novelty=True),
+# обученный на опорной подвыборке)
+def get_lof_scores(index, n_neighbors):
+    k = min(n_neighbors, len(index.reference) - 1)
+    distances, indices = index.get_neighbors(k)
+
+    k_distance = distances[index.reference, -1]
+    reach_distances = np.maximum(distances, k_distance[indices])
+    density = 1 / (reach_distances.mean(axis=1) + 1e-10)
+    return density[index.reference][indices].mean(axis=1) / density
+
+
+def get_lof_mask(values, threshold, n_neighbors=lof_neighbors):
+    mask = ~np.isnan(values).any(axis=1)
+    rows = values[mask]
+    if len(rows) <= 2:
+        return mask
+
+    # Колонки в разных единицах приводятся к одному масштабу
+    spread = rows.std(axis=0)
+    spread[spread == 0] = 1
+    rows = (rows - rows.mean(axis=0)) / spread
+
+    index = get_neighbor_index(rows)
+    mask[mask] = get_lof_scores(index, n_neighbors) < threshold
+    return mask
+
+
+mask_functions = {
+    "zscore": get_zscore_mask,
+    "mad": get_mad_mask,
+    "iqr": get_iqr_mask,
+    "lof": get_lof_mask,
+}
+
+
+# Маска по группам: строки упорядочиваются по группе один раз, затем маска
+# считается на непрерывном отрезке матрицы каждой группы
+def compute_mask(values, method, threshold, groups=None, n_neighbors=None):
+    function = mask_functions[method]
+    if method == "lof":
+        function = functools.partial(function, n_neighbors=n_neighbors)
+    if groups is None:
+        return function(values, threshold)
+
+    order = np.argsort(groups, kind="stable")
+    sorted_groups = groups[order]
+    bounds = np.flatnonzero(np.diff(sorted_groups)) + 1
+    starts = np.r_[0, bounds]
+    ends = np.r_[bounds, len(order)]
+
+    mask = np.empty(len(values), dtype=bool)
+    for start, end in zip(starts, ends):
+        positions = order[start:end]
+        mask[positions] = function(values[positions], threshold)
+    return mask
+
+
+class MaskCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._masks = OrderedDict()  # от давно использованных к недавно использованным
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            mask = self._masks.get(key)
+            if mask is None:
+                self.misses += 1
+                return None
+            self._masks.move_to_end(key)
+            self.hits += 1
+            return mask
+
+    def put(self, key, mask):
+        with self._lock:
+            if key in self._masks:
+                return
+            self._masks[key] = mask
+            self._bytes += mask.nbytes
+            while self._bytes > self.max_bytes and len(self._masks) > 1:
+                _, evicted = self._masks.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._masks),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+mask_cache = MaskCache(mask_cache_max_bytes)
+
+
+class NeighborIndexCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()  # от давно использованных к недавно использованным
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.approximate = 0
+
+    def get(self, key):
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is None:
+                self.misses += 1
+                return None
+            self._indexes.move_to_end(key)
+            self.hits += 1
+            return index
+
+    def put(self, key, index):
+        with self._lock:
+            if key in self._indexes:
+                return self._indexes[key]
+            self._indexes[key] = index
+            if index.approximate:
+                self.approximate += 1
+            while len(self._indexes) > self.max_entries:
+                self._indexes.popitem(last=False)
+                self.evictions += 1
+            return index
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._indexes),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "approximate": self.approximate,
+                "max_rows": lof_max_rows,
+            }
+
+
+neighbor_index_cache = NeighborIndexCache(neighbor_index_cache_size)
+
+
+# Ключ — хэш самих значений (и групп): одинаковые данные, полученные разными
+# обработчиками, дают один ключ, а устаревшая маска не может подойти к новым данным
+def get_values_digest(values):
+    digest = hashlib.sha1(np.ascontiguousarray(values).view("uint8"))
+    digest.update(str(values.shape).encode())
+    return digest
+
+
+def get_mask_key(values, groups, method, threshold, n_neighbors):
+    digest = get_values_digest(values)
+    if groups is not None:
+        digest.update(np.ascontiguousarray(groups).view("uint8"))
+    return (digest.hexdigest(), method, float(threshold), n_neighbors)
+
+
+def get_neighbor_index(values):
+    key = get_values_digest(values).hexdigest()
+    index = neighbor_index_cache.get(key)
+    if index is None:
+        index = neighbor_index_cache.put(key, NeighborIndex(values, lof_max_rows))
+    return index
+
+
+def get_mask(values, method, threshold, groups=None, n_neighbors=None):
+    values = np.asarray(values, dtype="float64")
+    if values.ndim == 1:
+        values = values[:, None]
+    if groups is not None:
+        groups = pd.factorize(groups, use_na_sentinel=False)[0]
+    if method != "lof":
+        return compute_mask(values, method, threshold, groups)
+
+    n_neighbors = n_neighbors or lof_neighbors
+    key = get_mask_key(values, groups, method, threshold, n_neighbors)
+    mask = mask_cache.get(key)
+    if mask is None:
+        mask = compute_mask(values, method, threshold, groups, n_neighbors)
+        mask_cache.put(key, mask)
+    return mask
+
+
+# Строки df без выбросов по колонкам columns. group — колонка групп (или None),
+# n_neighbors — число соседей для lof (None — lof_neighbors)
+def filter_df(df, columns, method, threshold, group=None, n_neighbors=None):
+    groups = df[group].to_numpy() if group is not None else None
+    values = df[columns].to_numpy(dtype="float64")
+    mask = get_mask(values, method or default_method, threshold, groups, n_neighbors)
+    return df[mask]
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+# Построение широкой таблицы "направление × тест" из длинной выборки.
+# Заменяет последовательность drop_duplicates().pivot().dropna(): направления и тесты
+# кодируются целыми числами (factorize), значения раскладываются в заранее
+# выделенный массив NumPy одним присваиванием
+
+pivot_index = ["referral_header_id", "gender", "patient_age_when_sampling"]
+
+
+def pivot_results(df, columns="test_name", complete_cases=True, values="result"):
+    # complete_cases=True — оставить только направления, в которых есть все тесты
+    # (как dropna() после pivot), False — оставить пропуски как NaN
+    row_codes, row_levels = factorize_rows(df)
+    col_codes, col_uniques = pd.factorize(df[columns], sort=True)
+
+    # Повтор теста в одном направлении: как и drop_duplicates, берем первое значение
+    referral_codes, _ = pd.factorize(df["referral_header_id"], use_na_sentinel=False)
+    pair_codes = referral_codes.astype("int64") * len(col_uniques) + col_codes
+    first = ~pd.Series(pair_codes).duplicated().to_numpy()
+
+    matrix = np.full((len(row_levels[0]), len(col_uniques)), np.nan)
+    matrix[row_codes[first], col_codes[first]] = df[values].to_numpy(dtype="float64")[first]
+
+    index_arrays = row_levels
+    if complete_cases:
+        keep = ~np.isnan(matrix).any(axis=1)
+        matrix = matrix[keep]
+        index_arrays = [level[keep] for level in row_levels]
+
+    return pd.DataFrame(
+        matrix,
+        index=pd.MultiIndex.from_arrays(index_arrays, names=pivot_index),
+        columns=pd.Index(np.asarray(col_uniques), name=columns),
+    )
+
+
+# Строка результата определяется тройкой (направление, пол, возраст), как индекс в pivot.
+# Коды трех колонок объединяются в одно целое, строки упорядочены так же,
+# как отсортированный индекс pivot. Пропуск (например, не указан пол) получает
+# собственный код, как и в pivot: с кодом -1 объединенный код совпал бы
+# с кодом другого направления
+def factorize_rows(df):
+    codes = []
+    uniques = []
+    for column in pivot_index:
+        column_codes, column_uniques = pd.factorize(df[column], sort=True, use_na_sentinel=False)
+        codes.append(column_codes.astype("int64"))
+        uniques.append(np.asarray(column_uniques))
+
+    combined = codes[0]
+    for column_codes, column_uniques in zip(codes[1:], uniques[1:]):
+        combined = combined * len(column_uniques) + column_codes
+
+    row_codes, row_keys = pd.factorize(combined, sort=True)
+
+    levels = []
+    for column_uniques in reversed(uniques):
+        levels.append(column_uniques[row_keys % len(column_uniques)])
+        row_keys = row_keys // len(column_uniques)
+    levels.reverse()
+
+    return row_codes, levels
@@ -0,0 +1,78 @@
+import hashlib
+import json
+import threading
+
+import cache
+import images
+
+# Кэш построенных графиков. Повторный запрос того же графика (те же выборки, тесты
+# и параметры) не читает данные и не рисует заново, а берет готовый PNG из
+# images.image_store. Ключ запроса — хэш проверенных параметров и версии данных,
+# он хранится в image_store как псевдоним хэша картинки: картинки одинакового
+# содержимого хранятся один раз, а вытеснение (в памяти и на диске) общее с ними
+
+
+# Параметры, которые на картинку не влияют, в ключ не входят. Фильтр выборки
+# приводится к cache.get_sample_key (порядок диагнозов, формат дат), название
+# выборки сохраняется — оно есть на графике
+def normalize_params(value):
+    if isinstance(value, dict):
+        if "age_interval" in value:
+            return {"filter": cache.get_sample_key(value), "name": value.get("name")}
+        return {
+            name: normalize_params(item)
+            for name, item in value.items()
+            if name != "image_format"
+        }
+    if isinstance(value, list):
+        return [normalize_params(item) for item in value]
+    return value
+
+
+def get_plot_key(kind, params, connection):
+    cache.sample_cache.check_version(connection)
+    key = [kind, normalize_params(params), cache.sample_cache.data_version]
+    return hashlib.sha256(
+        json.dumps(key, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+class PlotCache:
+    def __init__(self, store):
+        self.store = store
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Ключ запроса найден, но картинка уже вытеснена из image_store
+        self.stale = 0
+
+    # Возвращает хэш картинки в image_store (для ссылки) и ее байты
+    def get(self, plot_key):
+        image_key = self.store.get_alias(plot_key)
+        png = self.store.get(image_key) if image_key is not None else None
+
+        with self._lock:
+            if png is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                if image_key is not None:
+                    self.stale += 1
+        if png is None:
+            if image_key is not None:
+                self.store.remove_alias(plot_key)
+            return None, None
+        return image_key, png
+
+    def put(self, plot_key, png):
+        image_key = self.store.put(png)
+        self.store.put_alias(plot_key, image_key)
+        return image_key
+
+    def get_stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "stale": self.stale}
+
+
+plot_cache = PlotCache(images.image_store)
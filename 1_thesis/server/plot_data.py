@@ -0,0 +1,233 @@
+import numpy as np
+import pandas as pd
+from scipy import stats as scipy_stats
+
+# Данные для отрисовки графика на клиенте (output: "data") вместо PNG. Принимает
+# те же spec и таблицу, что render.render, и возвращает агрегаты, по которым
+# строится график: границы и высоты столбцов гистограммы, значения KDE на сетке,
+# пятичисловые сводки, шестиугольные ячейки. Размер ответа зависит от числа
+# столбцов/ячеек, а не от числа строк выборки. Параметры агрегатов повторяют
+# значения по умолчанию seaborn и matplotlib, чтобы график совпадал с картинкой
+
+# Значащих цифр в числах ответа: для графика больше не нужно, а JSON короче
+digits = 6
+
+
+def to_list(values):
+    return [float(f"{value:.{digits}g}") for value in np.asarray(values, dtype="float64")]
+
+
+# Гауссово KDE с шириной окна по правилу Скотта (как в seaborn). Сетка выходит
+# за пределы данных на cut ширин окна
+def get_kde(values, gridsize, cut):
+    values = np.asarray(values, dtype="float64")
+    if len(values) < 2 or np.ptp(values) == 0:
+        return None
+
+    kde = scipy_stats.gaussian_kde(values, bw_method="scott")
+    bw = np.sqrt(kde.covariance.squeeze())
+    grid = np.linspace(values.min() - bw * cut, values.max() + bw * cut, gridsize)
+    return grid, kde(grid)
+
+
+def get_histogram(values, bins):
+    counts, edges = np.histogram(values, bins=bins)
+    return {"edges": to_list(edges), "counts": counts.tolist()}
+
+
+# Ящик с усами как в matplotlib.boxplot: усы до крайних значений в пределах
+# 1.5 межквартильного размаха, остальные точки — выбросы
+def get_box_stats(values):
+    values = np.asarray(values, dtype="float64")
+    q1, median, q3 = np.percentile(values, [25, 50, 75])
+    iqr = q3 - q1
+    inside = values[(values >= q1 - 1.5 * iqr) & (values <= q3 + 1.5 * iqr)]
+    whisker_low, whisker_high = (inside.min(), inside.max()) if len(inside) else (q1, q3)
+    fliers = values[(values < whisker_low) | (values > whisker_high)]
+
+    return {
+        "q1": float(q1),
+        "median": float(median),
+        "q3": float(q3),
+        "whisker_low": float(whisker_low),
+        "whisker_high": float(whisker_high),
+        "fliers": to_list(fliers),
+    }
+
+
+def get_groups(df, spec):
+    names = pd.unique(df[spec["x"]])
+    return [(name, df.loc[df[spec["x"]] == name, spec["y"]].dropna()) for name in names]
+
+
+def get_hist_data(df, spec):
+    values = df[spec["x"]].dropna().to_numpy(dtype="float64")
+    data = get_histogram(values, spec["bins"])
+
+    data["kde"] = None
+    if spec["kde"]:
+        # Как в histplot: кривая не выходит за пределы данных и масштабирована
+        # к высоте столбцов (число значений * ширина столбца)
+        kde = get_kde(values, gridsize=200, cut=0)
+        if kde is not None:
+            grid, density = kde
+            bin_width = data["edges"][1] - data["edges"][0]
+            data["kde"] = {"x": to_list(grid), "y": to_list(density * len(values) * bin_width)}
+
+    return data
+
+
+def get_kde_data(df, spec):
+    series = []
+    for name in df.columns:
+        kde = get_kde(df[name].dropna(), gridsize=200, cut=3)
+        if kde is not None:
+            grid, density = kde
+            series.append({"name": str(name), "x": to_list(grid), "y": to_list(density)})
+    return {"series": series}
+
+
+def get_box_data(df, spec):
+    return {
+        "groups": [
+            {"name": str(name), **get_box_stats(values)}
+            for name, values in get_groups(df, spec)
+        ],
+    }
+
+
+# Скрипка — KDE каждой группы (сетка 100 точек, cut=2, как в seaborn violinplot)
+# и ящик внутри. Плотности нормированы на общий максимум: ширина скрипок сравнима
+def get_violin_data(df, spec):
+    groups = []
+    for name, values in get_groups(df, spec):
+        group = {"name": str(name), **get_box_stats(values)}
+        del group["fliers"]
+
+        kde = get_kde(values, gridsize=100, cut=2)
+        if kde is not None:
+            group["grid"], group["density"] = kde
+        else:
+            # Одно значение (или ни одного): скрипка вырождается в линию
+            group["grid"] = np.unique(values)
+            group["density"] = np.ones(len(group["grid"]))
+        groups.append(group)
+
+    max_density = max((group["density"].max() for group in groups if len(group["density"])), default=1)
+    for group in groups:
+        group["density"] = to_list(group["density"] / max_density)
+        group["grid"] = to_list(group["grid"])
+    return {"groups": groups}
+
+
+def get_scatter_data(df, spec):
+    df = df[[spec["x"], spec["y"]]].dropna()
+    return {"x": df[spec["x"]].tolist(), "y": df[spec["y"]].tolist()}
+
+
+# Число шестиугольников по горизонтали выбирается как в seaborn jointplot(kind="hex")
+def get_hex_gridsize(x, y):
+    def freedman_diaconis_bins(values):
+        if len(values) < 2:
+            return 1
+        iqr = np.subtract.reduce(np.nanpercentile(values, [75, 25]))
+        h = 2 * iqr / (len(values) ** (1 / 3))
+        if h == 0:
+            return int(np.sqrt(values.size))
+        return int(np.ceil((values.max() - values.min()) / h))
+
+    return int(np.mean([min(freedman_diaconis_bins(x), 50), min(freedman_diaconis_bins(y), 50)]))
+
+
+def expand_singular(vmin, vmax, expander=0.1):
+    if vmin == vmax:
+        if vmin == 0:
+            return -expander, expander
+        return vmin - expander * abs(vmin), vmax + expander * abs(vmax)
+    return vmin, vmax
+
+
+# Разбиение на шестиугольники как в matplotlib.hexbin: две решетки центров, сдвинутые
+# на полшага, точка относится к ближайшему центру. Возвращаются только непустые ячейки
+def get_hexbin(x, y, gridsize):
+    nx = gridsize
+    ny = int(nx / np.sqrt(3))
+
+    xmin, xmax = expand_singular(x.min(), x.max())
+    ymin, ymax = expand_singular(y.min(), y.max())
+    padding = 1e-9 * (xmax - xmin)
+    xmin -= padding
+    xmax += padding
+    sx = (xmax - xmin) / nx
+    sy = (ymax - ymin) / ny
+
+    ix = (x - xmin) / sx
+    iy = (y - ymin) / sy
+    ix1, iy1 = np.round(ix).astype(int), np.round(iy).astype(int)
+    ix2, iy2 = np.floor(ix).astype(int), np.floor(iy).astype(int)
+
+    nx1, ny1 = nx + 1, ny + 1
+    i1 = np.where((0 <= ix1) & (ix1 < nx1) & (0 <= iy1) & (iy1 < ny1), ix1 * ny1 + iy1 + 1, 0)
+    i2 = np.where((0 <= ix2) & (ix2 < nx) & (0 <= iy2) & (iy2 < ny), ix2 * ny + iy2 + 1, 0)
+    first = (ix - ix1) ** 2 + 3.0 * (iy - iy1) ** 2 < (ix - ix2 - 0.5) ** 2 + 3.0 * (iy - iy2 - 0.5) ** 2
+
+    counts = np.concatenate([
+        np.bincount(i1[first], minlength=1 + nx1 * ny1)[1:],
+        np.bincount(i2[~first], minlength=1 + nx * ny)[1:],
+    ])
+    centers_x = np.concatenate([np.repeat(np.arange(nx1), ny1), np.repeat(np.arange(nx) + 0.5, ny)])
+    centers_y = np.concatenate([np.tile(np.arange(ny1), nx1), np.tile(np.arange(ny), nx) + 0.5])
+
+    filled = counts > 0
+    return {
+        # Вершины шестиугольника: центр + [sx, sy / 3] * [(.5, -.5), (.5, .5), (0, 1), ...]
+        "sx": float(sx),
+        "sy": float(sy),
+        "x": to_list(centers_x[filled] * sx + xmin),
+        "y": to_list(centers_y[filled] * sy + ymin),
+        "counts": counts[filled].tolist(),
+    }
+
+
+def get_hex_data(df, spec):
+    df = df[[spec["x"], spec["y"]]].dropna()
+    x = df[spec["x"]].to_numpy(dtype="float64")
+    y = df[spec["y"]].to_numpy(dtype="float64")
+    if len(x) == 0:
+        return {"sx": 0, "sy": 0, "x": [], "y": [], "counts": [], "marginal_x": None, "marginal_y": None}
+
+    data = get_hexbin(x, y, get_hex_gridsize(x, y))
+    # Гистограммы по краям, как histplot с bins="auto"
+    data["marginal_x"] = get_histogram(x, "auto")
+    data["marginal_y"] = get_histogram(y, "auto")
+    return data
+
+
+def get_heatmap_data(df, spec):
+    return {
+        "names": [str(name) for name in df.columns],
+        "values": [
+            [None if np.isnan(value) else float(f"{value:.{digits}g}") for value in row]
+            for row in df.to_numpy(dtype="float64")
+        ],
+    }
+
+
+calculators = {
+    "hist": get_hist_data,
+    "kde": get_kde_data,
+    "box": get_box_data,
+    "violin": get_violin_data,
+    "scatter": get_scatter_data,
+    "hex": get_hex_data,
+    "heatmap": get_heatmap_data,
+}
+
+
+def get_plot_data(spec, df):
+    data = calculators[spec["kind"]](df, spec)
+    data["kind"] = spec["kind"]
+    for field in ["title", "x", "y", "ylabel"]:
+        if field in spec:
+            data.setdefault("labels", {})[field] = str(spec[field])
+    return data
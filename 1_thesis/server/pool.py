@@ -0,0 +1,158 @@
+import os
+import threading
+import time
+
+import common
+import psycopg2 as pg
+from dotenv import dotenv_values
+from flask import g, has_app_context
+from psycopg2 import extensions as pg_extensions
+
+config = dotenv_values(common.ENV_FILE)
+
+# Размеры пула и таймауты можно переопределить в .env
+min_size = int(config.get("DB_POOL_MIN_SIZE") or 1)
+max_size = int(config.get("DB_POOL_MAX_SIZE") or 10)
+checkout_timeout = float(config.get("DB_POOL_TIMEOUT") or 30)  # seconds
+# Соединение, простоявшее без дела дольше этого времени, проверяется запросом SELECT 1
+health_check_interval = float(config.get("DB_POOL_HEALTH_CHECK_INTERVAL") or 30)  # seconds
+connect_retries = 3
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, min_size, max_size, timeout):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        # Ограничивает число одновременно выданных соединений
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle = []  # [(connection, время возврата в пул)]
+
+        for _ in range(min_size):
+            self._idle.append((connect(), time.monotonic()))
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f"No free database connection in {self.timeout} s")
+
+        try:
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    conn, released_at = self._idle.pop()
+
+                if is_healthy(conn, released_at):
+                    return conn
+                close_quietly(conn)
+
+            # Свободных живых соединений нет, но лимит еще не исчерпан
+            return connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn):
+        try:
+            if conn.closed:
+                return
+
+            status = conn.info.transaction_status
+            if status == pg_extensions.TRANSACTION_STATUS_UNKNOWN:
+                # Соединение с сервером потеряно
+                close_quietly(conn)
+                return
+            if status != pg_extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except pg.Error:
+                    close_quietly(conn)
+                    return
+
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            close_quietly(conn)
+
+
+def connect():
+    # Автоматическое переподключение: при недоступности сервера пробуем еще несколько раз
+    for attempt in range(connect_retries):
+        try:
+            return pg.connect(
+                dbname=config["DB_NAME"],
+                user=config["DB_USER"],
+                password=config["DB_PASSWORD"],
+            )
+        except pg.OperationalError:
+            if attempt == connect_retries - 1:
+                raise
+            time.sleep(0.5 * 2**attempt)
+
+
+def is_healthy(conn, released_at):
+    if conn.closed:
+        return False
+    if time.monotonic() - released_at < health_check_interval:
+        return True
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1;")
+        conn.rollback()
+        return True
+    except pg.Error:
+        return False
+
+
+def close_quietly(conn):
+    try:
+        conn.close()
+    except pg.Error:
+        pass
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool, _pool_pid
+    # После fork (несколько воркеров WSGI-сервера) унаследованные соединения
+    # использовать нельзя, поэтому каждый процесс создает собственный пул
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ConnectionPool(min_size, max_size, checkout_timeout)
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def get_connection():
+    # Внутри запроса Flask соединение берется из пула один раз и хранится в контексте
+    # приложения, возвращается оно в release_connection при завершении контекста
+    if not has_app_context():
+        raise RuntimeError("get_connection() must be called inside a Flask app context")
+
+    if "db_connection" not in g:
+        g.db_connection = get_pool().getconn()
+    return g.db_connection
+
+
+def release_connection(exception=None):
+    conn = g.pop("db_connection", None)
+    if conn is not None:
+        get_pool().putconn(conn)
@@ -0,0 +1,353 @@
+import io
+import os
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import common
+import executors
+import matplotlib
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import seaborn as sns
+from dotenv import dotenv_values
+from matplotlib.figure import Figure
+from scipy.cluster.hierarchy import dendrogram
+
+matplotlib.use("agg", force=True)
+
+sns.set_palette("pastel")
+
+config = dotenv_values(common.ENV_FILE)
+
+# Отрисовка графиков в отдельных процессах. Обработчик api описывает график
+# словарем (spec: вид графика, заголовок, размер, параметры) и передает таблицу
+# с данными. Таблица разбирается на массивы NumPy, крупные массивы передаются
+# через разделяемую память, а не сериализацией в канал. Процесс отрисовки
+# (matplotlib и seaborn импортируются при его запуске) возвращает байты PNG.
+# RENDER_WORKERS=0 — отрисовка в текущем процессе (удобно для отладки)
+
+workers = int(config.get("RENDER_WORKERS") or min(4, os.cpu_count() or 1))
+# Массивы меньше этого размера дешевле передать вместе со spec
+shared_memory_min_bytes = 64 * 2**10
+
+dpi = 200
+
+
+### Передача таблицы в процесс отрисовки ###
+
+
+# Колонки таблицы: числовые передаются как есть, строковые и категориальные —
+# кодами и списком значений (порядок значений сохраняется, от него зависит
+# порядок на графике)
+def pack_df(df):
+    columns = []
+    blocks = []
+    for name in df.columns:
+        column = df[name]
+        packed = {"name": name}
+
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            packed["categories"] = column.cat.categories.tolist()
+            packed["ordered"] = column.cat.ordered
+            values = column.cat.codes.to_numpy()
+        elif column.dtype == object or pd.api.types.is_string_dtype(column.dtype):
+            codes, uniques = pd.factorize(column)
+            packed["uniques"] = uniques.tolist()
+            values = codes
+        else:
+            values = column.to_numpy()
+
+        packed["dtype"] = values.dtype.str
+        packed["length"] = len(values)
+        # Массив объектов (например, nullable-колонки pandas) передается сериализацией
+        if values.dtype != object and values.nbytes >= shared_memory_min_bytes:
+            block = shared_memory.SharedMemory(create=True, size=values.nbytes)
+            np.ndarray(values.shape, values.dtype, buffer=block.buf)[:] = values
+            packed["shared_memory"] = block.name
+            blocks.append(block)
+        else:
+            packed["values"] = values
+        columns.append(packed)
+
+    return {"columns": columns, "columns_name": df.columns.name}, blocks
+
+
+def unpack_df(packed):
+    data = {}
+    for column in packed["columns"]:
+        if "shared_memory" in column:
+            block = shared_memory.SharedMemory(name=column["shared_memory"])
+            try:
+                view = np.ndarray(column["length"], column["dtype"], buffer=block.buf)
+                values = view.copy()
+                del view
+            finally:
+                block.close()
+        else:
+            values = column["values"]
+
+        if "categories" in column:
+            values = pd.Categorical.from_codes(
+                values, column["categories"], ordered=column["ordered"]
+            )
+        elif "uniques" in column:
+            # Код -1 (пропуск) указывает на добавленный в конец None
+            values = np.array(column["uniques"] + [None], dtype=object)[values]
+        data[column["name"]] = values
+
+    df = pd.DataFrame(data, columns=[column["name"] for column in packed["columns"]])
+    df.columns.name = packed["columns_name"]
+    return df
+
+
+def release_blocks(blocks):
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+### Отрисовка (выполняется в процессе отрисовки) ###
+
+
+# Пустая задача: процесс отрисовки при запуске импортирует этот модуль
+# (а с ним matplotlib и seaborn), после чего готов рисовать
+def warm_up():
+    pass
+
+
+def draw_hist(df, spec):
+    figure = Figure(figsize=spec["figsize"])
+    ax = figure.add_subplot(1, 1, 1)
+    ax.set_title(spec["title"])
+
+    sns.histplot(
+        df,
+        x=spec["x"],
+        bins=spec["bins"],
+        kde=spec["kde"],
+        ax=ax,
+    ).set(ylabel=spec["ylabel"])
+
+    return figure
+
+
+def draw_kde(df, spec):
+    figure = Figure(figsize=spec["figsize"])
+    ax = figure.add_subplot(1, 1, 1)
+    ax.set_title(spec["title"])
+
+    sns.kdeplot(df, ax=ax).set(ylabel=spec["ylabel"])
+
+    return figure
+
+
+def draw_box(df, spec):
+    figure = Figure(figsize=spec["figsize"])
+    ax = figure.add_subplot(1, 1, 1)
+    ax.set_title(spec["title"])
+
+    plot = sns.violinplot if spec["kind"] == "violin" else sns.boxplot
+    plot(data=df, x=spec["x"], y=spec["y"], ax=ax)
+
+    return figure
+
+
+def draw_scatter(df, spec):
+    figure = Figure(figsize=spec["figsize"])
+    ax = figure.add_subplot(1, 1, 1)
+    ax.set_title(spec["title"])
+
+    sns.scatterplot(
+        df,
+        x=spec["x"],
+        y=spec["y"],
+        ax=ax,
+        size=[1] * len(df),
+        sizes=(10, 10),
+        legend=False,
+    )
+
+    return figure
+
+
+def draw_hex(df, spec):
+    figure = sns.jointplot(
+        df,
+        x=spec["x"],
+        y=spec["y"],
+        kind="hex",
+        height=spec["height"],
+    ).figure
+    figure.suptitle(spec["title"], y=1)
+
+    return figure
+
+
+def draw_pairplot(df, spec):
+    figure = sns.pairplot(df, hue=spec["hue"], palette="pastel").figure
+    figure.suptitle(spec["title"], y=1)
+
+    return figure
+
+
+# Таблица с данными — матрица связей (linkage matrix) scipy
+def draw_dendrogram(df, spec):
+    figure = Figure(figsize=spec["figsize"])
+    ax = figure.add_subplot(1, 1, 1)
+    ax.set_xlabel(spec["xlabel"])
+
+    dendrogram(df.to_numpy(dtype="float64"), **spec["options"], ax=ax)
+
+    return figure
+
+
+# Таблица с данными — квадратная матрица, строки в том же порядке, что и колонки
+def draw_heatmap(df, spec):
+    figure = Figure(figsize=spec["figsize"])
+    ax = figure.add_subplot(1, 1, 1)
+    # Заголовок над всей фигурой: над осями его перекрывает шкала цветов
+    figure.suptitle(spec["title"])
+
+    sns.heatmap(
+        df.set_axis(df.columns, axis=0),
+        vmin=-1,
+        vmax=1,
+        cmap="vlag",
+        annot=spec["annot"],
+        fmt=".2f",
+        square=True,
+        ax=ax,
+    )
+    ax.set(xlabel="", ylabel="")
+    ax.tick_params(axis="y", labelrotation=0)
+
+    return figure
+
+
+drawers = {
+    "hist": draw_hist,
+    "kde": draw_kde,
+    "box": draw_box,
+    "violin": draw_box,
+    "scatter": draw_scatter,
+    "hex": draw_hex,
+    "pairplot": draw_pairplot,
+    "dendrogram": draw_dendrogram,
+    "heatmap": draw_heatmap,
+}
+
+
+def render_packed(spec, packed):
+    start = time.perf_counter()
+    df = unpack_df(packed)
+    figure = drawers[spec["kind"]](df, spec)
+    drawn = time.perf_counter()
+
+    # Свой буфер на каждый график: в нем только байты этого PNG
+    buffer = io.BytesIO()
+    try:
+        figure.savefig(buffer, format="png", bbox_inches="tight", dpi=dpi)
+    finally:
+        # jointplot и pairplot создают фигуру через pyplot, который держит ссылку
+        # на нее до явного закрытия; без этого процесс отрисовки копит фигуры
+        plt.close(figure)
+    encoded = time.perf_counter()
+
+    # В текущем процессе байты отдаются без копирования, из процесса отрисовки
+    # они все равно передаются сериализацией
+    png = buffer.getvalue() if workers else buffer.getbuffer()
+    return png, {"draw": drawn - start, "encode": encoded - drawn}
+
+
+### Пул процессов отрисовки ###
+
+
+executor_pool = executors.SpawnPool(workers, warm_up)
+
+
+class RenderStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.kinds = {}
+
+    def add(self, kind, total, timings):
+        with self._lock:
+            stats = self.kinds.setdefault(
+                kind,
+                {"count": 0, "total_time": 0.0, "max_time": 0.0, "draw_time": 0.0, "encode_time": 0.0},
+            )
+            stats["count"] += 1
+            stats["total_time"] += total
+            stats["max_time"] = max(stats["max_time"], total)
+            stats["draw_time"] += timings["draw"]
+            stats["encode_time"] += timings["encode"]
+
+    def get_stats(self):
+        with self._lock:
+            result = {}
+            for kind, stats in self.kinds.items():
+                stats = dict(stats)
+                # Время ожидания свободного процесса и передачи данных
+                stats["overhead_time"] = stats["total_time"] - stats["draw_time"] - stats["encode_time"]
+                result[kind] = stats
+            return {"workers": workers, "kinds": result}
+
+
+render_stats = RenderStats()
+
+
+# Ставит график в очередь на отрисовку. Возвращает Future с байтами PNG,
+# несколько графиков одного запроса рисуются параллельно
+def submit(spec, df):
+    start = time.perf_counter()
+    packed, blocks = pack_df(df)
+
+    future = Future()
+
+    def done(png, timings):
+        render_stats.add(spec["kind"], time.perf_counter() - start, timings)
+        future.set_result(png)
+
+    if workers == 0:
+        try:
+            done(*render_packed(spec, packed))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            release_blocks(blocks)
+        return future
+
+    executor = executor_pool.get_executor()
+
+    def on_complete(worker_future):
+        release_blocks(blocks)
+        try:
+            done(*worker_future.result())
+        except BrokenProcessPool as e:
+            executor_pool.reset_executor(executor)
+            future.set_exception(e)
+        except Exception as e:
+            future.set_exception(e)
+
+    try:
+        executor.submit(render_packed, spec, packed).add_done_callback(on_complete)
+    except BrokenProcessPool:
+        release_blocks(blocks)
+        executor_pool.reset_executor(executor)
+        raise
+    except Exception:
+        release_blocks(blocks)
+        raise
+    return future
+
+
+def render(spec, df):
+    return submit(spec, df).result()
+
+
+def get_stats():
+    return render_stats.get_stats()
@@ -0,0 +1,263 @@
+import time
+from concurrent.futures import TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import common
+import compute
+import numpy as np
+import pandas as pd
+import statsmodels.stats.multitest as multi
+from dotenv import dotenv_values
+
+import screening
+
+config = dotenv_values(common.ENV_FILE)
+
+# Непараметрическая проверка гипотез перестановками и бутстрепом (параметр
+# inference: "resampling" у /api/ttest, /api/mediantest и /api/oneway_anova).
+# Результаты анализов сильно скошены, и параметрические критерии на них неточны.
+# - Перестановочный p: значения всех выборок перемешиваются и делятся на выборки
+#   прежних размеров, p = (1 + число перестановок со статистикой не меньше
+#   наблюдаемой) / (1 + число перестановок).
+# - Бутстреп-интервал разности средних или медиан каждой выборки с первой:
+#   выборки независимо ресэмплируются с возвращением, границы — процентили.
+# Перестановки и ресэмплы пакетами задаются матрицами индексов (пакет × значения),
+# статистики считаются по строкам матрицы без цикла. Пакеты выполняются в пуле
+# процессов compute. Генератор каждого пакета определяется seed, номером задачи
+# и номером пакета, поэтому результат не зависит от того, какой процесс и в каком
+# порядке выполнил пакет. По истечении time_budget новые пакеты не ждут:
+# используются готовые пакеты (по порядку номеров), в ответе указано
+# достигнутое число ресэмплов
+
+default_resamples = int(config.get("RESAMPLING_COUNT") or 9999)
+default_time_budget = float(config.get("RESAMPLING_TIME_BUDGET") or 10)  # seconds
+# Размер матрицы индексов одного пакета (строк × значений)
+batch_elements = int(config.get("RESAMPLING_BATCH_ELEMENTS") or 2**21)
+
+statistic_names = {
+    "mean_difference": "Разность средних",
+    "median_difference": "Разность медиан",
+    "anova": "F (однофакторный дисперсионный анализ)",
+    "median_test": "Хи-квадрат (медианный критерий)",
+}
+
+
+### Статистики по строкам матриц ###
+
+
+# groups — матрицы (число ресэмплов × размер выборки), результат — по строкам
+def get_mean_difference(groups):
+    return groups[1].mean(axis=1) - groups[0].mean(axis=1)
+
+
+def get_median_difference(groups):
+    return np.median(groups[1], axis=1) - np.median(groups[0], axis=1)
+
+
+def get_group_arrays(groups):
+    count = np.array([[group.shape[1] for group in groups]], dtype="float64").repeat(len(groups[0]), axis=0)
+    mean = np.stack([group.mean(axis=1) for group in groups], axis=1)
+    return count, mean
+
+
+def get_anova(groups):
+    count, mean = get_group_arrays(groups)
+    m2 = np.stack([((group - mean[:, [i]]) ** 2).sum(axis=1) for i, group in enumerate(groups)], axis=1)
+    return screening.get_anova(count, mean, m2)[0]
+
+
+def get_median_test(groups):
+    count, _ = get_group_arrays(groups)
+    median = np.median(np.concatenate(groups, axis=1), axis=1)
+    above = np.stack([(group > median[:, None]).sum(axis=1) for group in groups], axis=1)
+    return screening.get_median_test(above, count)[0]
+
+
+statistics = {
+    "mean_difference": get_mean_difference,
+    "median_difference": get_median_difference,
+    "anova": get_anova,
+    "median_test": get_median_test,
+}
+# Для разностей p двусторонний, для F и хи-квадрат — односторонний
+two_sided = {"mean_difference", "median_difference"}
+
+
+def get_observed(groups, statistic):
+    return statistics[statistic]([group[None, :] for group in groups])[0]
+
+
+### Пакеты (выполняются в процессах пула) ###
+
+
+def split_columns(matrix, groups):
+    return np.split(matrix, np.cumsum([len(group) for group in groups])[:-1], axis=1)
+
+
+# Число перестановок, на которых статистика не меньше наблюдаемой
+def permutation_batch(groups, statistic, observed, size, seed):
+    rng = np.random.default_rng(seed)
+    pooled = np.tile(np.concatenate(groups), (size, 1))
+    rng.permuted(pooled, axis=1, out=pooled)
+
+    values = statistics[statistic](split_columns(pooled, groups))
+    if statistic in two_sided:
+        values, observed = np.abs(values), abs(observed)
+    # Допуск на ошибки округления: перестановка, совпадающая с исходным
+    # разбиением, должна засчитываться
+    return int((values >= observed - 1e-12 * max(abs(observed), 1)).sum())
+
+
+def bootstrap_batch(groups, statistic, size, seed):
+    rng = np.random.default_rng(seed)
+    samples = [group[rng.integers(0, len(group), (size, len(group)))] for group in groups]
+    return statistics[statistic](samples)
+
+
+def get_batch_sizes(resamples, values_count):
+    size = max(1, min(resamples, batch_elements // max(values_count, 1)))
+    sizes = [size] * (resamples // size)
+    if resamples % size:
+        sizes.append(resamples % size)
+    return sizes
+
+
+# jobs — список (функция пакета, аргументы до size и seed, число значений).
+# Пакеты всех задач чередуются (первые пакеты всех задач, затем вторые...), чтобы
+# при нехватке времени каждая задача получила сопоставимое число ресэмплов.
+# Возвращает для каждой задачи список результатов готовых пакетов и их размеры
+def run_jobs(jobs, resamples, seed, time_budget):
+    deadline = time.monotonic() + time_budget
+    batches = [get_batch_sizes(resamples, values_count) for _, _, values_count in jobs]
+    order = [
+        (job, batch)
+        for batch in range(max(len(sizes) for sizes in batches))
+        for job in range(len(jobs))
+        if batch < len(batches[job])
+    ]
+
+    def get_arguments(job, batch):
+        function, arguments, _ = jobs[job]
+        batch_seed = np.random.SeedSequence(seed, spawn_key=(job, batch))
+        return function, (*arguments, batches[job][batch], batch_seed)
+
+    results = [[] for _ in jobs]
+    sizes = [[] for _ in jobs]
+    # Задача прекращается на первом неготовом пакете: используются только пакеты
+    # подряд с начала, так что результат определяется их числом
+    stopped = [False] * len(jobs)
+
+    executor = compute.executor_pool.get_executor()
+    if executor is None:
+        for job, batch in order:
+            if batch > 0 and time.monotonic() > deadline:
+                break
+            function, arguments = get_arguments(job, batch)
+            results[job].append(function(*arguments))
+            sizes[job].append(batches[job][batch])
+        return results, sizes
+
+    futures = []
+    try:
+        for job, batch in order:
+            function, arguments = get_arguments(job, batch)
+            futures.append(executor.submit(function, *arguments))
+
+        for (job, batch), future in zip(order, futures):
+            if stopped[job]:
+                continue
+            # Первый пакет каждой задачи ждем без ограничения: без него нет оценки
+            timeout = None if batch == 0 else max(deadline - time.monotonic(), 0)
+            try:
+                results[job].append(future.result(timeout=timeout))
+                sizes[job].append(batches[job][batch])
+            except TimeoutError:
+                stopped[job] = True
+    except BrokenProcessPool:
+        compute.executor_pool.reset_executor(executor)
+        raise
+    finally:
+        for future in futures:
+            future.cancel()
+
+    return results, sizes
+
+
+### Сравнение выборок ###
+
+
+# items — список (название теста, массивы значений выборок), names — названия
+# выборок. differences — статистики для каждой выборки против первой (перестановочный
+# p и бутстреп-интервал), overall — статистика для всех выборок сразу (только p)
+def compare(items, names, differences, overall, threshold, resamples=None, seed=0, time_budget=None):
+    resamples = resamples or default_resamples
+    time_budget = time_budget or default_time_budget
+
+    rows = []
+    jobs = []
+    for row_name, groups in items:
+        groups = [np.asarray(group, dtype="float64") for group in groups]
+        groups = [group[~np.isnan(group)] for group in groups]
+        values_count = sum(len(group) for group in groups)
+
+        comparisons = []
+        if overall is not None and len(groups) > 2:
+            comparisons.append((", ".join(names), groups, overall, False))
+        for i in range(1, len(groups)):
+            pair = [groups[0], groups[i]]
+            for statistic in differences:
+                comparisons.append((f"{names[i]} − {names[0]}", pair, statistic, True))
+
+        for comparison, pair, statistic, interval in comparisons:
+            row = {
+                "row_name": row_name,
+                "comparison": comparison,
+                "statistic": statistic_names[statistic],
+                "stats": None,
+                "ci_low": None,
+                "ci_high": None,
+                "pvalue": None,
+                "resamples": 0,
+            }
+            rows.append(row)
+            if any(len(group) < 2 for group in pair):
+                continue
+
+            observed = get_observed(pair, statistic)
+            row["stats"] = observed
+            if np.isnan(observed):
+                continue
+            row["jobs"] = {"permutation": len(jobs)}
+            jobs.append((permutation_batch, (pair, statistic, observed), values_count))
+            if interval:
+                row["jobs"]["bootstrap"] = len(jobs)
+                jobs.append((bootstrap_batch, (pair, statistic), values_count))
+
+    results, sizes = run_jobs(jobs, resamples, seed, time_budget) if jobs else ([], [])
+
+    for row in rows:
+        row_jobs = row.pop("jobs", None)
+        if row_jobs is None:
+            continue
+        done = sum(sizes[row_jobs["permutation"]])
+        row["pvalue"] = (1 + sum(results[row_jobs["permutation"]])) / (1 + done)
+        row["resamples"] = done
+        if "bootstrap" in row_jobs:
+            values = np.concatenate(results[row_jobs["bootstrap"]])
+            values = values[~np.isnan(values)]
+            if len(values):
+                row["ci_low"], row["ci_high"] = np.quantile(values, [threshold / 2, 1 - threshold / 2])
+
+    res = pd.DataFrame(rows, columns=[
+        "row_name", "comparison", "statistic", "stats", "ci_low", "ci_high", "pvalue", "resamples",
+    ])
+    tested = res["pvalue"].notna().to_numpy()
+    res["qvalue"] = None
+    res["qvalue_null_h"] = None
+    if tested.any():
+        rejected, qvalues, _, _ = multi.multipletests(res.loc[tested, "pvalue"].astype(float), alpha=threshold)
+        res.loc[tested, "qvalue"] = qvalues
+        res.loc[tested, "qvalue_null_h"] = np.where(rejected, "отвергается", "не отвергается")
+
+    # NaN не сериализуется в JSON
+    return res.astype(object).where(res.notna(), None)
@@ -1,3 +1,6 @@
+import clustering
+import outliers
+
 sample = {
     "type": "object",
     "properties": {
@@ -43,6 +46,20 @@ test_ids = {
     "minItems": 1,
 }
 
+# Картинки в ответе: base64 (по умолчанию) или ссылки /api/images/<hash>.png
+image_format = {"enum": ["base64", "url"]}
+# Графики распределения и корреляции: картинка (по умолчанию) или данные для отрисовки на клиенте
+plot_output = {"enum": ["image", "data"]}
+# Метод поиска выбросов, порог — z_value (см. outliers.py)
+outlier_method = {"enum": outliers.methods}
+lof_neighbors = {"type": "integer", "minimum": 2, "maximum": 100}
+# Проверка гипотез: только параметрические критерии (по умолчанию) или еще
+# перестановки и бутстреп (см. resampling.py)
+inference = {"enum": ["parametric", "resampling"]}
+resamples = {"type": "integer", "minimum": 99, "maximum": 1000000}
+seed = {"type": "integer", "minimum": 0}
+time_budget = {"type": "number", "exclusiveMinimum": 0, "maximum": 300}  # seconds
+
 stats = {
     "type": "object",
     "properties": {
@@ -51,6 +68,10 @@ stats = {
         "group_by": {"enum": ["samples", "params"]},
         "calc_gender_stats": {"type": "boolean"},
         "calc_age_stats": {"type": "boolean"},
+        # Потоковый режим: выборки читаются фрагментами, память не зависит от их размера
+        "stream": {"type": "boolean"},
+        # Где считать статистики: в pandas (по умолчанию) или в PostgreSQL
+        "execution": {"enum": ["pandas", "sql"]},
     },
     "required": [
         "samples",
@@ -67,6 +88,10 @@ hist = {
         "sample": sample,
         "test_id": test_id,
         "z_value": {"type": "number"},
+        "outlier_method": outlier_method,
+        "lof_neighbors": lof_neighbors,
+        "image_format": image_format,
+        "output": plot_output,
         "bins": {"type": "integer"},
         "density": {"type": "boolean"},
     },
@@ -85,6 +110,10 @@ density = {
         "sample": sample,
         "test_id": test_id,
         "z_value": {"type": "number"},
+        "outlier_method": outlier_method,
+        "lof_neighbors": lof_neighbors,
+        "image_format": image_format,
+        "output": plot_output,
     },
     "required": [
         "sample",
@@ -99,6 +128,10 @@ box_violin = {
         "samples": samples,
         "test_id": test_id,
         "z_value": {"type": "number"},
+        "outlier_method": outlier_method,
+        "lof_neighbors": lof_neighbors,
+        "image_format": image_format,
+        "output": plot_output,
     },
     "required": [
         "samples",
@@ -114,6 +147,10 @@ scatter_hex = {
         "test_id1": test_id,
         "test_id2": test_id,
         "z_value": {"type": "number"},
+        "outlier_method": outlier_method,
+        "lof_neighbors": lof_neighbors,
+        "image_format": image_format,
+        "output": plot_output,
     },
     "required": [
         "sample",
@@ -170,6 +207,10 @@ ttest2 = {
         "sample2": sample,
         "test_ids": test_ids,
         "threshold": threshold,
+        "inference": inference,
+        "resamples": resamples,
+        "seed": seed,
+        "time_budget": time_budget,
     },
     "required": [
         "ttest_type",
@@ -186,6 +227,10 @@ mediantest = {
         "samples": samples,
         "test_id": test_id,
         "threshold": threshold,
+        "inference": inference,
+        "resamples": resamples,
+        "seed": seed,
+        "time_budget": time_budget,
     },
     "required": [
         "samples",
@@ -200,6 +245,10 @@ oneway_anova = {
         "samples": samples,
         "test_ids": test_ids,
         "threshold": threshold,
+        "inference": inference,
+        "resamples": resamples,
+        "seed": seed,
+        "time_budget": time_budget,
     },
     "required": [
         "samples",
@@ -208,14 +257,48 @@ oneway_anova = {
     ],
 }
 
+correlation = {
+    "type": "object",
+    "properties": {
+        "sample": sample,
+        "test_ids": {"type": "array", "items": test_id, "minItems": 2},
+        "method": {"enum": ["pearson", "spearman"]},
+        "threshold": threshold,
+        "image_format": image_format,
+        "output": plot_output,
+    },
+    "required": [
+        "sample",
+        "test_ids",
+        "threshold",
+    ],
+}
+
+screening = {
+    "type": "object",
+    "properties": {
+        "samples": samples,
+        "test_ids": test_ids,
+        "threshold": threshold,
+        "fdr_method": {"enum": ["fdr_bh", "fdr_by"]},
+    },
+    "required": [
+        "samples",
+        "threshold",
+    ],
+}
+
 kmeans = {
     "type": "object",
     "properties": {
         "samples": samples,
         "test_ids": test_ids,
         "cluster_count": {"type": "integer"},
-        "dist_metric": {"type": "string"},
+        "dist_metric": {"enum": clustering.metrics},
         "z_value": {"type": "number"},
+        "outlier_method": outlier_method,
+        "lof_neighbors": lof_neighbors,
+        "image_format": image_format,
     },
     "required": [
         "samples",
@@ -233,6 +316,9 @@ hierarchy = {
         "test_ids": test_ids,
         "cluster_count": {"type": "integer"},
         "z_value": {"type": "number"},
+        "outlier_method": outlier_method,
+        "lof_neighbors": lof_neighbors,
+        "image_format": image_format,
     },
     "required": [
         "samples",
@@ -0,0 +1,187 @@
+import numpy as np
+import pandas as pd
+import statsmodels.stats.multitest as multi
+from scipy import stats as scipy_stats
+
+# Скрининг гипотез сразу по многим тестам и выборкам (/api/screening). Вместо
+# отдельного запроса и сводной таблицы на каждый тест статистики считаются по
+# длинной таблице результатов одним проходом: значения группируются по паре
+# (тест, выборка) через np.bincount, критерии вычисляются из сумм групп сразу
+# для всех тестов. Первая выборка — опорная:
+# - t-критерий Уэлча и r Пирсона (точечно-бисериальный: значение теста против
+#   принадлежности к выборке) — каждая выборка против опорной;
+# - F однофакторного дисперсионного анализа и медианный критерий Муда — все
+#   выборки вместе.
+# Поправка на множественные сравнения (FDR) применяется один раз ко всем
+# полученным p-значениям. Результаты совпадают с scipy.stats.ttest_ind
+# (equal_var=False), pearsonr, f_oneway и median_test для каждого теста отдельно
+
+criteria = {
+    "welch": "t-критерий Уэлча",
+    "pearson": "r Пирсона",
+    "anova": "Однофакторный дисперсионный анализ",
+    "median": "Медианный критерий",
+}
+
+
+# Суммы по группам: число значений, среднее, сумма квадратов отклонений от среднего
+def get_group_moments(values, groups, group_count):
+    count = np.bincount(groups, minlength=group_count).astype("float64")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.bincount(groups, weights=values, minlength=group_count) / count
+    m2 = np.bincount(groups, weights=(values - mean[groups]) ** 2, minlength=group_count)
+    return count, mean, m2
+
+
+# Медиана значений каждого теста: значения сортируются по (тест, значение) один раз
+def get_test_medians(values, tests, test_count):
+    order = np.lexsort((values, tests))
+    sorted_values = values[order]
+    count = np.bincount(tests, minlength=test_count)
+    starts = np.r_[0, np.cumsum(count)[:-1]]
+
+    medians = np.full(test_count, np.nan)
+    present = count > 0
+    low = starts[present] + (count[present] - 1) // 2
+    high = starts[present] + count[present] // 2
+    medians[present] = (sorted_values[low] + sorted_values[high]) / 2
+    return medians
+
+
+# Выборка против опорной (индексы [:, 0] — опорная, [:, 1:] — остальные)
+def get_pairwise(count, mean, m2):
+    n0, n1 = count[:, :1], count[:, 1:]
+    mean0, mean1 = mean[:, :1], mean[:, 1:]
+    ss0, ss1 = m2[:, :1], m2[:, 1:]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Уэлч: дисперсии групп не предполагаются равными
+        var0, var1 = ss0 / (n0 - 1), ss1 / (n1 - 1)
+        se0, se1 = var0 / n0, var1 / n1
+        welch_t = (mean1 - mean0) / np.sqrt(se0 + se1)
+        welch_df = (se0 + se1) ** 2 / (se0**2 / (n0 - 1) + se1**2 / (n1 - 1))
+        welch_p = 2 * scipy_stats.t.sf(np.abs(welch_t), welch_df)
+
+        # Точечно-бисериальный r: корреляция значения с индикатором выборки
+        n = n0 + n1
+        delta = mean1 - mean0
+        ss_total = ss0 + ss1 + delta**2 * n0 * n1 / n
+        r = delta * np.sqrt(n0 * n1 / n) / np.sqrt(ss_total)
+        r = np.clip(r, -1, 1)
+        r_df = n - 2
+        r_t = r * np.sqrt(r_df / (1 - r**2))
+        r_p = 2 * scipy_stats.t.sf(np.abs(r_t), r_df)
+
+    valid = (n0 >= 2) & (n1 >= 2)
+    welch_t, welch_p = np.where(valid, welch_t, np.nan), np.where(valid, welch_p, np.nan)
+    r, r_p = np.where(valid, r, np.nan), np.where(valid, r_p, np.nan)
+    return welch_t, welch_p, r, r_p
+
+
+# Однофакторный дисперсионный анализ по выборкам, в которых есть значения теста
+def get_anova(count, mean, m2):
+    present = count > 0
+    groups = present.sum(axis=1)
+    n = count.sum(axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        grand_mean = np.nansum(np.where(present, count * mean, 0), axis=1) / n
+        ss_between = np.nansum(np.where(present, count * (mean - grand_mean[:, None]) ** 2, 0), axis=1)
+        ss_within = m2.sum(axis=1)
+        df_between, df_within = groups - 1, n - groups
+        f = (ss_between / df_between) / (ss_within / df_within)
+        p = scipy_stats.f.sf(f, df_between, df_within)
+
+    valid = (groups >= 2) & (df_within > 0)
+    return np.where(valid, f, np.nan), np.where(valid, p, np.nan)
+
+
+# Медианный критерий Муда (как scipy median_test с ties="below"): таблица
+# "выше / не выше общей медианы × выборка", хи-квадрат с поправкой Йейтса
+# при одной степени свободы
+def get_median_test(above, count):
+    below = count - above
+    observed = np.stack([above, below], axis=1)  # тесты × 2 × выборки
+    present = count > 0
+    observed = np.where(present[:, None, :], observed, 0)
+
+    n = observed.sum(axis=(1, 2))
+    row_totals = observed.sum(axis=2)
+    column_totals = observed.sum(axis=1)
+    groups = present.sum(axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        expected = row_totals[:, :, None] * column_totals[:, None, :] / n[:, None, None]
+        dof = groups - 1
+        diff = expected - observed
+        correction = np.where((dof == 1)[:, None, None], np.minimum(0.5, np.abs(diff)), 0)
+        corrected = observed + correction * np.sign(diff)
+        terms = np.where(present[:, None, :], (corrected - expected) ** 2 / expected, 0)
+        chi = terms.sum(axis=(1, 2))
+        p = scipy_stats.chi2.sf(chi, dof)
+
+    valid = (groups >= 2) & (row_totals > 0).all(axis=1)
+    return np.where(valid, chi, np.nan), np.where(valid, p, np.nan)
+
+
+# dfs — длинные таблицы выборок (result, test_id, test_name), первая — опорная.
+# Возвращает таблицу "тест × выборка × критерий", упорядоченную по q-значению
+def screen(dfs, sample_names, threshold, fdr_method="fdr_bh"):
+    sample_count = len(dfs)
+    df = pd.concat(
+        [sample_df[["test_id", "test_name", "result"]].assign(sample=i) for i, sample_df in enumerate(dfs)],
+        ignore_index=True,
+    )
+    df = df[df["result"].notna()]
+
+    tests, test_ids = pd.factorize(df["test_id"], sort=True)
+    test_names = df.groupby("test_id", observed=True)["test_name"].first().reindex(test_ids).astype(str).to_numpy()
+    test_count = len(test_ids)
+    values = df["result"].to_numpy(dtype="float64")
+    samples = df["sample"].to_numpy()
+    groups = tests * sample_count + samples
+
+    shape = (test_count, sample_count)
+    count, mean, m2 = (moment.reshape(shape) for moment in get_group_moments(values, groups, test_count * sample_count))
+
+    medians = get_test_medians(values, tests, test_count)
+    above = np.bincount(groups, weights=values > medians[tests], minlength=test_count * sample_count).reshape(shape)
+
+    welch_t, welch_p, r, r_p = get_pairwise(count, mean, m2)
+    anova_f, anova_p = get_anova(count, mean, m2)
+    median_chi, median_p = get_median_test(above, count)
+
+    compared = np.array(sample_names[1:], dtype=object)
+    all_samples = ", ".join(sample_names)
+    parts = [
+        ("welch", np.repeat(test_names, sample_count - 1), np.tile(compared, test_count), welch_t, welch_p),
+        ("pearson", np.repeat(test_names, sample_count - 1), np.tile(compared, test_count), r, r_p),
+        ("anova", test_names, np.full(test_count, all_samples), anova_f, anova_p),
+        ("median", test_names, np.full(test_count, all_samples), median_chi, median_p),
+    ]
+    res = pd.concat([
+        pd.DataFrame({
+            "test_name": names,
+            "sample_name": compared_names,
+            "criterion": criteria[criterion],
+            "stats": np.ravel(stats),
+            "pvalue": np.ravel(pvalues),
+        })
+        for criterion, names, compared_names, stats, pvalues in parts
+    ], ignore_index=True)
+
+    # Тесты, для которых критерий неприменим (мало значений), в семейство не входят
+    tested = res["pvalue"].notna().to_numpy()
+    res["pvalue_null_h"] = np.where(res["pvalue"] > threshold, "не отвергается", "отвергается")
+    res.loc[~tested, "pvalue_null_h"] = None
+    res["qvalue"] = np.nan
+    res["qvalue_null_h"] = None
+    if tested.any():
+        rejected, qvalues, _, _ = multi.multipletests(res.loc[tested, "pvalue"], alpha=threshold, method=fdr_method)
+        res.loc[tested, "qvalue"] = qvalues
+        res.loc[tested, "qvalue_null_h"] = np.where(rejected, "отвергается", "не отвергается")
+
+    res = res.sort_values(["qvalue", "pvalue"], kind="stable", na_position="last").reset_index(drop=True)
+    res.insert(0, "rank", np.arange(1, len(res) + 1))
+    # NaN не сериализуется в JSON
+    return res.astype(object).where(res.notna(), None)
@@ -0,0 +1,97 @@
+import re
+import threading
+import time
+import weakref
+
+# Реестр подготовленных выражений (PREPARE). Текст запроса регистрируется один раз,
+# на каждом соединении выражение подготавливается при первом использовании,
+# дальше выполняется по имени (EXECUTE) без повторного разбора запроса.
+# Параметры в тексте записываются как в psycopg2: %(name)s
+
+placeholder_pattern = re.compile(r"%\((\w+)\)s")
+
+
+class Statement:
+    def __init__(self, name, query):
+        self.name = name
+        # Текст для обычного выполнения
+        self.query = query
+
+        self.param_names = list(dict.fromkeys(placeholder_pattern.findall(query)))
+        positions = {param: i + 1 for i, param in enumerate(self.param_names)}
+
+        body = query.strip().rstrip(";")
+        # В тексте PREPARE знак % не экранируется, а параметры становятся $1, $2, ...
+        body = placeholder_pattern.sub(lambda m: f"${positions[m.group(1)]}", body)
+        body = body.replace("%%", "%")
+        self.prepare_query = f"PREPARE {name} AS {body};"
+
+        args = ", ".join(f"%({param})s" for param in self.param_names)
+        self.execute_query = f"EXECUTE {name}({args});" if args else f"EXECUTE {name};"
+
+        self.prepares = 0
+        self.executions = 0
+        self.prepare_time = 0.0
+        self.execute_time = 0.0
+
+
+registry = {}
+_registry_lock = threading.Lock()
+
+# Имена выражений, уже подготовленных на соединении. Подготовленные выражения
+# живут до закрытия соединения и не отменяются откатом транзакции
+_prepared = weakref.WeakKeyDictionary()
+_prepared_lock = threading.Lock()
+
+
+def register(name, query):
+    with _registry_lock:
+        if name not in registry:
+            registry[name] = Statement(name, query)
+        return registry[name]
+
+
+def get_prepared(connection):
+    with _prepared_lock:
+        return _prepared.setdefault(connection, set())
+
+
+def prepare(cursor, statement):
+    prepared = get_prepared(cursor.connection)
+    if statement.name in prepared:
+        return
+
+    start = time.perf_counter()
+    cursor.execute(statement.prepare_query)
+    statement.prepare_time += time.perf_counter() - start
+    statement.prepares += 1
+    prepared.add(statement.name)
+
+
+# Выполняет выражение из реестра по имени, строка запроса выполняется как обычно
+def execute(cursor, statement, params=None):
+    if isinstance(statement, str):
+        cursor.execute(statement, params)
+        return
+
+    prepare(cursor, statement)
+
+    start = time.perf_counter()
+    cursor.execute(statement.execute_query, params)
+    statement.execute_time += time.perf_counter() - start
+    statement.executions += 1
+
+
+def get_stats():
+    with _registry_lock:
+        statements = list(registry.values())
+
+    return {
+        statement.name: {
+            "prepares": statement.prepares,
+            "executions": statement.executions,
+            "prepare_time": statement.prepare_time,
+            "execute_time": statement.execute_time,
+        }
+        for statement in statements
+    }